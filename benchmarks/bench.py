@@ -0,0 +1,264 @@
+'''
+Benchmark suite for the public bioseq entry points.
+
+Generates synthetic DNA and protein inputs from a fixed seed, times each function at several input sizes and records peak memory.
+Results are written as JSON and can be compared against a stored baseline, failing when a benchmark slows down by more than a threshold.
+
+Usage:
+    python benchmarks/bench.py --scale small --output results.json
+    python benchmarks/bench.py --scale medium --baseline baseline.json --threshold 0.25
+    python benchmarks/bench.py --only translate,findORFs
+
+Scales are cumulative, 'medium' also runs the 'small' sizes. DNA inputs range from 1 kb to 100 Mb and protein sets from 10 to 50k sequences.
+Import benchmarks time a fresh interpreter importing the package, their size is always 1 and their peak memory is only that of the benchmark process.
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bioseq.fasta import readFASTA, readFASTAseq, writeFASTA, writeFASTArecords
+from bioseq.translation import translate
+from bioseq.orf import candidateProtein, findORFs, scanORFs
+from bioseq.alignment import simple_align, global_align, local_align
+from bioseq.scoring import Scoring
+from bioseq.composition import AAtypes, compositionProfile
+from bioseq.distance import distanceArray, distanceMatrix
+from bioseq.kmerindex import KmerIndex
+from bioseq.screening import alignment_scores
+from bioseq.msa import progressive_align
+from bioseq.neighbours import NeighbourIndex
+
+SEED = 20240101
+SCALES = ['small', 'medium', 'large']
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def random_dna(length, seed=SEED):
+    '''
+    Returns a reproducible random DNA string.
+    '''
+    rng = np.random.default_rng(seed)
+    return np.frombuffer(b'ACGT', dtype=np.uint8)[rng.integers(0, 4, length)].tobytes().decode('ascii')
+
+
+def random_protein(length, seed=SEED):
+    '''
+    Returns a reproducible random protein string.
+    '''
+    rng = np.random.default_rng(seed)
+    alphabet = np.frombuffer(AMINO_ACIDS.encode('ascii'), dtype=np.uint8)
+    return alphabet[rng.integers(0, len(alphabet), length)].tobytes().decode('ascii')
+
+
+def random_proteins(count, seed=SEED):
+    '''
+    Returns a reproducible list of random proteins of 50 to 500 residues.
+    '''
+    rng = np.random.default_rng(seed)
+    return [random_protein(int(length), seed + n) for n, length in enumerate(rng.integers(50, 500, count))]
+
+
+def mutate(sequence, rate=0.05, seed=SEED):
+    '''
+    Returns a copy of a protein with a fraction of residues substituted, used to build related pairs for alignment.
+    '''
+    rng = np.random.default_rng(seed)
+    residues = np.frombuffer(sequence.encode('ascii'), dtype=np.uint8).copy()
+    changed = rng.random(len(residues)) < rate
+    alphabet = np.frombuffer(AMINO_ACIDS.encode('ascii'), dtype=np.uint8)
+    residues[changed] = alphabet[rng.integers(0, len(alphabet), int(changed.sum()))]
+    return residues.tobytes().decode('ascii')
+
+
+def fasta_file(directory, name, records):
+    '''
+    Writes (description, sequence) records to a fasta file in directory and returns its path.
+    '''
+    path = os.path.join(directory, name)
+    with open(path, 'wt') as OUTF:
+        for description, sequence in records:
+            OUTF.write('>' + description + '\n')
+            for pos in range(0, len(sequence), 60):
+                OUTF.write(sequence[pos:pos + 60] + '\n')
+    return path
+
+
+def python_code(code):
+    '''
+    Returns a function running code in a fresh python interpreter, used to time imports which are cached after the first one.
+    '''
+    environment = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    return lambda: subprocess.run([sys.executable, '-c', code], env=environment, check=True)
+
+
+def profile_table(directory, count):
+    '''
+    Writes an AAtypetable style csv of count random profiles and returns its path.
+    '''
+    rng = np.random.default_rng(SEED)
+    path = os.path.join(directory, f'profiles_{count}.csv')
+    with open(path, 'wt') as OUTF:
+        OUTF.write('#Filename,Polar,Small,Hydrophobic\n')
+        for n, values in enumerate(rng.random((count, 3)).round(3)):
+            OUTF.write(f'protein{n},' + ','.join(str(value) for value in values) + '\n')
+    return path
+
+
+# Benchmarks as (name, {scale: sizes}, setup). setup(size, directory) returns a function of no arguments which runs the benchmark once.
+BENCHMARKS = [
+    ('import python', {'small': [1]}, lambda size, directory: python_code('pass')),
+    ('import bioseq', {'small': [1]}, lambda size, directory: python_code('import bioseq')),
+    ('import translate', {'small': [1]}, lambda size, directory: python_code('from bioseq import translate')),
+    ('import Scoring', {'small': [1]}, lambda size, directory: python_code("from bioseq import Scoring; Scoring('BLOSUM62')")),
+    ('readFASTAseq', {'small': [1000, 100000], 'medium': [10000000], 'large': [100000000]},
+     lambda size, directory: (lambda path: lambda: readFASTAseq(path))(fasta_file(directory, f'dna_{size}.fasta', [('dna', random_dna(size))]))),
+    ('readFASTA', {'small': [10, 1000], 'medium': [10000], 'large': [50000]},
+     lambda size, directory: (lambda path: lambda: sum(1 for _ in readFASTA(path)))(
+         fasta_file(directory, f'proteins_{size}.fasta', [(f'p{n}', seq) for n, seq in enumerate(random_proteins(size))]))),
+    ('writeFASTA', {'small': [1000, 100000], 'medium': [10000000], 'large': [100000000]},
+     lambda size, directory: (lambda seq: lambda: writeFASTA(seq, 'dna', os.path.join(directory, 'out.fasta')))(random_dna(size))),
+    ('writeFASTArecords', {'small': [10, 1000], 'medium': [10000], 'large': [50000]},
+     lambda size, directory: (lambda records: lambda: writeFASTArecords(records, os.path.join(directory, 'out.fasta.gz'), 'gzip', background=True))(
+         [(f'p{n}', seq) for n, seq in enumerate(random_proteins(size))])),
+    ('translate', {'small': [1000, 100000], 'medium': [1000000, 10000000], 'large': [100000000]},
+     lambda size, directory: (lambda seq: lambda: translate(seq))(random_dna(size))),
+    ('findORFs', {'small': [1000, 100000], 'medium': [1000000, 10000000], 'large': [100000000]},
+     lambda size, directory: (lambda seq: lambda: sum(1 for _ in findORFs(seq, minlength=30)))(random_dna(size))),
+    ('scanORFs', {'small': [100000], 'medium': [10000000], 'large': [100000000]},
+     lambda size, directory: (lambda path: lambda: sum(1 for _ in scanORFs(path, minlength=30)))(
+         fasta_file(directory, f'genome_{size}.fasta', [('genome', random_dna(size))]))),
+    ('candidateProtein', {'small': [1000, 100000], 'medium': [1000000, 10000000], 'large': [100000000]},
+     lambda size, directory: (lambda seq: lambda: candidateProtein(seq))(random_dna(size))),
+    ('simple_align', {'small': [100, 1000], 'medium': [10000], 'large': [100000]},
+     lambda size, directory: (lambda seq, scoring: lambda: simple_align((seq, mutate(seq)), scoring))(random_protein(size), Scoring('BLOSUM62'))),
+    ('global_align', {'small': [100], 'medium': [500], 'large': [2000]},
+     lambda size, directory: (lambda seq, scoring: lambda: global_align((seq, mutate(seq)), scoring, -11, -1))(random_protein(size), Scoring('BLOSUM62'))),
+    ('local_align', {'small': [100], 'medium': [500], 'large': [2000]},
+     lambda size, directory: (lambda seq, scoring: lambda: local_align((seq, mutate(seq)), scoring, -11, -1))(random_protein(size), Scoring('BLOSUM62'))),
+    ('alignment_scores', {'small': [100], 'medium': [1000], 'large': [10000]},
+     lambda size, directory: (lambda query, targets, scoring: lambda: alignment_scores(query, targets, scoring, -11, -1))(
+         random_protein(300), random_proteins(size), Scoring('BLOSUM62'))),
+    ('progressive_align', {'small': [20], 'medium': [200], 'large': [1000]},
+     lambda size, directory: (lambda records, scoring: lambda: progressive_align(records, scoring))(
+         [(f'p{n}', mutate(random_protein(300), 0.2, SEED + n)) for n in range(size)], Scoring('BLOSUM62'))),
+    ('KmerIndex.search', {'small': [1000], 'medium': [10000], 'large': [50000]},
+     lambda size, directory: (lambda index, queries: lambda: [index.search(query) for query in queries])(
+         KmerIndex.build([(f'p{n}', seq) for n, seq in enumerate(random_proteins(size))], os.path.join(directory, f'index_{size}')),
+         [mutate(seq) for seq in random_proteins(100, seed=SEED + 1)])),
+    ('AAtypes', {'small': [1000, 100000], 'medium': [1000000], 'large': [10000000]},
+     lambda size, directory: (lambda seq: lambda: AAtypes(seq))(random_protein(size))),
+    ('compositionProfile', {'small': [10, 1000], 'medium': [10000], 'large': [50000]},
+     lambda size, directory: (lambda seqs: lambda: compositionProfile(seqs, k=2))(random_proteins(size))),
+    ('distanceMatrix', {'small': [10, 100], 'medium': [1000], 'large': [5000]},
+     lambda size, directory: (lambda path: lambda: distanceMatrix(path, os.path.join(directory, 'matrix'), 'l1'))(profile_table(directory, size))),
+    ('distanceArray', {'small': [100, 1000], 'medium': [10000], 'large': [50000]},
+     lambda size, directory: (lambda profiles: lambda: distanceArray(profiles, 'l1', out=np.empty((size, size), dtype=np.float32)))(
+         np.random.default_rng(SEED).random((size, 3)))),
+    ('NeighbourIndex.query', {'small': [1000, 10000], 'medium': [100000], 'large': [1000000]},
+     lambda size, directory: (lambda profiles: lambda: NeighbourIndex(profiles, 'l1').query(k=10))(np.random.default_rng(SEED).random((size, 3)))),
+]
+
+
+def measure(function, repeat):
+    '''
+    Runs a benchmark repeat times and returns the best wall time in seconds and the peak memory in bytes allocated during one run.
+    Peak memory is measured with tracemalloc on a separate run, since tracing slows the code down.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(times), peak
+
+
+def run(scale, repeat, only=None):
+    '''
+    Runs every benchmark up to the given scale and returns the results as a dictionary.
+    '''
+    scales = SCALES[:SCALES.index(scale) + 1]
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, sizes, setup in BENCHMARKS:
+            if only and name not in only:
+                continue
+            for size in [size for level in scales for size in sizes.get(level, [])]:
+                function = setup(size, directory)
+                seconds, peak = measure(function, repeat)
+                results.append({'name': name, 'size': size, 'seconds': seconds, 'peak_bytes': peak})
+                print(f'{name:<20} {size:>12} {seconds:>12.6f} s {peak / 1e6:>12.2f} MB', flush=True)
+
+    return {'scale': scale,
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'results': results}
+
+
+def compare(results, baseline, threshold):
+    '''
+    Compares results against a baseline and returns a list of regressions, benchmarks whose time or peak memory grew by more than threshold (0.2 = 20%).
+    '''
+    previous = {(entry['name'], entry['size']): entry for entry in baseline['results']}
+    regressions = []
+    for entry in results['results']:
+        old = previous.get((entry['name'], entry['size']))
+        if old is None:
+            continue
+        for field in ['seconds', 'peak_bytes']:
+            if old[field] > 0 and entry[field] > old[field] * (1 + threshold):
+                regressions.append(f"{entry['name']} size {entry['size']}: {field} {old[field]:.6g} -> {entry[field]:.6g} "
+                                   f"(+{(entry[field] / old[field] - 1) * 100:.1f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the public bioseq entry points.')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='largest input scale to run (default: small)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark, the best is kept (default: 3)')
+    parser.add_argument('--only', help='comma separated benchmark names to run')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against results previously written with --output')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown before a regression is reported (default: 0.2)')
+    args = parser.parse_args(argv)
+
+    only = set(args.only.split(',')) if args.only else None
+    results = run(args.scale, args.repeat, only)
+
+    if args.output:
+        with open(args.output, 'wt') as OUTF:
+            json.dump(results, OUTF, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'rt') as INFILE:
+            baseline = json.load(INFILE)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
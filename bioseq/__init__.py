@@ -1,9 +1,40 @@
 """
 bioseq: lightweight utilities for genomic and proteomic sequence analysis
+
+Submodules are imported the first time one of their names is used, so 'import bioseq' does not load NumPy or Biopython
+and a job only pays for the modules it uses.
 """
+import importlib
+
+# Public names of the package and the submodule defining each of them
+_EXPORTS = {
+    'PackedDNA': 'packed',
+    'readFASTAseq': 'fasta', 'writeFASTA': 'fasta', 'readFASTA': 'fasta', 'FASTAIndex': 'fasta',
+    'FASTAWriter': 'fasta', 'writeFASTArecords': 'fasta', 'readFASTAchunks': 'fasta', 'recordName': 'fasta',
+    'candidateProtein': 'orf', 'maximalORF': 'orf', 'findORFs': 'orf',
+    'findORFsChunked': 'orf', 'scanORFs': 'orf',
+    'translate': 'translation',
+    'simple_align': 'alignment', 'seeded_simple_align': 'alignment', 'global_align': 'alignment',
+    'local_align': 'alignment', 'banded_align': 'alignment', 'anchored_align': 'alignment',
+    'Scoring': 'scoring',
+    'alignment_scores': 'screening', 'screen': 'screening',
+    'KmerIndex': 'kmerindex',
+    'progressive_align': 'msa', 'guide_tree': 'msa',
+    'NeighbourIndex': 'neighbours',
+    'ResultCache': 'cache',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    # Importing the submodule of a public name on first use, the name is then cached in the package namespace
+    if name not in _EXPORTS:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    value = getattr(importlib.import_module('.' + _EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
 
-from .fasta import readFASTAseq, writeFASTA
-from .orf import candidateProtein, maximalORF
-from .translation import translate
-from .alignment import simple_align, seeded_simple_align
-from .scoring import Scoring
\ No newline at end of file
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,5 +1,9 @@
 import re
 
+from bioseq.profiling import instrument, sequence_pair_argument
+
+
+@instrument('alignment.simple_align', sequence_pair_argument)
 def simple_align(sequences, scoring, gap=-1):
     '''
     Performs an alignment between 2 sequences using a one step look ahead algorithm.
@@ -102,6 +106,7 @@ def simple_align(sequences, scoring, gap=-1):
     return result
 
 
+@instrument('alignment.seeded_simple_align', sequence_pair_argument)
 def seeded_simple_align(sequences, scoring, seed, gap=-1):
     '''
     Performs a seeded alignment between 2 sequences using a one step look ahead algorithm.
@@ -160,3 +165,692 @@ def seeded_simple_align(sequences, scoring, seed, gap=-1):
     final_result = seed[0] + result[0], seed[1] + result[1], (result[2] + seed_score)
 
     return final_result
+
+
+@instrument('alignment.global_align', sequence_pair_argument)
+def global_align(sequences, scoring, gap_open=-1, gap_extend=-1, linear=False):
+    '''
+    Performs an optimal global alignment between 2 sequences using the Needleman-Wunsch algorithm with affine gap penalties (Gotoh).
+    Input is a tuple containing two sequences to be aligned in the form of a string and a Scoring object.
+    A gap of length k scores gap_open + (k - 1) * gap_extend, so the defaults of -1 give the same linear gap penalty as simple_align.
+    Values such as gap_open=-11 and gap_extend=-1 are common with BLOSUM62.
+
+    By default the full dynamic programming matrices are kept for the traceback, which needs memory proportional to the product of the sequence lengths.
+    With linear=True the alignment is recovered with the Myers-Miller (Hirschberg) divide and conquer algorithm, which needs memory proportional to the sequence lengths at about twice the run time.
+    Both modes return an optimal alignment with the same score.
+
+    Input sequences are converted to uppercase for usage in scoring but original casing is returned in displayed alignment.
+    Output is a tuple of (aligned sequence 1, aligned sequence 2, alignment score), the same as simple_align.
+    '''
+    # Encoding sequences as residue codes which index the compiled score table
+    a = bytes(scoring.encode(sequences[0].upper()))
+    b = bytes(scoring.encode(sequences[1].upper()))
+
+    if linear:
+        ops = []
+        _myers_miller(a, b, scoring.table, gap_open, gap_extend, ops)
+        score = _ops_score(ops, a, b, scoring.table, gap_open, gap_extend)
+    else:
+        ops, score, _, _ = _gotoh(a, b, scoring.table, gap_open, gap_extend, local=False)
+
+    return _render(ops, sequences[0], sequences[1]) + (score,)
+
+
+@instrument('alignment.local_align', sequence_pair_argument)
+def local_align(sequences, scoring, gap_open=-1, gap_extend=-1, linear=False):
+    '''
+    Performs an optimal local alignment between 2 sequences using the Smith-Waterman algorithm with affine gap penalties (Gotoh).
+    Only the highest scoring pair of subsequences is returned, if no pair scores above 0 the aligned sequences are empty strings.
+    Gap penalties and the linear memory mode work as in global_align. In linear mode the end of the best local alignment is found with one pass,
+    its start with a second pass over the reversed prefixes, and the region between them is aligned with the Myers-Miller algorithm.
+
+    Input sequences are converted to uppercase for usage in scoring but original casing is returned in displayed alignment.
+    Output is a tuple of (aligned sequence 1, aligned sequence 2, alignment score), the same as simple_align.
+    '''
+    # Encoding sequences as residue codes which index the compiled score table
+    a = bytes(scoring.encode(sequences[0].upper()))
+    b = bytes(scoring.encode(sequences[1].upper()))
+
+    if linear:
+        # Finding where the best local alignment ends
+        score, i_end, j_end = _best_cell(a, b, scoring.table, gap_open, gap_extend, anchored=False)
+        if score <= 0:
+            return ('', '', 0)
+
+        # Finding where it starts by aligning the reversed prefixes from their first characters
+        _, length_i, length_j = _best_cell(a[:i_end][::-1], b[:j_end][::-1], scoring.table, gap_open, gap_extend, anchored=True)
+        i_start = i_end - length_i
+        j_start = j_end - length_j
+
+        ops = []
+        _myers_miller(a[i_start:i_end], b[j_start:j_end], scoring.table, gap_open, gap_extend, ops)
+        score = _ops_score(ops, a[i_start:i_end], b[j_start:j_end], scoring.table, gap_open, gap_extend)
+    else:
+        ops, score, i_start, j_start = _gotoh(a, b, scoring.table, gap_open, gap_extend, local=True)
+        if not ops:
+            return ('', '', 0)
+
+    return _render(ops, sequences[0][i_start:], sequences[1][j_start:]) + (score,)
+
+
+@instrument('alignment.banded_align', sequence_pair_argument)
+def banded_align(sequences, scoring, band=16, gap_open=-1, gap_extend=-1):
+    '''
+    Performs a global alignment with affine gaps where only a band of diagonals around the main diagonal is filled.
+    The band covers every diagonal within band positions of the diagonals joining the start and the end of both sequences,
+    so run time and memory are proportional to the sequence length times the band width instead of the product of the lengths.
+    The result is the optimal alignment that stays inside the band, which is the optimal alignment whenever the sequences need no more than band net insertions or deletions at any point.
+    Gap penalties work as in global_align.
+
+    Input sequences are converted to uppercase for usage in scoring but original casing is returned in displayed alignment.
+    Output is a tuple of (aligned sequence 1, aligned sequence 2, alignment score), the same as simple_align.
+    '''
+    a = bytes(scoring.encode(sequences[0].upper()))
+    b = bytes(scoring.encode(sequences[1].upper()))
+
+    ops = _banded_gotoh(a, b, scoring.table, gap_open, gap_extend, band)
+    score = _ops_score(ops, a, b, scoring.table, gap_open, gap_extend)
+
+    return _render(ops, sequences[0], sequences[1]) + (score,)
+
+
+@instrument('alignment.anchored_align', sequence_pair_argument)
+def anchored_align(sequences, scoring, k=8, band=16, gap_open=-1, gap_extend=-1, max_occurrences=32):
+    '''
+    Performs a global alignment of two closely related sequences by chaining exact matches into anchors and filling the regions between anchors with banded_align.
+    Shared k-mers of length k are found with a hash index of the second sequence and extended into maximal exact matches along their diagonal.
+    The highest scoring chain of non overlapping matches that appear in the same order in both sequences is kept as anchors.
+    k-mers found more than max_occurrences times in the second sequence are ignored, so repeats do not flood the seeding stage.
+
+    Only the regions between anchors are aligned by dynamic programming, so the cost is close to linear for near identical sequences.
+    The result is near optimal but not guaranteed optimal, use global_align when an exact optimum is required.
+    Choose k so that random matches are rare, for example around 5 for proteins and 12 or more for DNA.
+
+    Input sequences are converted to uppercase for usage in scoring but original casing is returned in displayed alignment.
+    Output is a tuple of (aligned sequence 1, aligned sequence 2, alignment score), the same as simple_align.
+    '''
+    a = bytes(scoring.encode(sequences[0].upper()))
+    b = bytes(scoring.encode(sequences[1].upper()))
+
+    anchors = _chain_anchors(_find_anchors(a, b, k, max_occurrences))
+
+    # Aligning the regions before, between and after the anchors and adding anchors as matches
+    ops = []
+    i = 0
+    j = 0
+    for anchor_i, anchor_j, length in anchors + [(len(a), len(b), 0)]:
+        ops.extend(_banded_gotoh(a[i:anchor_i], b[j:anchor_j], scoring.table, gap_open, gap_extend, band))
+        ops.extend('M' * length)
+        i = anchor_i + length
+        j = anchor_j + length
+
+    score = _ops_score(ops, a, b, scoring.table, gap_open, gap_extend)
+
+    return _render(ops, sequences[0], sequences[1]) + (score,)
+
+
+# Alignment operations used by the dynamic programming aligners.
+# 'M' aligns a character of each sequence, 'D' aligns a character of the first sequence to a gap and 'I' a character of the second sequence to a gap.
+_NEG = float('-inf')
+
+
+def _render(ops, seq1, seq2):
+    '''
+    Builds the aligned sequences described by a list of alignment operations, starting at the beginning of seq1 and seq2.
+    '''
+    aln1 = []
+    aln2 = []
+    i = 0
+    j = 0
+    for op in ops:
+        if op == 'M':
+            aln1.append(seq1[i])
+            aln2.append(seq2[j])
+            i += 1
+            j += 1
+        elif op == 'D':
+            aln1.append(seq1[i])
+            aln2.append('-')
+            i += 1
+        else:
+            aln1.append('-')
+            aln2.append(seq2[j])
+            j += 1
+    return (''.join(aln1), ''.join(aln2))
+
+
+def _ops_score(ops, a, b, table, gap_open, gap_extend):
+    '''
+    Scores the alignment described by a list of alignment operations with affine gap penalties.
+    '''
+    score = 0
+    i = 0
+    j = 0
+    previous = 'M'
+    for op in ops:
+        if op == 'M':
+            score += table[a[i]][b[j]]
+            i += 1
+            j += 1
+        else:
+            score += gap_extend if op == previous else gap_open
+            if op == 'D':
+                i += 1
+            else:
+                j += 1
+        previous = op
+    return score
+
+
+def _gotoh(a, b, table, gap_open, gap_extend, local):
+    '''
+    Fills the three affine gap dynamic programming matrices and traces back the optimal alignment.
+    M holds the best score of alignments ending with a[i] aligned to b[j], X ending with a[i] aligned to a gap and Y ending with b[j] aligned to a gap.
+    a and b are encoded sequences and table the compiled score table of a Scoring object.
+    Returns the list of alignment operations, the score and the start positions of the alignment in a and b.
+    '''
+    n = len(a)
+    m = len(b)
+
+    # Score and traceback matrices. Traceback values are the previous state, 0=M, 1=X, 2=Y and 3 for the start of a local alignment
+    M = [[_NEG] * (m + 1) for _ in range(n + 1)]
+    X = [[_NEG] * (m + 1) for _ in range(n + 1)]
+    Y = [[_NEG] * (m + 1) for _ in range(n + 1)]
+    PM = [bytearray(m + 1) for _ in range(n + 1)]
+    PX = [bytearray(m + 1) for _ in range(n + 1)]
+    PY = [bytearray(m + 1) for _ in range(n + 1)]
+
+    M[0][0] = 0
+    if not local:
+        # Global alignments may begin with a gap in either sequence
+        for i in range(1, n + 1):
+            X[i][0] = gap_open + (i - 1) * gap_extend
+            PX[i][0] = 1 if i > 1 else 0
+        for j in range(1, m + 1):
+            Y[0][j] = gap_open + (j - 1) * gap_extend
+            PY[0][j] = 2 if j > 1 else 0
+
+    best = 0
+    best_i = 0
+    best_j = 0
+
+    for i in range(1, n + 1):
+        scores = table[a[i - 1]]
+        M_prev, X_prev, Y_prev = M[i - 1], X[i - 1], Y[i - 1]
+        M_row, X_row, Y_row = M[i], X[i], Y[i]
+        PM_row, PX_row, PY_row = PM[i], PX[i], PY[i]
+
+        for j in range(1, m + 1):
+            # Alignment ending with a match, ties are won by matches, then X then Y
+            diag = M_prev[j - 1]
+            state = 0
+            if X_prev[j - 1] > diag:
+                diag = X_prev[j - 1]
+                state = 1
+            if Y_prev[j - 1] > diag:
+                diag = Y_prev[j - 1]
+                state = 2
+            if local and diag <= 0:
+                diag = 0
+                state = 3
+            M_row[j] = diag + scores[b[j - 1]]
+            PM_row[j] = state
+
+            # Alignment ending with a[i] aligned to a gap
+            up = M_prev[j] + gap_open
+            state = 0
+            if X_prev[j] + gap_extend > up:
+                up = X_prev[j] + gap_extend
+                state = 1
+            if Y_prev[j] + gap_open > up:
+                up = Y_prev[j] + gap_open
+                state = 2
+            X_row[j] = up
+            PX_row[j] = state
+
+            # Alignment ending with b[j] aligned to a gap
+            left = M_row[j - 1] + gap_open
+            state = 0
+            if X_row[j - 1] + gap_open > left:
+                left = X_row[j - 1] + gap_open
+                state = 1
+            if Y_row[j - 1] + gap_extend > left:
+                left = Y_row[j - 1] + gap_extend
+                state = 2
+            Y_row[j] = left
+            PY_row[j] = state
+
+            if local and M_row[j] > best:
+                best = M_row[j]
+                best_i = i
+                best_j = j
+
+    # Choosing where the traceback begins
+    if local:
+        if best <= 0:
+            return [], 0, 0, 0
+        i, j, state = best_i, best_j, 0
+        score = best
+    else:
+        i, j = n, m
+        score, state = M[n][m], 0
+        if X[n][m] > score:
+            score, state = X[n][m], 1
+        if Y[n][m] > score:
+            score, state = Y[n][m], 2
+
+    # Tracing back through the matrices
+    ops = []
+    while i > 0 or j > 0:
+        if state == 0:
+            ops.append('M')
+            state = PM[i][j]
+            i -= 1
+            j -= 1
+            if state == 3:
+                break
+        elif state == 1:
+            ops.append('D')
+            state = PX[i][j]
+            i -= 1
+        else:
+            ops.append('I')
+            state = PY[i][j]
+            j -= 1
+    ops.reverse()
+
+    return ops, score, i, j
+
+
+def _best_cell(a, b, table, gap_open, gap_extend, anchored):
+    '''
+    Finds the highest scoring cell of an affine gap alignment matrix using memory proportional to the length of b.
+    With anchored=False alignments may start anywhere (Smith-Waterman), with anchored=True they must start at the beginning of both sequences.
+    Returns the best score and the number of characters of a and b the alignment ending there has consumed.
+    '''
+    m = len(b)
+
+    # Previous row of each matrix, see _gotoh
+    M_row = [_NEG] * (m + 1)
+    X_row = [_NEG] * (m + 1)
+    Y_row = [_NEG] * (m + 1)
+    M_row[0] = 0
+    if anchored:
+        for j in range(1, m + 1):
+            Y_row[j] = gap_open + (j - 1) * gap_extend
+
+    best = 0 if not anchored else _NEG
+    best_i = 0
+    best_j = 0
+    for j in range(m + 1):
+        cell = max(M_row[j], X_row[j], Y_row[j])
+        if cell > best:
+            best = cell
+            best_j = j
+
+    for i in range(1, len(a) + 1):
+        scores = table[a[i - 1]]
+        M_prev, X_prev, Y_prev = M_row, X_row, Y_row
+        M_row = [_NEG] * (m + 1)
+        X_row = [_NEG] * (m + 1)
+        Y_row = [_NEG] * (m + 1)
+        if anchored:
+            X_row[0] = gap_open + (i - 1) * gap_extend
+
+        for j in range(1, m + 1):
+            diag = max(M_prev[j - 1], X_prev[j - 1], Y_prev[j - 1])
+            if not anchored and diag < 0:
+                diag = 0
+            M_row[j] = diag + scores[b[j - 1]]
+            X_row[j] = max(M_prev[j] + gap_open, X_prev[j] + gap_extend, Y_prev[j] + gap_open)
+            Y_row[j] = max(M_row[j - 1] + gap_open, X_row[j - 1] + gap_open, Y_row[j - 1] + gap_extend)
+
+        for j in range(m + 1):
+            cell = max(M_row[j], X_row[j], Y_row[j])
+            if cell > best:
+                best = cell
+                best_i = i
+                best_j = j
+
+    return best, best_i, best_j
+
+
+def _mm_forward(a, b, table, gap_open, gap_extend, start):
+    '''
+    Forward pass of the Myers-Miller algorithm, the three matrices of _gotoh kept one row at a time.
+    Returns three lists with the best scores of aligning all of a with each prefix of b, ending with a match (M), a deletion (X) or an insertion (Y).
+    start is the state (0=M, 1=X, 2=Y) the alignment continues from, a gap of the same type as start extends it instead of opening a new one.
+    '''
+    n = len(b)
+    rows = [[_NEG] * (n + 1) for _ in range(3)]
+    rows[start][0] = 0
+    M_row, X_row, Y_row = rows
+
+    # First row, b aligned to a gap
+    for j in range(1, n + 1):
+        Y_row[j] = max(M_row[j - 1] + gap_open, X_row[j - 1] + gap_open, Y_row[j - 1] + gap_extend)
+
+    for ai in a:
+        scores = table[ai]
+        diag_M, diag_X, diag_Y = M_row[0], X_row[0], Y_row[0]
+        X_row[0] = max(M_row[0] + gap_open, X_row[0] + gap_extend, Y_row[0] + gap_open)
+        M_row[0] = _NEG
+        Y_row[0] = _NEG
+        for j in range(1, n + 1):
+            up_M, up_X, up_Y = M_row[j], X_row[j], Y_row[j]
+            M_row[j] = max(diag_M, diag_X, diag_Y) + scores[b[j - 1]]
+            X_row[j] = max(up_M + gap_open, up_X + gap_extend, up_Y + gap_open)
+            Y_row[j] = max(M_row[j - 1] + gap_open, X_row[j - 1] + gap_open, Y_row[j - 1] + gap_extend)
+            diag_M, diag_X, diag_Y = up_M, up_X, up_Y
+
+    return M_row, X_row, Y_row
+
+
+def _mm_reverse(a, b, table, gap_open, gap_extend, end):
+    '''
+    Reverse pass of the Myers-Miller algorithm, computed from the end of both sequences one row at a time.
+    Returns three lists with the best scores of aligning all of a with each suffix of b (entry j for b[j:]), when the alignment continues from
+    a match (M), a deletion (X) or an insertion (Y). end is the state the alignment must finish in, or None for any state.
+    '''
+    n = len(b)
+    # Last row, the remaining characters of b aligned to a gap
+    M_row = [_NEG] * (n + 1)
+    X_row = [_NEG] * (n + 1)
+    Y_row = [_NEG] * (n + 1)
+    M_row[n] = 0 if end in (None, 0) else _NEG
+    X_row[n] = 0 if end in (None, 1) else _NEG
+    Y_row[n] = 0 if end in (None, 2) else _NEG
+    for j in range(n - 1, -1, -1):
+        y = Y_row[j + 1]
+        M_row[j] = gap_open + y
+        X_row[j] = gap_open + y
+        Y_row[j] = gap_extend + y
+
+    for ai in reversed(a):
+        scores = table[ai]
+        down_M, down_X, down_Y = M_row, X_row, Y_row
+        M_row = [_NEG] * (n + 1)
+        X_row = [_NEG] * (n + 1)
+        Y_row = [_NEG] * (n + 1)
+        x = down_X[n]
+        M_row[n] = gap_open + x
+        X_row[n] = gap_extend + x
+        Y_row[n] = gap_open + x
+        for j in range(n - 1, -1, -1):
+            match = down_M[j + 1] + scores[b[j]]
+            x = down_X[j]
+            y = Y_row[j + 1]
+            M_row[j] = max(match, gap_open + x, gap_open + y)
+            X_row[j] = max(match, gap_extend + x, gap_open + y)
+            Y_row[j] = max(match, gap_open + x, gap_extend + y)
+
+    return M_row, X_row, Y_row
+
+
+def _run_score(previous, state, length, gap_open, gap_extend):
+    # Score of a gap of length characters of the given state following an operation in state previous
+    if length == 0:
+        return 0
+    return (gap_extend if previous == state else gap_open) + (length - 1) * gap_extend
+
+
+def _myers_miller(a, b, table, gap_open, gap_extend, ops, start=0, end=None):
+    '''
+    Appends to ops an optimal global alignment of a and b with affine gaps, using memory proportional to the sequence lengths (Myers and Miller, 1988).
+    The first sequence is split in half, the column and state where the optimal alignment crosses the middle row are found from a forward and a reverse pass,
+    and both halves are aligned recursively, the second one continuing from the state the first one ends in.
+    Alignments follow the three states of _gotoh (0=M, 1=X for deletions, 2=Y for insertions), so a gap never directly follows a gap of the same type
+    and scores are the same as _gotoh for any gap penalties, including gap_extend below gap_open.
+    start is the state the alignment continues from and end the state it must finish in, None for any state.
+    '''
+    n_a = len(a)
+    n_b = len(b)
+
+    if n_a == 0:
+        ops.extend('I' * n_b)
+        return
+
+    if n_a == 1:
+        # The character of a is either matched to one character of b or aligned to a gap, with the rest of b inserted around it
+        best = _NEG
+        choice = None
+        for k in range(n_b + 1):
+            before = _run_score(start, 2, k, gap_open, gap_extend)
+            previous = 2 if k > 0 else start
+            after = n_b - k
+            if after > 0:
+                score = before + table[a[0]][b[k]] + _run_score(0, 2, after - 1, gap_open, gap_extend)
+                last = 2 if after > 1 else 0
+                if end in (None, last) and score > best:
+                    best, choice = score, (k, 'M')
+            score = before + (gap_extend if previous == 1 else gap_open) + _run_score(1, 2, after, gap_open, gap_extend)
+            last = 2 if after > 0 else 1
+            if end in (None, last) and score > best:
+                best, choice = score, (k, 'D')
+
+        k, op = choice
+        ops.extend('I' * k)
+        ops.append(op)
+        ops.extend('I' * (n_b - k - (op == 'M')))
+        return
+
+    # Scores of the top half against each prefix of b, ending in each state, and of the bottom half against each suffix of b, continuing from each state
+    mid = n_a // 2
+    forward = _mm_forward(a[:mid], b, table, gap_open, gap_extend, start)
+    reverse = _mm_reverse(a[mid:], b, table, gap_open, gap_extend, end)
+
+    # Finding the best crossing column and the state of the alignment there
+    best = _NEG
+    best_j = 0
+    best_state = 0
+    for j in range(n_b + 1):
+        for state in range(3):
+            score = forward[state][j] + reverse[state][j]
+            if score > best:
+                best, best_j, best_state = score, j, state
+
+    _myers_miller(a[:mid], b[:best_j], table, gap_open, gap_extend, ops, start, best_state)
+    _myers_miller(a[mid:], b[best_j:], table, gap_open, gap_extend, ops, best_state, end)
+
+
+def _banded_gotoh(a, b, table, gap_open, gap_extend, band):
+    '''
+    Global affine gap alignment of a and b filling only the diagonals j - i between min(0, m - n) - band and max(0, m - n) + band.
+    Rows are stored by diagonal, cell (i, j) is at position j - i - low of row i, so memory is proportional to n times the band width.
+    Matrices and traceback values are the same as in _gotoh. Returns the list of alignment operations.
+    '''
+    n = len(a)
+    m = len(b)
+    if band < 0:
+        raise ValueError('band must not be negative')
+
+    low = min(0, m - n) - band
+    high = max(0, m - n) + band
+    width = high - low + 1
+
+    M = [[_NEG] * width for _ in range(n + 1)]
+    X = [[_NEG] * width for _ in range(n + 1)]
+    Y = [[_NEG] * width for _ in range(n + 1)]
+    PM = [bytearray(width) for _ in range(n + 1)]
+    PX = [bytearray(width) for _ in range(n + 1)]
+    PY = [bytearray(width) for _ in range(n + 1)]
+
+    # First row, b aligned to a gap
+    M[0][-low] = 0
+    for j in range(1, min(m, high) + 1):
+        Y[0][j - low] = gap_open + (j - 1) * gap_extend
+        PY[0][j - low] = 2 if j > 1 else 0
+
+    for i in range(1, n + 1):
+        scores = table[a[i - 1]]
+        M_prev, X_prev, Y_prev = M[i - 1], X[i - 1], Y[i - 1]
+        M_row, X_row, Y_row = M[i], X[i], Y[i]
+        PM_row, PX_row, PY_row = PM[i], PX[i], PY[i]
+
+        # First column, a aligned to a gap
+        if i + low <= 0:
+            X_row[-i - low] = gap_open + (i - 1) * gap_extend
+            PX_row[-i - low] = 1 if i > 1 else 0
+
+        for j in range(max(1, i + low), min(m, i + high) + 1):
+            d = j - i - low
+
+            # Diagonal neighbour is at the same position of the previous row, the upper neighbour one position to the right
+            diag = M_prev[d]
+            state = 0
+            if X_prev[d] > diag:
+                diag = X_prev[d]
+                state = 1
+            if Y_prev[d] > diag:
+                diag = Y_prev[d]
+                state = 2
+            M_row[d] = diag + scores[b[j - 1]]
+            PM_row[d] = state
+
+            up = _NEG
+            state = 0
+            if d + 1 < width:
+                up = M_prev[d + 1] + gap_open
+                if X_prev[d + 1] + gap_extend > up:
+                    up = X_prev[d + 1] + gap_extend
+                    state = 1
+                if Y_prev[d + 1] + gap_open > up:
+                    up = Y_prev[d + 1] + gap_open
+                    state = 2
+            X_row[d] = up
+            PX_row[d] = state
+
+            left = _NEG
+            state = 0
+            if d > 0:
+                left = M_row[d - 1] + gap_open
+                if X_row[d - 1] + gap_open > left:
+                    left = X_row[d - 1] + gap_open
+                    state = 1
+                if Y_row[d - 1] + gap_extend > left:
+                    left = Y_row[d - 1] + gap_extend
+                    state = 2
+            Y_row[d] = left
+            PY_row[d] = state
+
+    # Tracing back from the end of both sequences
+    i, j = n, m
+    d = m - n - low
+    score, state = M[n][d], 0
+    if X[n][d] > score:
+        score, state = X[n][d], 1
+    if Y[n][d] > score:
+        score, state = Y[n][d], 2
+
+    ops = []
+    while i > 0 or j > 0:
+        d = j - i - low
+        if state == 0:
+            ops.append('M')
+            state = PM[i][d]
+            i -= 1
+            j -= 1
+        elif state == 1:
+            ops.append('D')
+            state = PX[i][d]
+            i -= 1
+        else:
+            ops.append('I')
+            state = PY[i][d]
+            j -= 1
+    ops.reverse()
+
+    return ops
+
+
+def _find_anchors(a, b, k, max_occurrences):
+    '''
+    Finds maximal exact matches of at least k characters between a and b, seeded by shared k-mers.
+    Returns a list of (i, j, length) tuples, matches on the same diagonal are reported once.
+    '''
+    if k < 1:
+        raise ValueError('k must be at least 1')
+
+    # Index of the positions of every k-mer of b
+    positions = {}
+    for j in range(len(b) - k + 1):
+        positions.setdefault(b[j:j + k], []).append(j)
+
+    anchors = []
+    covered = {}  # end of the last match found on each diagonal
+    for i in range(len(a) - k + 1):
+        hits = positions.get(a[i:i + k])
+        if hits is None or len(hits) > max_occurrences:
+            continue
+        for j in hits:
+            diagonal = i - j
+            if covered.get(diagonal, -1) > i:
+                continue
+
+            # Extending the seed along its diagonal
+            length = k
+            while i + length < len(a) and j + length < len(b) and a[i + length] == b[j + length]:
+                length += 1
+            anchors.append((i, j, length))
+            covered[diagonal] = i + length
+
+    return anchors
+
+
+def _chain_anchors(anchors):
+    '''
+    Selects the chain of anchors with the largest total length where each anchor ends before the next one starts in both sequences.
+    Anchors are swept in order of their start in the first sequence, and a Fenwick tree over their end in the second sequence
+    gives the best chain that can be extended, so the chaining takes O(n log n) time.
+    Returns the chain as a list of (i, j, length) tuples in order.
+    '''
+    if not anchors:
+        return []
+
+    anchors = sorted(anchors)
+    by_end = sorted(range(len(anchors)), key=lambda n: anchors[n][0] + anchors[n][2])
+
+    # Fenwick tree of (best chain score, anchor) over positions in the second sequence
+    size = max(j + length for _, j, length in anchors) + 1
+    tree = [(0, -1)] * (size + 1)
+
+    def update(position, value):
+        position += 1
+        while position <= size:
+            if value > tree[position]:
+                tree[position] = value
+            position += position & -position
+
+    def query(position):
+        # Best chain among anchors ending at or before position
+        best = (0, -1)
+        position += 1
+        while position > 0:
+            if tree[position] > best:
+                best = tree[position]
+            position -= position & -position
+        return best
+
+    scores = [0] * len(anchors)
+    previous = [-1] * len(anchors)
+    added = 0
+    for n, (i, j, length) in enumerate(anchors):
+        # Adding anchors that end before this one starts in the first sequence
+        while added < len(by_end) and anchors[by_end[added]][0] + anchors[by_end[added]][2] <= i:
+            m = by_end[added]
+            update(anchors[m][1] + anchors[m][2], (scores[m], m))
+            added += 1
+
+        best, best_anchor = query(j)
+        scores[n] = best + length
+        previous[n] = best_anchor
+
+    # Following the best chain backwards
+    n = max(range(len(anchors)), key=lambda n: scores[n])
+    chain = []
+    while n != -1:
+        chain.append(anchors[n])
+        n = previous[n]
+    chain.reverse()
+
+    return chain
@@ -0,0 +1,152 @@
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from bioseq.alignment import simple_align, global_align, local_align, banded_align, anchored_align
+from bioseq.fasta import readFASTA
+
+# Aligners that can be selected by name
+ALIGNERS = {'simple': simple_align, 'global': global_align, 'local': local_align,
+            'banded': banded_align, 'anchored': anchored_align}
+
+# Settings of each worker process, set once by _init_worker so the Scoring object is only sent to a worker once
+_worker = {}
+
+
+def _init_worker(scoring, aligner, options):
+    '''
+    Stores the Scoring object, aligner and its options in a worker process.
+    '''
+    _worker['scoring'] = scoring
+    _worker['aligner'] = aligner
+    _worker['options'] = options
+
+
+def _align_chunk(chunk):
+    '''
+    Aligns a chunk of (key, (seq1, seq2)) tasks in a worker process and returns a list of (key, result).
+    '''
+    aligner = _worker['aligner']
+    scoring = _worker['scoring']
+    options = _worker['options']
+    return [(key, aligner(pair, scoring, **options)) for key, pair in chunk]
+
+
+def _get_aligner(method):
+    '''
+    Returns the aligner for a method name in ALIGNERS, or the method itself if it is a function.
+    Functions must be defined at module level so they can be sent to worker processes.
+    '''
+    if callable(method):
+        return method
+    if method not in ALIGNERS:
+        raise ValueError(f"Unknown method '{method}'. Please select one of {list(ALIGNERS)}")
+    return ALIGNERS[method]
+
+
+def _run(tasks, scoring, method, processes, chunksize, ordered, options):
+    '''
+    Aligns an iterable of (key, (seq1, seq2)) tasks and yields (key, result) tuples.
+    Tasks are grouped into chunks and spread over a pool of worker processes. At most a few chunks per worker are in flight at a time,
+    so the tasks are read lazily and memory use does not grow with the number of tasks.
+    With ordered=True results are yielded in the order of the tasks, otherwise as soon as their chunk completes.
+    '''
+    aligner = _get_aligner(method)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if chunksize < 1:
+        raise ValueError('chunksize must be at least 1')
+
+    tasks = iter(tasks)
+
+    # Aligning in this process when only one process is requested
+    if processes <= 1:
+        for key, pair in tasks:
+            yield key, aligner(pair, scoring, **options)
+        return
+
+    max_pending = processes * 4
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(scoring, aligner, options)) as executor:
+        pending = deque()
+
+        def submit():
+            # Submitting the next chunk of tasks, returns False once the tasks are exhausted
+            chunk = list(itertools.islice(tasks, chunksize))
+            if not chunk:
+                return False
+            pending.append(executor.submit(_align_chunk, chunk))
+            return True
+
+        exhausted = False
+        while len(pending) < max_pending and not exhausted:
+            exhausted = not submit()
+
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done = [future for future in pending if future in finished]
+                for future in done:
+                    pending.remove(future)
+
+            for future in done:
+                yield from future.result()
+
+            while len(pending) < max_pending and not exhausted:
+                exhausted = not submit()
+
+
+def batch_align(pairs, scoring, method='global', processes=None, chunksize=16, ordered=True, **options):
+    '''
+    Aligns many pairs of sequences across a pool of worker processes.
+    This is a generator yielding (index, (aln1, aln2, score)) tuples, where index is the position of the pair in the input.
+    Input is an iterable of tuples containing two sequences, as accepted by simple_align, and a Scoring object.
+
+    method is a name in ALIGNERS ('simple', 'global', 'local', 'banded' or 'anchored'), or an aligner function defined at module level. Other keyword arguments, such as gap_open or linear, are passed on to the aligner.
+    processes is the number of worker processes, the default is one per CPU. With processes=1 pairs are aligned in this process.
+    Pairs are sent to workers in chunks of chunksize pairs, the Scoring object is sent to each worker once.
+    With ordered=True results are yielded in input order, with ordered=False as soon as they complete.
+    '''
+    return _run(enumerate(pairs), scoring, method, processes, chunksize, ordered, options)
+
+
+def all_vs_all(records, scoring, method='global', processes=None, chunksize=16, ordered=True, **options):
+    '''
+    Aligns every pair of sequences in a collection once, across a pool of worker processes.
+    records is either the filename of a fasta file or an iterable of (name, sequence) tuples.
+    This is a generator yielding (name1, name2, (aln1, aln2, score)) tuples for every pair with name1 before name2 in the input.
+    Other arguments are the same as batch_align.
+    '''
+    if isinstance(records, str):
+        records = readFASTA(records)
+    records = list(records)
+
+    tasks = (((name1, name2), (seq1, seq2))
+             for (name1, seq1), (name2, seq2) in itertools.combinations(records, 2))
+
+    for (name1, name2), result in _run(tasks, scoring, method, processes, chunksize, ordered, options):
+        yield name1, name2, result
+
+
+def database_align(queries, database, scoring, method='local', processes=None, chunksize=16, ordered=True, **options):
+    '''
+    Aligns a set of query sequences against every sequence of a fasta database, across a pool of worker processes.
+    queries is either the filename of a fasta file or an iterable of (name, sequence) tuples, and is held in memory.
+    database is the filename of a fasta file, which is read one record at a time.
+    This is a generator yielding (query name, database name, (aln1, aln2, score)) tuples. In order mode results follow the database,
+    every query is aligned against the first database record before moving to the next.
+    Other arguments are the same as batch_align, the default method is 'local'.
+    '''
+    if isinstance(queries, str):
+        queries = readFASTA(queries)
+    queries = list(queries)
+
+    tasks = (((query_name, target_name), (query, target))
+             for target_name, target in readFASTA(database)
+             for query_name, query in queries)
+
+    for (query_name, target_name), result in _run(tasks, scoring, method, processes, chunksize, ordered, options):
+        yield query_name, target_name, result
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+from bioseq.translation import translate
+from bioseq.orf import candidateProtein
+
+
+# Number of bases hashed at a time by sequence_digest
+DIGEST_CHUNK = 1 << 20
+
+
+def sequence_digest(dnaseq):
+    '''
+    Returns a hex digest of the content of a DNA sequence (string or PackedDNA), used as cache key.
+    Sequences are upper cased first, as translate and candidateProtein do, so 'atg' and 'ATG' share a key, and a PackedDNA sequence has the same key as its string.
+    The sequence is hashed DIGEST_CHUNK bases at a time, PackedDNA sequences from views of that size, so it is never copied or decoded as a whole.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    for start in range(0, len(dnaseq), DIGEST_CHUNK):
+        digest.update(str(dnaseq[start:start + DIGEST_CHUNK]).upper().encode('ascii', 'replace'))
+    return digest.hexdigest()
+
+
+def _copy(result):
+    # Returning copies of cached dictionaries (the frames of translate) so callers cannot modify the cached result
+    return dict(result) if isinstance(result, dict) else result
+
+
+class ResultCache:
+    '''
+    Class caches the results of translate and candidateProtein, keyed by a digest of the sequence content (see sequence_digest).
+    Results are kept in memory in a least recently used cache of at most maxsize results.
+    If path is given, results are also stored on disk in that directory, one pickle file per result, so they are shared between processes and survive between runs.
+    Hit and miss counts are available from stats().
+
+    Methods:
+    'translate(dnaseq)' returns translate(dnaseq), from the cache when possible.
+    'candidateProtein(dnaseq)' returns candidateProtein(dnaseq), from the cache when possible. Sequences without ORFs raise IndexError every time.
+    'stats()' returns a dictionary of hits, disk_hits, misses, size and hit_rate.
+    'clear()' empties the memory cache, and the disk store with disk=True.
+    '''
+
+    def __init__(self, maxsize=1024, path=None):
+        if maxsize < 0:
+            raise ValueError('maxsize must not be negative')
+        self.maxsize = maxsize
+        self.path = path
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def translate(self, dnaseq, engine='numpy'):
+        return self._get('translate', dnaseq, lambda: translate(dnaseq, engine))
+
+    def candidateProtein(self, dnaseq, starts=('ATG',)):
+        # Results of sequences without ORFs are cached as None and raise the same IndexError as candidateProtein
+        def compute():
+            try:
+                return candidateProtein(dnaseq, starts)
+            except IndexError:
+                return None
+
+        result = self._get('candidateProtein:' + ','.join(starts), dnaseq, compute)
+        if result is None:
+            raise IndexError('No open reading frames found')
+        return result
+
+    def _get(self, function, dnaseq, compute):
+        '''
+        Returns the cached result of function for dnaseq, looking in memory then on disk, or computes and stores it.
+        '''
+        key = function + ':' + sequence_digest(dnaseq)
+
+        # Memory cache
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return _copy(self._memory[key])
+
+        # Disk store
+        if self.path is not None:
+            try:
+                with open(self._file(key), 'rb') as INFILE:
+                    result = pickle.load(INFILE)
+                self.disk_hits += 1
+                self._remember(key, result)
+                return _copy(result)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+
+        self.misses += 1
+        result = compute()
+        self._remember(key, result)
+
+        if self.path is not None:
+            # Writing to a temporary file and renaming it so other processes never read a partial file
+            handle, temporary = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(handle, 'wb') as OUTF:
+                pickle.dump(result, OUTF, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self._file(key))
+
+        return _copy(result)
+
+    def _remember(self, key, result):
+        '''
+        Adds a result to the memory cache, removing the least recently used results beyond maxsize.
+        '''
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _file(self, key):
+        return os.path.join(self.path, key.replace(':', '_').replace(',', '-') + '.pickle')
+
+    def stats(self):
+        '''
+        Returns a dictionary of cache statistics. hits are answered from memory, disk_hits from the disk store and misses were computed.
+        '''
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'size': len(self._memory),
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0}
+
+    def clear(self, disk=False):
+        '''
+        Empties the memory cache and resets the statistics. With disk=True the files of the disk store are removed too.
+        '''
+        self._memory.clear()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk and self.path is not None:
+            for name in os.listdir(self.path):
+                if name.endswith('.pickle'):
+                    os.remove(os.path.join(self.path, name))
@@ -0,0 +1,260 @@
+'''
+Command line interface, run with 'python -m bioseq <command>'.
+
+Commands stream records from FASTA input to their output without intermediate files:
+    translate    six frame translation of every DNA record
+    orfs         open reading frames of every DNA record as protein FASTA
+    composition  polar/small/hydrophobic proportions or k-mer profiles of every protein record as CSV
+    distance     distance matrix of an AAtypetable CSV
+    pipeline     DNA records -> ORFs -> composition -> distance matrix in one pass
+
+Input files may be gzip compressed and '-' stands for standard input or output.
+'''
+import argparse
+import contextlib
+import functools
+import itertools
+import multiprocessing
+import sys
+
+import numpy as np
+
+from bioseq.fasta import readFASTA, FASTAWriter, recordName
+from bioseq.translation import translate, frame_list_names
+from bioseq.orf import findORFs, longestORF, scanORFs, selectLongestORF
+from bioseq.composition import AAtypeProfile, compositionProfile, profileColumns
+from bioseq.distance import distanceMatrix, writeDistances
+
+
+def _open_text_output(filename):
+    '''
+    Opens an output file for writing text, '-' stands for standard output.
+    '''
+    if filename == '-':
+        return contextlib.nullcontext(sys.stdout)
+    return open(filename, 'wt')
+
+
+def _map(function, items, workers, chunksize=64):
+    '''
+    Applies function to every item, in a pool of worker processes if workers is greater than 1. Results are yielded in input order as they arrive.
+    '''
+    if workers <= 1:
+        yield from map(function, items)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(function, items, chunksize)
+
+
+def _record_translations(record):
+    header, seq = record
+    frames = translate(seq)
+    return [(f'{recordName(header)}_{frame}', frames[frame]) for frame in frame_list_names]
+
+
+def _record_orfs(record, minlength, starts, longest):
+    '''
+    Returns the ORFs of one DNA record as (description, protein) tuples. The description holds the record id, frame and coordinates.
+    '''
+    header, seq = record
+    if longest:
+        orf = longestORF(seq, minlength, starts)
+        orfs = [orf] if orf is not None else []
+    else:
+        orfs = findORFs(seq, minlength, starts)
+    return [_orf_record(header, orf) for orf in orfs]
+
+
+def _orf_record(header, orf):
+    return f'{recordName(header)}_{orf.frame}_{orf.start}_{orf.end} length={orf.length}', orf.protein
+
+
+def _find_orfs(args):
+    '''
+    Yields the ORFs of every DNA record of the input as lists of (description, protein) tuples.
+    With --chunk-size records are scanned in windows by scanORFs, so no record is held in memory as a whole and the workers share the windows of each record,
+    otherwise whole records are spread over the workers.
+    '''
+    if args.chunk_size is None:
+        find = functools.partial(_record_orfs, minlength=args.min_length, starts=tuple(args.starts), longest=args.longest)
+        yield from _map(find, readFASTA(args.input), args.workers)
+        return
+
+    found = scanORFs(args.input, args.min_length, tuple(args.starts), args.chunk_size, args.workers, numbered=True)
+    # ORFs of a record are consecutive, records without ORFs yield nothing. Grouping by record number keeps records sharing a header apart
+    for (_, header), orfs in itertools.groupby(found, key=lambda item: item[:2]):
+        orfs = [orf for _, _, orf in orfs]
+        if args.longest:
+            orfs = [selectLongestORF(orfs)]
+        yield [_orf_record(header, orf) for orf in orfs]
+
+
+def _batches(items, size):
+    '''
+    Groups an iterable into lists of at most size items.
+    '''
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _profiles(proteins, k):
+    '''
+    Returns the composition profiles of a list of proteins, class proportions if k is 0 and k-mer frequencies otherwise.
+    Class proportions are rounded to 3 decimal places like AAtypes, so distances match those of distanceMatrix on an AAtypetable csv.
+    '''
+    if k == 0:
+        return np.round(AAtypeProfile(proteins).astype(np.float64), 3)
+    return compositionProfile(proteins, k=k)
+
+
+def _profile_columns(k):
+    return ['Polar', 'Small', 'Hydrophobic'] if k == 0 else profileColumns(k)
+
+
+def _profile_header(k):
+    # Same header as AAtypetable so the table can be read back by distanceMatrix
+    return '#' + 'Filename' + ',' + ','.join(_profile_columns(k)) + '\n'
+
+
+def _profile_rows(names, profiles, k):
+    digits = 3 if k == 0 else 6
+    return ''.join(name + ',' + ','.join(str(round(value, digits)) for value in row) + '\n'
+                   for name, row in zip(names, profiles.tolist()))
+
+
+def _fasta_writer(filename, args):
+    # Writing from a background thread so formatting and disk writes overlap with the next records
+    return FASTAWriter(filename, args.compression, background=True)
+
+
+def command_translate(args):
+    with _fasta_writer(args.output, args) as writer:
+        for translations in _map(_record_translations, readFASTA(args.input), args.workers):
+            writer.write_records(translations)
+
+
+def command_orfs(args):
+    with _fasta_writer(args.output, args) as writer:
+        for orfs in _find_orfs(args):
+            writer.write_records(orfs)
+
+
+def command_composition(args):
+    with _open_text_output(args.output) as OUTF:
+        OUTF.write(_profile_header(args.k))
+        for batch in _batches(readFASTA(args.input), args.batch_size):
+            names = [recordName(header) for header, _ in batch]
+            OUTF.write(_profile_rows(names, _profiles([seq for _, seq in batch], args.k), args.k))
+
+
+def command_distance(args):
+    distanceMatrix(args.input, args.output, args.metric, output=args.format, update=args.update)
+
+
+def command_pipeline(args):
+    '''
+    Finds the ORFs of every DNA record, profiles their proteins and writes the distance matrix between all proteins.
+    Proteins are profiled in batches as they are found and only their names and profile rows are kept.
+    '''
+    orfs = (orf for found in _find_orfs(args) for orf in found)
+
+    names = []
+    rows = []
+    with contextlib.ExitStack() as stack:
+        proteins_out = stack.enter_context(_fasta_writer(args.proteins, args)) if args.proteins else None
+        profiles_out = stack.enter_context(_open_text_output(args.profiles)) if args.profiles else None
+        if profiles_out:
+            profiles_out.write(_profile_header(args.k))
+
+        for batch in _batches(orfs, args.batch_size):
+            batch_names = [recordName(description) for description, _ in batch]
+            profiles = _profiles([protein for _, protein in batch], args.k)
+            names.extend(batch_names)
+            rows.append(profiles)
+            if proteins_out:
+                proteins_out.write_records(batch)
+            if profiles_out:
+                profiles_out.write(_profile_rows(batch_names, profiles, args.k))
+
+    profiles = np.concatenate(rows) if rows else np.zeros((0, len(_profile_columns(args.k))))
+    writeDistances(names, profiles, args.output, args.metric, args.format, columns=_profile_columns(args.k))
+
+
+def _chunk_size(value):
+    size = int(value)
+    if size < 3 or size % 3:
+        raise argparse.ArgumentTypeError('must be a positive multiple of 3')
+    return size
+
+
+def _add_orf_options(parser):
+    parser.add_argument('--min-length', type=int, default=0, help='minimum protein length in amino acids (default: 0)')
+    parser.add_argument('--starts', nargs='+', default=['ATG'], help='start codons (default: ATG)')
+    parser.add_argument('--longest', action='store_true', help='keep only the longest ORF of each record')
+    parser.add_argument('--chunk-size', type=_chunk_size, help='scan records in windows of this many bases, a multiple of 3, '
+                        'so memory does not grow with record length when the input has a .fai index (default: whole records)')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='bioseq', description='Streaming sequence analysis pipelines.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('input', help="input fasta file, may be gzip compressed, '-' for standard input")
+    common.add_argument('-o', '--output', default='-', help="output file, '-' for standard output (default)")
+    common.add_argument('-w', '--workers', type=int, default=1, help='worker processes (default: 1)')
+
+    compression = argparse.ArgumentParser(add_help=False)
+    compression.add_argument('--compression', choices=['gzip', 'bgzip'], help='compress the fasta output (default: none)')
+
+    translate_parser = subparsers.add_parser('translate', parents=[common, compression], help='six frame translation as protein fasta')
+    translate_parser.set_defaults(function=command_translate)
+
+    orfs_parser = subparsers.add_parser('orfs', parents=[common, compression], help='open reading frames as protein fasta')
+    _add_orf_options(orfs_parser)
+    orfs_parser.set_defaults(function=command_orfs)
+
+    composition_parser = subparsers.add_parser('composition', parents=[common], help='composition profiles of protein records as csv')
+    composition_parser.add_argument('-k', type=int, default=0, help='k-mer length, 0 for polar/small/hydrophobic proportions (default: 0)')
+    composition_parser.add_argument('--batch-size', type=int, default=1000, help='records profiled at a time (default: 1000)')
+    composition_parser.set_defaults(function=command_composition)
+
+    distance_parser = subparsers.add_parser('distance', help='distance matrix of an AAtypetable csv')
+    distance_parser.add_argument('input', help='csv file written by AAtypetable or the composition command')
+    distance_parser.add_argument('-o', '--output', required=True, help="output name, the extension is added, '-' writes dmf to standard output")
+    distance_parser.add_argument('--metric', choices=['l1', 'l2', 'cosine'], default='l1', help="'l1'=Euclidean, 'l2'=Manhattan (default: l1)")
+    distance_parser.add_argument('--format', choices=['dmf', 'npy', 'condensed'], default='dmf', help='output format (default: dmf)')
+    distance_parser.add_argument('--update', action='store_true', help='with --format npy, update an existing matrix computing only new and changed entries')
+    distance_parser.set_defaults(function=command_distance)
+
+    pipeline_parser = subparsers.add_parser('pipeline', parents=[common, compression], help='DNA -> ORFs -> composition -> distance matrix')
+    _add_orf_options(pipeline_parser)
+    pipeline_parser.add_argument('-k', type=int, default=0, help='k-mer length, 0 for polar/small/hydrophobic proportions (default: 0)')
+    pipeline_parser.add_argument('--metric', choices=['l1', 'l2', 'cosine'], default='l1', help="'l1'=Euclidean, 'l2'=Manhattan (default: l1)")
+    pipeline_parser.add_argument('--format', choices=['dmf', 'npy', 'condensed'], default='dmf', help="output format as for the distance command, '-o -' writes dmf to standard output (default: dmf)")
+    pipeline_parser.add_argument('--proteins', help='also write the ORF proteins to this fasta file, compressed with --compression')
+    pipeline_parser.add_argument('--profiles', help='also write the composition profiles to this csv file')
+    pipeline_parser.add_argument('--batch-size', type=int, default=1000, help='proteins profiled at a time (default: 1000)')
+    pipeline_parser.set_defaults(function=command_pipeline)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    # Matrix files are named after the output, only the dmf text matrix can go to standard output
+    if getattr(args, 'format', 'dmf') != 'dmf' and args.output == '-':
+        parser.error(f"-o - writes to standard output, which only supports --format dmf, give an output name for --format {args.format}")
+    try:
+        args.function(args)
+    except BrokenPipeError:
+        # Output closed early, for example piped into head
+        sys.stderr.close()
+    return 0
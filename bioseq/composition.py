@@ -1,5 +1,23 @@
-from bioseq.fasta import readFASTAseq
+import glob
+import itertools
+import multiprocessing
+import os
 
+import numpy as np
+
+from bioseq.fasta import readFASTA, recordName
+from bioseq.profiling import instrument, sequence_argument, rows_result
+
+# The 20 standard amino acids, the default alphabet of composition profiles
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+# Amino acid classes used by AAtypes and AAtypeProfile
+aa_classes = {'polar': ['W', 'H', 'K', 'R', 'Y', 'T', 'C', 'S', 'N', 'Q', 'D', 'E'],
+              'small': ['D', 'N', 'T', 'S', 'C', 'A', 'G', 'P', 'V'],
+              'hydrophobic': ['I', 'V', 'L', 'M', 'F', 'Y', 'W', 'H', 'K', 'T', 'C', 'A']}
+
+
+@instrument('composition.AAtypes', sequence_argument)
 def AAtypes(aaseq):
     '''
     Calculates the proportion of polar, small and hydrophobic amino acids found in the input string.
@@ -8,11 +26,6 @@ def AAtypes(aaseq):
     # Ensuring all characters are upper case
     aaseq = aaseq.upper()
 
-    # Dictionary of
-    aa_classes = {'polar': ['W', 'H', 'K', 'R', 'Y', 'T', 'C', 'S', 'N', 'Q', 'D', 'E'],
-                  'small': ['D', 'N', 'T', 'S', 'C', 'A', 'G', 'P', 'V'],
-                  'hydrophobic': ['I', 'V', 'L', 'M', 'F', 'Y', 'W', 'H', 'K', 'T', 'C', 'A']}
-
     try:
         counts = {}
         for k in aa_classes:
@@ -29,12 +42,26 @@ def AAtypes(aaseq):
         print('Error:', e, '| Empty input, please enter a sequence.')
 
 
-def AAtypetable(filelist, outputfile):
+# File extensions picked up when AAtypetable is given a directory
+FASTA_EXTENSIONS = ('.fasta', '.fa', '.faa', '.fas', '.fna')
+
+
+@instrument('composition.AAtypetable')
+def AAtypetable(filelist, outputfile, processes=1, chunksize=16):
     '''
     Takes a list of fasta files containing amino acid sequence data. Sequence is read and the proportion of polar, small and hydrophobic residues are calculated.
     Results are outputted to a file in CSV format.
     Requires the AAtypes() function.
+
+    Instead of a list, filelist can be a directory, in which case every file ending in one of FASTA_EXTENSIONS is used, or a glob pattern such as 'proteomes/*.fasta'.
+    Files with a single record give one row named after the file. Files with several records give one row per record, named 'filename:id' where id is the first word of the header.
+    Files are read one record at a time and rows are written as soon as each file is processed, so memory use does not depend on the number of files.
+    With processes greater than 1 files are processed by a pool of worker processes, chunksize files at a time. Rows are written in the order of the files.
+    processes=None uses one worker process per CPU.
     '''
+    if processes is None:
+        processes = os.cpu_count() or 1
+    files = _expand_filelist(filelist)
 
     # Creating header format
     header = '#' + 'Filename' + ',' + 'Polar' + ',' + 'Small' + ',' + 'Hydrophobic' + '\n'
@@ -43,18 +70,188 @@ def AAtypetable(filelist, outputfile):
     with open(outputfile, 'wt') as OUTF:
         OUTF.write(header)
 
-        # Looping through files to get stats and writing tuples to the output file
-        for file in filelist:  # Looping through file names in the list
-            try:
-                seq = readFASTAseq(file)
-                stats = AAtypes(seq)  # Getting proportions of amino acid types
-                for i in range(0, len(stats)):
-                    data = ','.join([str(i) for i in stats])
-                line_format = file + ',' + data + '\n'
-                OUTF.write(line_format)
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap(_AAtypetable_rows, files, chunksize)
+        else:
+            pool = None
+            results = map(_AAtypetable_rows, files)
+
+        try:
+            # Writing rows of each file to the output file as they arrive
+            for lines, error in results:
+                if error is not None:
+                    print('Error:', error, '|', 'File does not exist in this directory')
+                OUTF.write(''.join(lines))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+
+def _expand_filelist(filelist):
+    '''
+    Returns the list of files given to AAtypetable as a list, a directory or a glob pattern.
+    '''
+    if not isinstance(filelist, str):
+        return list(filelist)
+    if os.path.isdir(filelist):
+        return sorted(os.path.join(filelist, name) for name in os.listdir(filelist)
+                      if name.lower().endswith(FASTA_EXTENSIONS))
+    if any(c in filelist for c in '*?['):
+        return sorted(glob.glob(filelist))
+    return [filelist]
+
+
+def _AAtypetable_rows(file):
+    '''
+    Calculates the AAtypetable rows of one fasta file.
+    Returns a tuple of the list of csv lines and an error message, which is None unless the file does not exist.
+    '''
+    try:
+        records = readFASTA(file)
+        try:
+            first = next(records, None)
+            second = next(records, None)
+
+            lines = []
+            if first is not None and second is None:
+                # Single record files keep the filename as row name
+                stats = AAtypes(first[1])  # Getting proportions of amino acid types
+                if stats is not None:
+                    lines.append(file + ',' + ','.join([str(i) for i in stats]) + '\n')
+            elif first is not None:
+                for header, seq in itertools.chain([first, second], records):
+                    stats = AAtypes(seq)
+                    if stats is not None:
+                        record_id = recordName(header)
+                        lines.append(file + ':' + record_id + ',' + ','.join([str(i) for i in stats]) + '\n')
+        finally:
+            records.close()
+        return lines, None
+
+    except FileNotFoundError as e:
+        return [], str(e)
+
+
+@instrument('composition.compositionProfile', rows_result)
+def compositionProfile(sequences, k=1, alphabet=AMINO_ACIDS, normalise=True, dtype=np.float32, chunk_residues=10000000, chunk_cells=10000000):
+    '''
+    Computes the residue or k-mer composition of a batch of sequences as one matrix, with a row per sequence and a column per k-mer.
+    Input is a list of sequences (a single string is treated as one sequence). Sequences are converted to uppercase.
+    Columns follow profileColumns(k, alphabet), the k-mers of the alphabet in lexicographic order, so there are len(alphabet) ** k columns.
+    k-mers containing a character that is not in the alphabet are not counted.
+
+    With normalise=True each row holds frequencies that sum to 1 (rows of sequences without any counted k-mer are all 0), otherwise raw counts.
+    dtype is the type of the returned matrix, float32 keeps large batches compact.
+    All sequences are encoded and counted together with a single np.bincount, in chunks of about chunk_residues residues to bound memory use.
+    Chunks are also limited to chunk_cells counts (rows times len(alphabet) ** k columns), which bounds the integer count matrix of large k.
+    Every chunk holds at least one sequence.
+    '''
+    if isinstance(sequences, str):
+        sequences = [sequences]
+    sequences = list(sequences)
+    if k < 1:
+        raise ValueError('k must be at least 1')
+
+    size = len(alphabet)
+    columns = size ** k
 
-            except FileNotFoundError as e:
-                print('Error:', e, '|', 'File does not exist in this directory')
+    lookup = _alphabet_lookup(alphabet)
+
+    profile = np.zeros((len(sequences), columns), dtype=dtype)
+
+    # Splitting the batch into chunks of about chunk_residues residues and at most chunk_cells counts
+    rows = max(chunk_cells // columns, 1)
+    start = 0
+    while start < len(sequences):
+        end = start
+        residues = 0
+        while end < len(sequences) and (end == start or (residues + len(sequences[end]) <= chunk_residues and end - start < rows)):
+            residues += len(sequences[end])
+            end += 1
+        profile[start:end] = _count_kmers(sequences[start:end], lookup, size, k)
+        start = end
+
+    if normalise:
+        totals = profile.sum(axis=1, keepdims=True)
+        np.divide(profile, totals, out=profile, where=totals > 0)
+
+    return profile
+
+
+def _count_kmers(sequences, lookup, size, k):
+    '''
+    Counts the k-mers of every sequence of a chunk with one np.bincount over the concatenated, encoded sequences.
+    Returns an integer matrix with a row per sequence.
+    '''
+    rows, kmers = _kmer_codes(sequences, lookup, size, k)
+    columns = size ** k
+    counts = np.bincount(rows * columns + kmers, minlength=len(sequences) * columns)
+    return counts.reshape(len(sequences), columns)
+
+
+def _kmer_codes(sequences, lookup, size, k):
+    '''
+    Encodes every k-mer of a list of sequences as an integer code, the k-mer's column in profileColumns(k, alphabet).
+    lookup maps ASCII codes to alphabet positions (-1 outside the alphabet), see _alphabet_lookup.
+    Returns two arrays, the position of the sequence in the list and the code of each k-mer, in sequence order.
+    k-mers containing characters outside the alphabet are skipped.
+    '''
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    raw = np.frombuffer(''.join(sequences).upper().encode('ascii', 'replace'), dtype=np.uint8)
+    codes = lookup[raw]
+    rows = np.repeat(np.arange(len(sequences)), lengths)
+
+    # Combining k consecutive codes into one k-mer code, k-mers must lie within one sequence and contain only alphabet characters
+    count = max(len(codes) - k + 1, 0)
+    kmers = np.zeros(count, dtype=np.int64)
+    valid = rows[:count] == rows[k - 1:k - 1 + count]
+    for offset in range(k):
+        window = codes[offset:offset + count]
+        kmers = kmers * size + window
+        valid &= window >= 0
+
+    return rows[:count][valid], kmers[valid]
+
+
+def _alphabet_lookup(alphabet):
+    '''
+    Returns a lookup table from ASCII code to alphabet position, -1 for characters outside the alphabet.
+    '''
+    lookup = np.full(256, -1, dtype=np.int64)
+    for code, residue in enumerate(alphabet.upper()):
+        lookup[ord(residue)] = code
+    return lookup
+
+
+def profileColumns(k=1, alphabet=AMINO_ACIDS):
+    '''
+    Returns the k-mers labelling the columns of compositionProfile, in column order.
+    '''
+    return [''.join(kmer) for kmer in itertools.product(alphabet.upper(), repeat=k)]
+
+
+@instrument('composition.AAtypeProfile', rows_result)
+def AAtypeProfile(sequences, dtype=np.float32):
+    '''
+    Calculates the proportion of polar, small and hydrophobic amino acids of a batch of sequences in one pass.
+    Returns a matrix with a row per sequence and the columns in polar, small, hydrophobic order, the same values as AAtypes without rounding.
+    Rows of empty sequences are all 0.
+    '''
+    if isinstance(sequences, str):
+        sequences = [sequences]
+    sequences = list(sequences)
 
+    # Membership of each amino acid in each class
+    membership = np.zeros((len(AMINO_ACIDS), len(aa_classes)))
+    for column, members in enumerate(aa_classes.values()):
+        for residue in members:
+            membership[AMINO_ACIDS.index(residue), column] = 1
 
+    counts = compositionProfile(sequences, normalise=False, dtype=np.float64)
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.float64)[:, None]
 
+    profile = counts @ membership
+    np.divide(profile, lengths, out=profile, where=lengths > 0)
+    return profile.astype(dtype)
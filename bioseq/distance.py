@@ -1,5 +1,12 @@
+import contextlib
+import io
 import math
-from bioseq.fasta import readFASTAseq
+import os
+import sys
+
+import numpy as np
+
+from bioseq.profiling import instrument, rows_result
 
 
 # Creating my exception to raise if tuples are different length
@@ -7,9 +14,11 @@ class DimensionalityException(Exception):
     pass
 
 
+@instrument('distance.distance')
 def distance(veca, vecb, metric):
     '''
     Computes the distance between 2 vectors. 2 different methods, Euclidean distance and Manhattan distance.
+    See distanceArray for distances between many vectors at once.
     Metric argument determines the method used.
     'l1'=Euclidean distance. 'l2'=Manhattan distance.
     Input requires 2 tuples with equal length containing float values.
@@ -44,57 +53,389 @@ def distance(veca, vecb, metric):
         raise ValueError
 
 
+@instrument('distance.readTable', lambda args, kwargs, result: (0, len(result)))
 def readTable(filename):
     '''
     Takes the filename of a CSV file containing proportions of small, polar and hydrophobic amino acids and stores them in a dictionary.
     Filename stored as keys and the values are a tuple containing the floats from calculations.
+    Tables with more columns, such as the k-mer profiles written by the command line interface, are read the same way.
     '''
 
-    out = readFASTAseq(filename, '#', 'ORIGINAL', 'KEEP')  # Using readFASTAseq function with required arguments
-
     data = {}  # initialising dictionary for csv to be stored
-    values = []  # initialising list for values to be stored
-    lines = out.strip().split('\n')  # stripping special characters
-    for line in lines:
-        values.append(line.split(','))  # adding lines as list to
-
-    # Convert values in tuple to float
-    for i in range(0, len(values)):  # moving through list of lines
-        for x in range(1, 4):  # moving through indexes in tuple
-            values[i][x] = float(values[i][x])
-        data[values[i][0]] = tuple(values[i][1:4])  # Adding file names as keys and calculations as values
+    with open(filename, 'rt') as INFILE:
+        for line in INFILE:
+            if line.startswith('#') or not line.strip():  # skipping header and blank lines
+                continue
+            values = line.rstrip('\n').split(',')
+            # Adding file names as keys and calculations as values
+            data[values[0]] = tuple(float(value) for value in values[1:])
 
     return data
 
 
-def distanceMatrix(inputfile, outputfile, metric):
+@instrument('distance.distanceMatrix')
+def distanceMatrix(inputfile, outputfile, metric, output='dmf', block=2048, update=False):
     '''
     Function takes a text file in csv format and outputs a tsv distance matrix file (.dmf)
     Calculates the distance between the proportions of amino acids for each protein using the given metric.
-    'l1'=Euclidean distance, 'l2'=Manhattan distance.
-    Requires the distance() function
+    'l1'=Euclidean distance, 'l2'=Manhattan distance, 'cosine'=cosine distance.
+    Distances are computed in blocks with distanceArray.
+
+    Fifth argument chooses the output format. There are three options:
+    'dmf' (default) writes the tsv matrix to outputfile + '.dmf'.
+    'npy' writes the full matrix as a memory-mapped NumPy file to outputfile + '.npy', filled block by block so it never has to fit in memory.
+    'condensed' writes only the upper triangle (see condensedDistances) to outputfile + '.condensed.npy', half the size of 'npy'.
+    For 'npy' and 'condensed' the order of the rows is recorded by writing the input table, in matrix order, to outputfile + '.keys.csv'.
+
+    With update=True and output='npy' an existing matrix is updated with updateDistanceMatrix instead of recomputed.
     '''
+    if output not in ['dmf', 'npy', 'condensed']:
+        raise ValueError
+    if update:
+        if output != 'npy':
+            raise ValueError('update is only supported for npy output')
+        updateDistanceMatrix(inputfile, outputfile, metric, block)
+        return
 
     data = readTable(inputfile)
 
     list_keys = list(data.keys())
-    list_values = list(data.values())
+    profiles = _table_profiles(data, list_keys)
+    writeDistances(list_keys, profiles, outputfile, metric, output, block, _table_columns(inputfile))
+
+
+@instrument('distance.updateDistanceMatrix', lambda args, kwargs, result: (0, len(result['added']) + len(result['changed'])))
+def updateDistanceMatrix(inputfile, outputfile, metric, block=2048):
+    '''
+    Updates a matrix written by distanceMatrix with output='npy' (outputfile + '.npy' and outputfile + '.keys.csv') to match a new version of its input table,
+    computing only the distances of entries that are new or whose values changed. metric must be the one the matrix was computed with.
+    If the matrix does not exist yet it is computed in full.
+
+    Entries are compared with the table recorded in outputfile + '.keys.csv':
+    entries no longer in the input are removed, entries with different values have their row and column recomputed in place,
+    and new entries are appended as new rows and columns in input order. The keys table is rewritten in the new matrix order.
+    When entries are only appended the file is grown in place, existing rows are moved to their new positions and never recomputed.
+    Removing entries writes a compacted copy of the matrix which replaces the old file.
+    The in place update is not atomic, a matrix interrupted while being updated should be recomputed.
+
+    Returns a dictionary of the 'added', 'changed' and 'removed' keys.
+    '''
+    if metric not in ['l1', 'l2', 'cosine']:
+        raise ValueError
+
+    data = readTable(inputfile)
+    matrixfile = outputfile + '.npy'
+    keysfile = outputfile + '.keys.csv'
+
+    if not (os.path.exists(matrixfile) and os.path.exists(keysfile)):
+        distanceMatrix(inputfile, outputfile, metric, output='npy', block=block)
+        return {'added': list(data), 'changed': [], 'removed': []}
+
+    old = readTable(keysfile)
+    removed = [key for key in old if key not in data]
+    changed = [key for key in old if key in data and data[key] != old[key]]
+    added = [key for key in data if key not in old]
+
+    # Kept entries stay in their old order, new entries follow
+    keys = [key for key in old if key in data] + added
+    profiles = _table_profiles(data, keys)
+
+    matrix = np.load(matrixfile, mmap_mode='r')
+    if matrix.shape != (len(old), len(old)):
+        raise ValueError(f'{matrixfile} does not match {keysfile}')
+    del matrix
 
+    if removed:
+        old_position = {key: i for i, key in enumerate(old)}
+        _rebuild_matrix(matrixfile, np.array([old_position[key] for key in keys if key in old], dtype=np.int64), len(keys), block)
+    elif added:
+        _grow_matrix(matrixfile, len(keys), block)
+
+    # Recomputing the rows and columns of changed and new entries
+    position = {key: i for i, key in enumerate(keys)}
+    rows = np.array(sorted(position[key] for key in changed) + list(range(len(keys) - len(added), len(keys))), dtype=np.int64)
+    if len(rows):
+        out = np.load(matrixfile, mmap_mode='r+')
+        _fill_rows(out, profiles, rows, metric, block)
+        out.flush()
+        del out
+
+    writeTable({key: data[key] for key in keys}, keysfile, _table_columns(keysfile))
+
+    return {'added': added, 'changed': changed, 'removed': removed}
+
+
+def _table_columns(filename):
+    '''
+    Returns the names of the value columns in the '#Filename,...' header of a table written by writeTable, or None if it has no header.
+    '''
+    with open(filename, 'rt') as INFILE:
+        line = INFILE.readline().rstrip('\n')
+    if not line.startswith('#'):
+        return None
+    return line[1:].split(',')[1:]
+
+
+def _table_profiles(data, keys):
+    '''
+    Returns the values of a table read by readTable as a profile matrix, with a row per key in the given order.
+    '''
+    if not keys:
+        return np.zeros((0, 0))
+    return np.array([data[key] for key in keys], dtype=np.float64)
+
+
+def _fill_rows(out, profiles, rows, metric, block):
+    '''
+    Computes the distances of the given rows to every profile and writes them to both the rows and the columns of a square matrix.
+    '''
+    n = len(profiles)
+    for start in range(0, len(rows), block):
+        part = rows[start:start + block]
+        for column_start in range(0, n, block):
+            column_end = min(column_start + block, n)
+            distances = _block_distance(profiles[part], profiles[column_start:column_end], metric)
+            out[part, column_start:column_end] = distances
+            out[column_start:column_end, part] = distances.T
+    out[rows, rows] = 0
+
+
+def _grow_matrix(matrixfile, n, block):
+    '''
+    Grows a square .npy matrix file in place to n x n, keeping the existing values in the top left corner. New values are left as 0.
+    Rows are moved to their new positions from last to first, so no row is overwritten before it is moved.
+    If the new shape does not fit in the space of the old header the matrix is copied instead.
+    '''
+    with open(matrixfile, 'r+b') as FILE:
+        version = np.lib.format.read_magic(FILE)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(FILE)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(FILE)
+        offset = FILE.tell()
+        old = shape[0]
+
+        header = io.BytesIO()
+        fields = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (n, n)}
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(header, fields)
+        else:
+            np.lib.format.write_array_header_2_0(header, fields)
+
+        if fortran_order or len(header.getvalue()) != offset:
+            FILE.close()
+            _rebuild_matrix(matrixfile, np.arange(old), n, block)
+            return
+
+        FILE.truncate(offset + n * n * dtype.itemsize)
+
+    values = np.memmap(matrixfile, dtype=dtype, mode='r+', offset=offset, shape=(n * n,))
+    for row in range(old - 1, 0, -1):
+        values[row * n:row * n + old] = values[row * old:(row + 1) * old]
+        values[row * n + old:(row + 1) * n] = 0
+    values[old:n] = 0
+    values.flush()
+    del values
+
+    # Writing the new shape once every row is in place
+    with open(matrixfile, 'r+b') as FILE:
+        FILE.write(header.getvalue())
+
+
+def _rebuild_matrix(matrixfile, kept, n, block):
+    '''
+    Replaces a square .npy matrix file by an n x n copy whose top left corner holds the rows and columns kept of the old matrix, in that order.
+    The copy is written to a temporary file and renamed, reading at most about block * block values of the old matrix at a time.
+    '''
+    old = np.load(matrixfile, mmap_mode='r')
+    temporary = matrixfile + '.tmp.npy'
+    new = np.lib.format.open_memmap(temporary, mode='w+', dtype=old.dtype, shape=(n, n))
+    step = max(1, block * block // max(len(old), 1))
+    for start in range(0, len(kept), step):
+        rows = np.asarray(old[kept[start:start + step]])
+        new[start:start + len(rows), :len(kept)] = rows[:, kept]
+    new.flush()
+    del new, old
+    os.replace(temporary, matrixfile)
+
+
+def writeDistances(keys, profiles, outputfile, metric, output='dmf', block=2048, columns=None):
+    '''
+    Computes the distance matrix of a profile matrix whose rows are named by keys and writes it in one of the output formats of distanceMatrix.
+    Used by distanceMatrix and by pipelines which hold their profiles in memory, so they do not need to write and read back a csv table.
+    columns are the names of the profile columns written to the header of the '.keys.csv' table, default is the AAtypetable header.
+    For 'dmf' an outputfile of '-' writes the matrix to standard output.
+    '''
+    if output not in ['dmf', 'npy', 'condensed']:
+        raise ValueError
+
+    if output == 'dmf':
+        writeDistanceTSV(keys, distanceRows(profiles, metric, block), outputfile if outputfile == '-' else outputfile + '.dmf')
+        return
+
+    n = len(keys)
+    if output == 'npy':
+        out = np.lib.format.open_memmap(outputfile + '.npy', mode='w+', dtype=np.float64, shape=(n, n))
+        distanceArray(profiles, metric, block, out=out)
+    else:
+        out = np.lib.format.open_memmap(outputfile + '.condensed.npy', mode='w+', dtype=np.float64, shape=(n * (n - 1) // 2,))
+        condensedDistances(profiles, metric, block, out=out)
+    out.flush()
+    del out
+
+    writeTable(dict(zip(keys, np.asarray(profiles).tolist())), outputfile + '.keys.csv', columns)
+
+
+def writeDistanceTSV(keys, matrix, outputfile):
+    '''
+    Writes a square distance matrix in the tsv format of distanceMatrix to outputfile, with values to 3 decimal places.
+    keys are the names of the rows and columns in matrix order. matrix can also be an iterable of rows, such as distanceRows, so rows are written as they are computed.
+    The file is opened once and written one row at a time.
+    An outputfile of '-' writes to standard output.
+    '''
     # Create header format
-    files = '\t'.join(list_keys)
-    header = '# filename\t' + files + '\n'
+    header = '# filename\t' + '\t'.join(keys) + '\n'
 
-    with open(outputfile + '.dmf', 'wt') as OUTF:
-        # writing header
+    with (contextlib.nullcontext(sys.stdout) if outputfile == '-' else open(outputfile, 'wt')) as OUTF:
         OUTF.write(header)
+        for key, row in zip(keys, matrix):
+            line = ''.join(['\t' + f"{answer:.3f}" + '\t' for answer in row.tolist()])
+            OUTF.write(str(key) + line + '\n')
+
+
+def writeTable(data, outputfile, columns=None):
+    '''
+    Writes a dictionary of {filename: (polar, small, hydrophobic)} in the csv format of AAtypetable, so it can be read back with readTable.
+    columns optionally replaces the names of the value columns in the header, for tables of other profiles.
+    '''
+    if columns is None:
+        columns = ['Polar', 'Small', 'Hydrophobic']
+    with open(outputfile, 'wt') as OUTF:
+        OUTF.write('#' + 'Filename' + ',' + ','.join(columns) + '\n')
+        for key, values in data.items():
+            OUTF.write(key + ',' + ','.join(str(value) for value in values) + '\n')
+
+
+def _block_distance(x, y, metric):
+    '''
+    Returns the matrix of distances between every row of x and every row of y.
+    Distances are accumulated one feature at a time so memory stays proportional to the block size,
+    except Euclidean distance between long vectors which uses a matrix product.
+    '''
+    if metric == 'l1':
+        if x.shape[1] > 64:
+            squared = (x * x).sum(axis=1)[:, None] + (y * y).sum(axis=1)[None, :] - 2 * (x @ y.T)
+            return np.sqrt(np.maximum(squared, 0))
+        total = np.zeros((len(x), len(y)))
+        for feature in range(x.shape[1]):
+            difference = x[:, feature, None] - y[None, :, feature]
+            total += difference * difference
+        return np.sqrt(total)
+
+    elif metric == 'l2':
+        total = np.zeros((len(x), len(y)))
+        for feature in range(x.shape[1]):
+            total += np.abs(x[:, feature, None] - y[None, :, feature])
+        return total
+
+    elif metric == 'cosine':
+        # Zero vectors are treated as having length 1, giving a distance of 1 to everything
+        x_norm = np.linalg.norm(x, axis=1)
+        y_norm = np.linalg.norm(y, axis=1)
+        x_norm[x_norm == 0] = 1
+        y_norm[y_norm == 0] = 1
+        return np.clip(1 - (x @ y.T) / (x_norm[:, None] * y_norm[None, :]), 0, 2)
+
+    else:
+        raise ValueError
+
+
+def _blocks(n, block):
+    '''
+    Yields the (start, end) row ranges of the blocks of the upper triangle, as pairs of row block and column block.
+    '''
+    if block < 1:
+        raise ValueError('block must be at least 1')
+    for row_start in range(0, n, block):
+        for column_start in range(row_start, n, block):
+            yield (row_start, min(row_start + block, n)), (column_start, min(column_start + block, n))
+
+
+@instrument('distance.distanceArray', rows_result)
+def distanceArray(profiles, metric='l1', block=2048, out=None, dtype=np.float64):
+    '''
+    Computes the distances between every pair of rows of a profile matrix (for example from compositionProfile) and returns a square matrix.
+    'l1'=Euclidean distance, 'l2'=Manhattan distance, 'cosine'=cosine distance, the same names as distance().
+    Distances are computed block by block over the upper triangle only and mirrored, so each pair is computed once
+    and working memory is proportional to block * block.
+    out can be a preallocated (n, n) array or memory-mapped file to fill, otherwise a new array of type dtype is returned.
+    '''
+    if metric not in ['l1', 'l2', 'cosine']:
+        raise ValueError
+
+    profiles = np.asarray(profiles, dtype=np.float64)
+    n = len(profiles)
+    if out is None:
+        out = np.empty((n, n), dtype=dtype)
+
+    for (row_start, row_end), (column_start, column_end) in _blocks(n, block):
+        distances = _block_distance(profiles[row_start:row_end], profiles[column_start:column_end], metric)
+        out[row_start:row_end, column_start:column_end] = distances
+        out[column_start:column_end, row_start:row_end] = distances.T
+
+    # Distance of a profile to itself
+    np.fill_diagonal(out, 0)
+
+    return out
+
+
+def distanceRows(profiles, metric='l1', block=2048):
+    '''
+    Yields the rows of the square distance matrix of a profile matrix one at a time, without holding the whole matrix.
+    Rows are computed in blocks of at most block * block distances, so working memory is proportional to block * block whatever the number of profiles.
+    Unlike distanceArray each pair is computed twice, once for each of its rows.
+    '''
+    if metric not in ['l1', 'l2', 'cosine']:
+        raise ValueError
+    if block < 1:
+        raise ValueError('block must be at least 1')
+
+    profiles = np.asarray(profiles, dtype=np.float64)
+    n = len(profiles)
+    rows = max(block * block // max(n, 1), 1)
+    for row_start in range(0, n, rows):
+        row_end = min(row_start + rows, n)
+        distances = _block_distance(profiles[row_start:row_end], profiles, metric)
+        # Distance of a profile to itself
+        distances[np.arange(row_end - row_start), np.arange(row_start, row_end)] = 0
+        yield from distances
+
+
+@instrument('distance.condensedDistances', lambda args, kwargs, result: (result.nbytes, len(args[0])))
+def condensedDistances(profiles, metric='l1', block=2048, out=None, dtype=np.float64):
+    '''
+    Computes the distances between every pair of rows of a profile matrix and returns them in condensed form,
+    a 1D array of length n * (n - 1) / 2 holding the upper triangle row by row, the layout used by scipy.spatial.distance.pdist.
+    The distance between rows i < j is at index n * i - i * (i + 1) / 2 + j - i - 1.
+    Metrics, block and out work as in distanceArray.
+    '''
+    if metric not in ['l1', 'l2', 'cosine']:
+        raise ValueError
+
+    profiles = np.asarray(profiles, dtype=np.float64)
+    n = len(profiles)
+    if out is None:
+        out = np.empty(n * (n - 1) // 2, dtype=dtype)
 
-    # Calculating values based on provided metric and then writing rows to file
-    for x in range(0, len(list_values)):  # looping through each tuple
-        line = ''
-        for y in range(0, len(list_values)):  # looping through each tuple again to create matrix
-            answer = distance(list_values[x], list_values[y], metric)  # Calculating distance using distance function
-            line += '\t' + f"{answer:.3f}" + '\t'
-        with open(outputfile + '.dmf', 'at') as OUTF:
-            OUTF.write(str(list_keys[x]) + line + '\n')
+    for (row_start, row_end), (column_start, column_end) in _blocks(n, block):
+        distances = _block_distance(profiles[row_start:row_end], profiles[column_start:column_end], metric)
 
+        # Copying the part of each row that lies above the diagonal
+        for i in range(row_start, row_end):
+            first = max(i + 1, column_start)
+            if first >= column_end:
+                continue
+            position = n * i - i * (i + 1) // 2 + first - i - 1
+            out[position:position + column_end - first] = distances[i - row_start, first - column_start:]
 
+    return out
@@ -1,4 +1,16 @@
-def readFASTAseq(fastafile, header='>', case='UPPER', strip='STRIP'):
+import contextlib
+import gzip
+import os
+import queue
+import sys
+import threading
+
+from bioseq.packed import PackedDNA
+from bioseq.profiling import instrument, sequence_argument, sequence_result, record_result
+
+
+@instrument('fasta.readFASTAseq', sequence_result)
+def readFASTAseq(fastafile, header='>', case='UPPER', strip='STRIP', packed=False):
     '''
     Reads a fasta file and returns the sequence found in the fasta file as a string.
 
@@ -10,12 +22,21 @@ def readFASTAseq(fastafile, header='>', case='UPPER', strip='STRIP'):
 
     Fourth arugument keeps special characters that specify line breaks or tab breaks etc. Default is set to remove them
     There are 2 options: 'STRIP' and 'KEEP'.
+
+    Fifth argument returns the sequence as a PackedDNA object at 2 bits per base instead of a string when set to True.
+    Lines are packed as they are read, so the sequence is never held as a full string. Packed sequences are always upper case and require strip='STRIP'.
     '''
     # Raising error if arguments do not match options avaliable
     if case not in ['UPPER', 'LOWER', 'ORIGINAL']:
         raise ValueError
     if strip not in ['STRIP', 'KEEP']:
         raise ValueError
+    if packed and strip != 'STRIP':
+        raise ValueError
+
+    if packed:
+        with open(fastafile, 'rt') as INFILE:
+            return PackedDNA.from_chunks(line.rstrip() for line in INFILE if not line.startswith(header))
 
     # Opening file for reading
     with open(fastafile, 'rt') as INFILE:
@@ -39,23 +60,505 @@ def readFASTAseq(fastafile, header='>', case='UPPER', strip='STRIP'):
     return seq
 
 
+@instrument('fasta.writeFASTA', sequence_argument)
 def writeFASTA(sequence, description, filename):
     '''
     Writes a description line as a header, then sequence in the body of the file, breaking every 60 lines to a specified filename.
     '''
 
-    # Setting header format
-    header = '>' + description + '\n'
-    # Setting sequence format
-    linewidth = 60
-    pos = 0
-
-    # Opening file in writing format
+    # Opening file in writing format and writing the whole record at once
     with open(filename, 'wt') as OUTF:
-        # Writing header to file
-        OUTF.write(header)
+        OUTF.write(_format_record(description, sequence))
+
+
+def _format_record(description, sequence, linewidth=60):
+    '''
+    Formats one fasta record as text, the header line then the sequence broken every linewidth characters.
+    '''
+    lines = ['>' + description]
+    lines.extend(sequence[pos:pos + linewidth] for pos in range(0, len(sequence), linewidth))
+    return '\n'.join(lines) + '\n'
+
+
+class FASTAWriter:
+    '''
+    Class writes many fasta records to one file, in the same format as writeFASTA.
+    Records are formatted into a buffer which is written in bulk once it holds buffersize characters, instead of one write call per line.
+    filename '-' writes to standard output.
+
+    compression can be None (plain text), 'gzip' or 'bgzip'. bgzip files are gzip files made of independent blocks, readable by gzip and indexable by samtools. bgzip requires Biopython.
+    With background=True the buffers are compressed and written by a separate thread, so the caller can go on computing the next records while the previous ones are written.
+    At most queuesize buffers wait for the thread, after which write blocks, so memory stays bounded if the disk is slower than the caller.
+    Errors raised by the thread are raised again by the next call to write or close.
+
+    Must be closed to write the last buffer, or used as a context manager:
+
+        with FASTAWriter('proteins.fasta.gz', compression='gzip', background=True) as writer:
+            for orf in findORFs(dnaseq):
+                writer.write(f'orf_{orf.start}', orf.protein)
+
+    Methods:
+    'write(description, sequence)' adds one record.
+    'write_records(records)' adds every (description, sequence) tuple of an iterable and returns the number of records written.
+    'flush()' writes the buffered records (waiting for the thread if background is True).
+    'close()' writes the remaining records and closes the file.
+    '''
+
+    def __init__(self, filename, compression=None, linewidth=60, buffersize=1 << 20, background=False, queuesize=8):
+        if compression not in [None, 'gzip', 'bgzip']:
+            raise ValueError
+        if linewidth < 1:
+            raise ValueError('linewidth must be at least 1')
+
+        self.filename = filename
+        self.compression = compression
+        self.linewidth = linewidth
+        self.buffersize = buffersize
+        self.records = 0
+
+        self._buffer = []
+        self._buffered = 0
+        self._handle = _open_output(filename, compression)
+
+        self._queue = None
+        self._thread = None
+        self._error = None
+        if background:
+            self._queue = queue.Queue(maxsize=queuesize)
+            self._thread = threading.Thread(target=self._writer, daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @instrument('fasta.FASTAWriter.write', lambda args, kwargs, result: (len(args[2]), 1) if len(args) > 2 else (0, 1))
+    def write(self, description, sequence):
+        '''
+        Adds one record. It is written once the buffer is full, or by flush and close.
+        '''
+        text = _format_record(description, str(sequence), self.linewidth)
+        self._buffer.append(text)
+        self._buffered += len(text)
+        self.records += 1
+        if self._buffered >= self.buffersize:
+            self._send()
+
+    def write_records(self, records):
+        '''
+        Adds every (description, sequence) record of an iterable, for example the output of readFASTA. Returns the number of records written.
+        '''
+        count = 0
+        for description, sequence in records:
+            self.write(description, sequence)
+            count += 1
+        return count
+
+    def flush(self):
+        '''
+        Writes the buffered records to the file.
+        '''
+        self._send()
+        if self._queue is not None:
+            self._queue.join()
+            self._check()
+        self._handle.flush()
+
+    def close(self):
+        '''
+        Writes the remaining records, stops the background thread and closes the file. Closing twice does nothing.
+        '''
+        if self._handle is None:
+            return
+        try:
+            self._send()
+            if self._thread is not None:
+                self._queue.put(None)  # tells the thread to stop once the queue is empty
+                self._thread.join()
+                self._check()
+        finally:
+            self._handle.close()
+            self._handle = None
+
+    def _send(self):
+        '''
+        Passes the buffer to the background thread, or writes it directly.
+        '''
+        if not self._buffer:
+            return
+        data = ''.join(self._buffer).encode()
+        self._buffer = []
+        self._buffered = 0
+        if self._queue is None:
+            self._handle.write(data)
+        else:
+            self._check()
+            self._queue.put(data)
+
+    def _writer(self):
+        '''
+        Body of the background thread, writing buffers from the queue until it receives None.
+        After an error the remaining buffers are discarded so the caller is never blocked.
+        '''
+        while True:
+            data = self._queue.get()
+            try:
+                if data is None:
+                    return
+                if self._error is None:
+                    self._handle.write(data)
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+def _open_output(filename, compression=None):
+    '''
+    Opens a file for writing bytes with the compression used by FASTAWriter, '-' stands for standard output.
+    '''
+    if filename == '-':
+        sys.stdout.flush()
+        # Closing this handle leaves standard output open
+        handle = open(sys.stdout.fileno(), 'wb', closefd=False)
+    else:
+        handle = open(filename, 'wb')
+
+    if compression == 'gzip':
+        return _ClosingGzipFile(handle)
+    if compression == 'bgzip':
+        from Bio import bgzf  # Biopython is only needed for bgzip output
+        return bgzf.BgzfWriter(fileobj=handle)
+    return handle
+
+
+class _ClosingGzipFile(gzip.GzipFile):
+    '''
+    GzipFile which closes the file object it writes to when closed, as BgzfWriter does.
+    '''
+
+    def __init__(self, handle):
+        super().__init__(fileobj=handle, mode='wb')
+        self._output = handle
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._output.close()
+
+
+def writeFASTArecords(records, filename, compression=None, linewidth=60, background=False):
+    '''
+    Writes every (description, sequence) record of an iterable to one fasta file using FASTAWriter, and returns the number of records written.
+    compression is None, 'gzip' or 'bgzip', and background=True writes from a separate thread while the records are being produced.
+    '''
+    with FASTAWriter(filename, compression, linewidth, background=background) as writer:
+        return writer.write_records(records)
+
+
+@instrument('fasta.readFASTA', record_result)
+def readFASTA(fastafile, case='UPPER'):
+    '''
+    Reads a fasta file one record at a time. This is a generator yielding a (header, sequence) tuple for every record in the file.
+    Unlike readFASTAseq, records are not merged and only one record is held in memory at a time, so it can be used to iterate over very large multi-record files.
+
+    The header is returned without the leading '>' and without the trailing line break.
+    Any sequence lines found before the first header are yielded with an empty header.
+    The file can be gzip compressed, and '-' reads from standard input (see openFASTA).
+
+    Second argument gives user the option to output the sequence as upper case, lower case or to keep it in the original casing. Default is set to output as upper case.
+    There are three options: 'UPPER', 'LOWER' and 'ORIGINAL'
+    '''
+    # Raising error if arguments do not match options avaliable
+    if case not in ['UPPER', 'LOWER', 'ORIGINAL']:
+        raise ValueError
+
+    with openFASTA(fastafile) as INFILE:
+        header = None
+        lines = []  # sequence lines of the current record, joined once the record is complete
+        for line in INFILE:
+            if line.startswith('>'):
+                if header is not None or lines:
+                    yield header or '', _format_sequence(''.join(lines), case)
+                header = line[1:].rstrip()
+                lines = []
+            else:
+                lines.append(line.rstrip())
+
+        # Yielding final record
+        if header is not None or lines:
+            yield header or '', _format_sequence(''.join(lines), case)
+
+
+def recordName(header):
+    '''
+    Returns the name of a record, the first word of its header as in a '.fai' index, or an empty string if the header is blank.
+    '''
+    words = header.split()
+    return words[0] if words else ''
+
+
+@instrument('fasta.readFASTAchunks', lambda args, kwargs, result: (len(result[2]), int(result[1] == 0)) if result is not None else (0, 0))
+def readFASTAchunks(fastafile, size, overlap=0, case='UPPER'):
+    '''
+    Reads a fasta file in windows of a fixed number of bases, so records of any length can be processed with memory proportional to size.
+    This is a generator yielding a (header, start, chunk) tuple for every window, where chunk is sequence[start:start + size + overlap] of the record.
+    Windows of a record start every size bases, so consecutive windows share overlap bases, and the last window of a record holds what remains.
+    Every record yields at least one window, records without sequence yield (header, 0, '').
+    Headers, '-' for standard input, gzip input and case work as in readFASTA.
+    '''
+    if case not in ['UPPER', 'LOWER', 'ORIGINAL']:
+        raise ValueError
+    if size < 1 or overlap < 0:
+        raise ValueError('size must be at least 1 and overlap at least 0')
+    window = size + overlap
+
+    with openFASTA(fastafile) as INFILE:
+        header = None
+        start = 0
+        pieces = []  # sequence of the current record not yielded yet
+        buffered = 0
+
+        def windows(final):
+            # Yielding every complete window of the buffered sequence, and what remains of the record when final
+            nonlocal start, pieces, buffered
+            seq = ''.join(pieces)
+            offset = 0
+            while True:
+                remaining = buffered - offset
+                if not (remaining >= window or (final and (start == 0 or remaining > overlap))):
+                    break
+                yield header or '', start, _format_sequence(seq[offset:offset + window], case)
+                if final and remaining <= window:
+                    offset = buffered
+                    break
+                offset += size
+                start += size
+            pieces = [seq[offset:]]
+            buffered -= offset
+
+        # Reading at most a window at a time, so a whole chromosome on one line is never held in memory
+        limit = max(window, 1 << 16)
+        line_start = True  # whether the next piece read begins a line
+        in_header = False  # whether the piece read continues a header line
+        for line in iter(lambda: INFILE.readline(limit), ''):
+            complete = line.endswith('\n')
+            if line_start and line.startswith('>'):
+                if header is not None or buffered:
+                    yield from windows(True)
+                header = line[1:]
+                in_header = True
+                start = 0
+                pieces = []
+                buffered = 0
+            elif in_header:
+                header += line
+            else:
+                line = line.rstrip() if complete else line
+                pieces.append(line)
+                buffered += len(line)
+                if buffered >= window:
+                    yield from windows(False)
+            if in_header and complete:
+                header = header.rstrip()
+                in_header = False
+            line_start = complete
+
+        # Yielding the end of the final record
+        if header is not None or buffered:
+            yield from windows(True)
+
+
+def openFASTA(fastafile):
+    '''
+    Opens a fasta file for reading text and returns the file object.
+    '-' stands for standard input. Files are decompressed on the fly if they are gzip (or bgzip) compressed, detected from their first bytes.
+    '''
+    if fastafile == '-':
+        # Wrapping stdin so leaving the with block does not close stdin itself
+        return contextlib.nullcontext(sys.stdin)
+
+    with open(fastafile, 'rb') as INFILE:
+        magic = INFILE.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(fastafile, 'rt')
+    return open(fastafile, 'rt')
+
+
+def _format_sequence(seq, case):
+    '''
+    Applies the casing option used by the fasta readers to a sequence.
+    '''
+    if case == 'UPPER':
+        return seq.upper()
+    if case == 'LOWER':
+        return seq.lower()
+    return seq
+
+
+@instrument('fasta.buildFASTAindex', lambda args, kwargs, result: (0, len(result)))
+def buildFASTAindex(fastafile, indexfile=None):
+    '''
+    Scans a fasta file once and writes a samtools style '.fai' index next to it (or to indexfile if given).
+    Each line of the index holds the record name, sequence length, byte offset of the first base, bases per line and bytes per line, separated by tabs.
+    The record name is the first word of the header.
+    Returns the index as a dictionary of {name: (length, offset, linebases, linewidth)}.
+
+    Every line of a record except the last must have the same length, otherwise bases cannot be located by arithmetic and a ValueError is raised.
+    '''
+    if indexfile is None:
+        indexfile = fastafile + '.fai'
+
+    index = {}
+    name = None
+
+    # Reading in binary mode so that positions are byte offsets usable by seek
+    with open(fastafile, 'rb') as INFILE:
+        pos = 0
+        for line in INFILE:
+            if line.startswith(b'>'):
+                if name is not None:
+                    index[name] = (length, offset, linebases or 0, linewidth or 0)
+
+                words = line[1:].split()
+                name = words[0].decode() if words else ''
+                if name in index:
+                    raise ValueError(f"Duplicate record name '{name}' in {fastafile}")
+
+                offset = pos + len(line)
+                length = 0
+                linebases = None
+                linewidth = None
+                finished = False  # set once a short line has been seen, which must be the last line of the record
+
+            elif name is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                if bases:
+                    if finished:
+                        raise ValueError(f"Record '{name}' in {fastafile} has lines of different lengths")
+                    if linebases is None:
+                        linebases = bases
+                        linewidth = len(line)
+                    elif bases > linebases or (bases == linebases and len(line) not in (bases, linewidth)):
+                        raise ValueError(f"Record '{name}' in {fastafile} has lines of different lengths")
+                    if bases < linebases or len(line) == bases:
+                        finished = True
+                    length += bases
+                else:
+                    finished = True
+
+            pos += len(line)
+
+        if name is not None:
+            index[name] = (length, offset, linebases or 0, linewidth or 0)
+
+    # Writing index to file
+    with open(indexfile, 'wt') as OUTF:
+        for name, entry in index.items():
+            OUTF.write('\t'.join([name] + [str(value) for value in entry]) + '\n')
+
+    return index
+
+
+def readFASTAindex(indexfile):
+    '''
+    Reads a '.fai' index file written by buildFASTAindex (or samtools faidx).
+    Returns the index as a dictionary of {name: (length, offset, linebases, linewidth)}.
+    '''
+    index = {}
+    with open(indexfile, 'rt') as INFILE:
+        for line in INFILE:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 5:
+                continue
+            index[fields[0]] = tuple(int(value) for value in fields[1:5])
+    return index
+
+
+class FASTAIndex:
+    '''
+    Class gives random access to the records of a fasta file using a '.fai' offset index, without reading the whole file.
+    The index is loaded from indexfile (default is the fasta filename plus '.fai'). It is built with buildFASTAindex if it does not exist or is older than the fasta file.
+    Records are fetched by name, the first word of the header, and only the requested bytes are read from disk.
+    Attributes are fastafile, indexfile and index, the dictionary returned by buildFASTAindex.
+    Can be used as a context manager to close the underlying file when done.
+    '''
+
+    def __init__(self, fastafile, indexfile=None):
+        self.fastafile = fastafile
+        self.indexfile = indexfile if indexfile is not None else fastafile + '.fai'
+
+        if os.path.exists(self.indexfile) and os.path.getmtime(self.indexfile) >= os.path.getmtime(fastafile):
+            self.index = readFASTAindex(self.indexfile)
+        else:
+            self.index = buildFASTAindex(fastafile, self.indexfile)
+
+        self._handle = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def length(self, name):
+        '''
+        Returns the sequence length of the named record.
+        '''
+        return self.index[name][0]
+
+    @instrument('fasta.FASTAIndex.fetch', sequence_result)
+    def fetch(self, name, start=None, end=None, case='UPPER'):
+        '''
+        Returns the sequence of the named record as a string, reading only the required bytes from disk.
+        start and end are optional 0-based coordinates with the same meaning as a python slice, so fetch(name, 10, 20) returns bases 11 to 20.
+        Coordinates are clipped to the record, negative coordinates are not supported.
+        A KeyError is raised if the name is not in the index.
+        Casing option is the same as readFASTA: 'UPPER', 'LOWER' or 'ORIGINAL'.
+        '''
+        if case not in ['UPPER', 'LOWER', 'ORIGINAL']:
+            raise ValueError
+        if name not in self.index:
+            raise KeyError(f"Record '{name}' not found in {self.indexfile}")
+
+        length, offset, linebases, linewidth = self.index[name]
+
+        # Clipping coordinates to the record
+        start = 0 if start is None else min(max(start, 0), length)
+        end = length if end is None else min(max(end, start), length)
+        if start == end:
+            return ''
+
+        # Converting base coordinates into byte positions, accounting for line breaks
+        start_byte = offset + (start // linebases) * linewidth + start % linebases
+        end_byte = offset + (end // linebases) * linewidth + end % linebases
+
+        if self._handle is None:
+            self._handle = open(self.fastafile, 'rb')
+        self._handle.seek(start_byte)
+        data = self._handle.read(end_byte - start_byte)
 
-        # Writing sequence to file using format
-        while pos < len(sequence):
-            OUTF.write(sequence[pos:pos + linewidth] + '\n')
-            pos = pos + linewidth
+        seq = data.replace(b'\n', b'').replace(b'\r', b'').decode()
+        return _format_sequence(seq, case)
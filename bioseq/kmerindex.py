@@ -0,0 +1,234 @@
+import json
+import os
+
+import numpy as np
+
+from bioseq.batch import _run
+from bioseq.composition import AMINO_ACIDS, _alphabet_lookup, _kmer_codes
+from bioseq.fasta import readFASTA, recordName
+from bioseq.profiling import instrument
+
+# Version of the on-disk layout, stored in meta.json
+INDEX_FORMAT = 2
+
+
+class KmerIndex:
+    '''
+    Class holds a persistent k-mer inverted index of a protein (or DNA) database, used to find the database sequences sharing the most k-mers with a query
+    before aligning only those with the aligners of bioseq.alignment.
+
+    An index is a directory of NumPy files, built once with KmerIndex.build and opened with KmerIndex(directory).
+    The files are memory-mapped when opened, so opening is instant and only the parts of the index touched by a query are read from disk.
+        meta.json      k, alphabet and number of sequences
+        names.txt      sequence names, one per line, in index order
+        kmers.npy      the distinct k-mer codes found in the database, sorted
+        offsets.npy    for the k-mer code kmers[i], postings[offsets[i]:offsets[i + 1]] are the sequences containing that k-mer
+        postings.npy   sequence numbers grouped by k-mer, each sequence listed once per distinct k-mer it contains
+        starts.npy     sequence i is residues[starts[i]:starts[i + 1]]
+        residues.npy   the upper case database sequences concatenated, so hits can be aligned without the original fasta file
+    k-mer codes are the column numbers of compositionProfile(k, alphabet), k-mers containing characters outside the alphabet are not indexed.
+    Only k-mers present in the database are stored, so the index grows with the database and not with len(alphabet) ** k.
+
+    Methods:
+    'search(query)' returns the (name, shared k-mers) of the best candidates for a query.
+    'search_many(queries)' yields (query name, name, shared k-mers) for every candidate of every query.
+    'align(query, scoring)' aligns the query against its best candidates and returns (name, shared k-mers, (aln1, aln2, score)) best score first.
+    'align_many(queries, scoring)' yields (query name, name, shared k-mers, (aln1, aln2, score)) for every candidate of every query, across worker processes.
+    'sequence(name)' returns a database sequence.
+    '''
+
+    def __init__(self, directory, mmap=True):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json'), 'rt') as INFILE:
+            meta = json.load(INFILE)
+        if meta.get('format') != INDEX_FORMAT:
+            raise ValueError(f"Unsupported k-mer index format {meta.get('format')} in {directory}")
+
+        self.k = meta['k']
+        self.alphabet = meta['alphabet']
+        with open(os.path.join(directory, 'names.txt'), 'rt') as INFILE:
+            self.names = [line.rstrip('\n') for line in INFILE]
+
+        mode = 'r' if mmap else None
+        self.kmers = np.load(os.path.join(directory, 'kmers.npy'), mmap_mode=mode)
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'), mmap_mode=mode)
+        self.postings = np.load(os.path.join(directory, 'postings.npy'), mmap_mode=mode)
+        self.starts = np.load(os.path.join(directory, 'starts.npy'), mmap_mode=mode)
+        self.residues = np.load(os.path.join(directory, 'residues.npy'), mmap_mode=mode)
+
+        self._lookup = _alphabet_lookup(self.alphabet)
+        self._ids = {name: number for number, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    @classmethod
+    @instrument('kmerindex.KmerIndex.build', lambda args, kwargs, result: (0, len(result)))
+    def build(cls, database, directory, k=3, alphabet=AMINO_ACIDS, batch=10000):
+        '''
+        Builds an index of a database and writes it to directory, which is created if needed. Returns the opened index.
+        database is the filename of a fasta file, read one record at a time and named by the first word of each header, or an iterable of (name, sequence) tuples.
+        k is the k-mer length, alphabet the residues indexed (the 20 standard amino acids by default, use 'ACGT' for DNA).
+        Sequences are indexed in batches of batch sequences, each batch encoded with one pass of NumPy operations.
+        Names must be unique, a ValueError is raised otherwise.
+        k-mer codes are 64 bit integers, a ValueError is raised if len(alphabet) ** k does not fit in them.
+        '''
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        if len(alphabet) ** k > np.iinfo(np.int64).max:
+            raise ValueError(f'k={k} is too large for an alphabet of {len(alphabet)} characters, len(alphabet) ** k must fit in a 64 bit integer')
+        if isinstance(database, str):
+            database = ((recordName(header), seq) for header, seq in readFASTA(database))
+
+        size = len(alphabet)
+        lookup = _alphabet_lookup(alphabet)
+
+        names = []
+        seen = set()
+        residues = []
+        lengths = []
+        kmer_parts = []
+        id_parts = []
+
+        def add(records):
+            # Indexing a batch of records, keeping each distinct (k-mer, sequence) pair once
+            sequences = [seq.upper() for _, seq in records]
+            first = len(names) - len(records)
+            rows, kmers = _kmer_codes(sequences, lookup, size, k)
+            # Sorting by k-mer then row and dropping repeated pairs, combining both into one code could overflow for large alphabets or k
+            order = np.lexsort((rows, kmers))
+            rows, kmers = rows[order], kmers[order]
+            keep = np.ones(len(kmers), dtype=bool)
+            keep[1:] = (kmers[1:] != kmers[:-1]) | (rows[1:] != rows[:-1])
+            kmer_parts.append(kmers[keep])
+            id_parts.append((rows[keep] + first).astype(np.int32))
+            residues.extend(seq.encode('ascii', 'replace') for seq in sequences)
+            lengths.extend(len(seq) for seq in sequences)
+
+        records = []
+        for name, seq in database:
+            if name in seen:
+                raise ValueError(f"Duplicate sequence name '{name}'")
+            seen.add(name)
+            names.append(name)
+            records.append((name, str(seq)))
+            if len(records) == batch:
+                add(records)
+                records = []
+        if records:
+            add(records)
+
+        # Grouping the postings by k-mer, a stable sort keeps the sequences of each k-mer in index order
+        kmers = np.concatenate(kmer_parts) if kmer_parts else np.zeros(0, dtype=np.int64)
+        ids = np.concatenate(id_parts) if id_parts else np.zeros(0, dtype=np.int32)
+        order = np.argsort(kmers, kind='stable')
+        postings = ids[order]
+        codes, counts = np.unique(kmers[order], return_counts=True)
+        offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        starts = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=starts[1:])
+
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'kmers.npy'), codes.astype(np.int64))
+        np.save(os.path.join(directory, 'offsets.npy'), offsets)
+        np.save(os.path.join(directory, 'postings.npy'), postings)
+        np.save(os.path.join(directory, 'starts.npy'), starts)
+        np.save(os.path.join(directory, 'residues.npy'), np.frombuffer(b''.join(residues), dtype=np.uint8))
+        with open(os.path.join(directory, 'names.txt'), 'wt') as OUTF:
+            OUTF.write(''.join(name + '\n' for name in names))
+        # Writing meta.json last, so an interrupted build cannot be opened
+        with open(os.path.join(directory, 'meta.json'), 'wt') as OUTF:
+            json.dump({'format': INDEX_FORMAT, 'k': k, 'alphabet': alphabet, 'sequences': len(names)}, OUTF)
+
+        return cls(directory)
+
+    def sequence(self, name):
+        '''
+        Returns the database sequence of a name (or index number) as an upper case string.
+        '''
+        number = name if isinstance(name, (int, np.integer)) else self._ids[name]
+        return self.residues[self.starts[number]:self.starts[number + 1]].tobytes().decode('ascii')
+
+    def shared_kmers(self, query):
+        '''
+        Returns an array with, for every database sequence, the number of distinct k-mers of query it contains.
+        '''
+        _, kmers = _kmer_codes([query], self._lookup, len(self.alphabet), self.k)
+        kmers = np.unique(kmers)
+        # Looking the query k-mers up in the sorted database k-mers, those not in the database have no postings
+        found = np.searchsorted(self.kmers, kmers)
+        found = found[found < len(self.kmers)]
+        found = found[self.kmers[found] == kmers[:len(found)]]
+        starts = self.offsets[found]
+        lengths = self.offsets[found + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(len(self), dtype=np.int64)
+
+        # Positions of every posting list of the query k-mers, gathered with one fancy index instead of a loop over k-mers
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        return np.bincount(self.postings[positions], minlength=len(self))
+
+    @instrument('kmerindex.KmerIndex.search', lambda args, kwargs, result: (len(args[1]), 1) if len(args) > 1 else (0, 1))
+    def search(self, query, top=10, min_shared=1):
+        '''
+        Returns the database sequences sharing the most distinct k-mers with query, as a list of (name, shared k-mers) tuples, most shared first.
+        At most top candidates are returned (all of them if top is None), and only those sharing at least min_shared k-mers.
+        Ties are broken by index order.
+        '''
+        shared = self.shared_kmers(query)
+        candidates = np.flatnonzero(shared >= max(min_shared, 1))
+        if top is not None and len(candidates) > top:
+            # Keeping every candidate tied with the last place so the tie break below is by index order
+            threshold = np.partition(shared[candidates], len(candidates) - top)[len(candidates) - top]
+            candidates = candidates[shared[candidates] >= threshold]
+        candidates = candidates[np.lexsort((candidates, -shared[candidates]))][:top]
+        return [(self.names[number], int(shared[number])) for number in candidates.tolist()]
+
+    def search_many(self, queries, top=10, min_shared=1):
+        '''
+        Searches every query of a fasta file or iterable of (name, sequence) tuples.
+        This is a generator yielding (query name, name, shared k-mers) tuples, query by query with the candidates of each query most shared first.
+        '''
+        for query_name, query in _records(queries):
+            for name, shared in self.search(query, top, min_shared):
+                yield query_name, name, shared
+
+    def align(self, query, scoring, top=10, min_shared=1, method='local', processes=1, **options):
+        '''
+        Aligns query against the top candidates found by search, using an aligner of bioseq.batch.ALIGNERS (default 'local') and a Scoring object.
+        Returns a list of (name, shared k-mers, (aln1, aln2, score)) tuples, best score first.
+        Other keyword arguments, such as gap_open and gap_extend, are passed on to the aligner. processes works as in batch_align.
+        '''
+        hits = [(name, shared, result) for _, name, shared, result
+                in self.align_many([('query', query)], scoring, top, min_shared, method, processes, **options)]
+        hits.sort(key=lambda hit: -hit[2][2])
+        return hits
+
+    def align_many(self, queries, scoring, top=10, min_shared=1, method='local', processes=1, chunksize=16, **options):
+        '''
+        Aligns every query of a fasta file or iterable of (name, sequence) tuples against its top candidates found by search.
+        This is a generator yielding (query name, name, shared k-mers, (aln1, aln2, score)) tuples in the order of search_many.
+        Alignments are spread over processes worker processes as in batch_align, the default aligns in this process.
+        '''
+        def tasks():
+            for query_name, query in _records(queries):
+                for name, shared in self.search(query, top, min_shared):
+                    yield (query_name, name, shared), (query, self.sequence(name))
+
+        for (query_name, name, shared), result in _run(tasks(), scoring, method, processes, chunksize, True, options):
+            yield query_name, name, shared, result
+
+
+def _records(queries):
+    '''
+    Returns the (name, sequence) records of a fasta filename, or the iterable itself.
+    '''
+    if isinstance(queries, str):
+        return ((recordName(header), seq) for header, seq in readFASTA(queries))
+    return queries
@@ -0,0 +1,364 @@
+'''
+Progressive multiple sequence alignment.
+
+Sequences are aligned in three steps:
+    1. a distance matrix, by default the Manhattan distances between the k-mer composition profiles of the sequences (compositionProfile and distanceArray),
+    2. a guide tree built from the distances with UPGMA or neighbour joining (guide_tree),
+    3. profiles aligned pairwise from the leaves to the root of the guide tree (align_profiles), the alignment of the root holding every sequence.
+Merges of independent subtrees do not depend on each other, so they can run in parallel in worker processes.
+
+A profile is a NumPy uint8 array of ASCII codes with a row per sequence and a column per alignment column, gaps are '-'.
+Two profiles are aligned with the affine gap dynamic programming of alignment._gotoh, where the score of a pair of columns is the
+average Scoring score of every pair of residues, one from each column (pairs with a gap score 0).
+Each column of the dynamic programming is computed with NumPy operations, vertical gaps with a running maximum as in bioseq.screening,
+and only one byte of traceback per cell is stored.
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from bioseq.composition import AMINO_ACIDS, compositionProfile
+from bioseq.distance import distanceArray
+from bioseq.fasta import readFASTA, recordName
+from bioseq.profiling import instrument
+
+GAP = ord('-')
+
+# Settings of each worker process, set once by _init_worker so the Scoring object is only sent to a worker once
+_worker = {}
+
+
+def guide_tree(distances, method='upgma'):
+    '''
+    Builds a guide tree from a square distance matrix (for example from distanceArray) and returns it as a list of merges.
+    Leaves are numbered 0 to n - 1 in matrix order, merge number k is a (left, right) tuple of node numbers and creates node n + k,
+    so the children of a merge are always created before it and the last merge is the root.
+    method is 'upgma' (average linkage, the default) or 'nj' (neighbour joining, rooted at its last join).
+    UPGMA updates one row per merge and costs O(n^2) time, neighbour joining rescans the matrix at each join and costs O(n^3).
+    UPGMA works on one copy of the matrix, neighbour joining on one copy plus a buffer of the same size. float32 matrices are kept as float32.
+    '''
+    if method not in ['upgma', 'nj']:
+        raise ValueError
+    distances = np.asarray(distances)
+    if distances.ndim != 2 or distances.shape[0] != distances.shape[1]:
+        raise ValueError('distances must be a square matrix')
+    matrix = np.array(distances, dtype=np.promote_types(distances.dtype, np.float32))
+    if method == 'upgma':
+        return _upgma(matrix)
+    return _neighbour_joining(matrix)
+
+
+def _upgma(matrix):
+    '''
+    Average linkage clustering, the closest pair of clusters is found from the minimum of each row, which only has to be recomputed
+    for rows whose minimum was one of the merged clusters. matrix is modified in place.
+    '''
+    n = len(matrix)
+    np.fill_diagonal(matrix, np.inf)
+    sizes = np.ones(n)
+    nodes = np.arange(n)
+    row_min = matrix.min(axis=1) if n else np.zeros(0)
+    row_arg = matrix.argmin(axis=1) if n else np.zeros(0, dtype=np.intp)
+
+    merges = []
+    for step in range(n - 1):
+        i = int(np.argmin(row_min))
+        j = int(row_arg[i])
+        merges.append((int(nodes[i]), int(nodes[j])))
+
+        # Cluster i becomes the merged cluster, j is removed by setting its row and column to infinity
+        merged = (sizes[i] * matrix[i] + sizes[j] * matrix[j]) / (sizes[i] + sizes[j])
+        merged[[i, j]] = np.inf
+        matrix[i] = merged
+        matrix[:, i] = merged
+        matrix[j] = np.inf
+        matrix[:, j] = np.inf
+        sizes[i] += sizes[j]
+        nodes[i] = n + step
+        row_min[j] = np.inf
+
+        # Rows whose closest cluster was i or j are rescanned, the others can only have come closer to the merged cluster
+        stale = np.flatnonzero((row_arg == i) | (row_arg == j))
+        stale = stale[np.isfinite(row_min[stale])]
+        closer = merged < row_min
+        row_min[closer] = merged[closer]
+        row_arg[closer] = i
+        stale = np.union1d(stale, [i])
+        row_min[stale] = matrix[stale].min(axis=1)
+        row_arg[stale] = matrix[stale].argmin(axis=1)
+
+    return merges
+
+
+def _neighbour_joining(matrix):
+    '''
+    Neighbour joining. The active clusters are kept in the first r rows and columns of matrix, a joined pair is replaced by the new
+    cluster in the row of the first and the last active row is moved into the row of the second. matrix is modified in place.
+    Row sums are updated with each join instead of recomputed, and the criterion matrix of every join is written into one buffer
+    allocated once, the size of matrix, so memory is about twice the matrix.
+    '''
+    n = len(matrix)
+    nodes = np.arange(n)
+    totals = matrix.sum(axis=1, dtype=np.float64)
+    buffer = np.empty(n * n, dtype=matrix.dtype)
+    merges = []
+    for step in range(n - 1):
+        r = n - step
+        active = matrix[:r, :r]
+        if r > 2:
+            criterion = buffer[:r * r].reshape(r, r)
+            np.multiply(active, r - 2, out=criterion)
+            row_totals = totals[:r].astype(matrix.dtype)
+            criterion -= row_totals[:, None]
+            criterion -= row_totals[None, :]
+            np.fill_diagonal(criterion, np.inf)
+            i, j = divmod(int(np.argmin(criterion)), r)
+        else:
+            i, j = 0, 1
+        if i > j:
+            i, j = j, i
+        merges.append((int(nodes[i]), int(nodes[j])))
+
+        joined = (active[i] + active[j] - active[i, j]) / 2
+        joined[i] = 0
+        # Other clusters lose their distances to i and j and gain their distance to the new cluster
+        totals[:r] += joined - active[i] - active[j]
+        totals[i] = joined.sum(dtype=np.float64)
+        matrix[i, :r] = joined
+        matrix[:r, i] = joined
+        # Moving the last active cluster into row and column j
+        last = r - 1
+        totals[j] = totals[last]
+        matrix[j, :r] = matrix[last, :r]
+        matrix[:r, j] = matrix[:r, last]
+        matrix[j, j] = 0
+        nodes[i] = n + step
+        nodes[j] = nodes[last]
+
+    return merges
+
+
+def align_profiles(profile1, profile2, scoring, gap_open=-11, gap_extend=-1):
+    '''
+    Aligns two profiles (uint8 arrays of ASCII codes, a row per sequence, '-' for gaps) with affine gap penalties and a Scoring object.
+    Returns the merged profile, the rows of profile1 followed by the rows of profile2, and the alignment score.
+    The score of a pair of columns is the average score of their pairs of residues, so two single sequences are aligned exactly as by global_align.
+    Memory is one byte per pair of columns for the traceback, plus the column pair scores.
+    '''
+    profile1 = np.asarray(profile1, dtype=np.uint8)
+    profile2 = np.asarray(profile2, dtype=np.uint8)
+    scores = _column_scores(profile1, profile2, scoring)
+    ops, score = _profile_gotoh(scores, float(gap_open), float(gap_extend))
+
+    # Column of each profile for every alignment column, -1 for a gap column
+    ops = np.frombuffer(ops.encode('ascii'), dtype=np.uint8)
+    uses1 = ops != ord('I')
+    uses2 = ops != ord('D')
+    columns1 = np.where(uses1, np.cumsum(uses1) - 1, -1)
+    columns2 = np.where(uses2, np.cumsum(uses2) - 1, -1)
+
+    merged = np.full((len(profile1) + len(profile2), len(ops)), GAP, dtype=np.uint8)
+    merged[:len(profile1), uses1] = profile1[:, columns1[uses1]]
+    merged[len(profile1):, uses2] = profile2[:, columns2[uses2]]
+    return merged, score
+
+
+def _column_scores(profile1, profile2, scoring):
+    '''
+    Returns the matrix of average residue pair scores between every column of profile1 and every column of profile2.
+    Residue counts of each column are multiplied through the Scoring matrix restricted to the residues present, gaps are not counted.
+    '''
+    codes = np.union1d(np.unique(profile1), np.unique(profile2))
+    codes = codes[codes != GAP]
+    substitution = scoring.array[np.ix_(codes, codes)].astype(np.float64)
+
+    lookup = np.full(256, len(codes), dtype=np.intp)
+    lookup[codes] = np.arange(len(codes))
+
+    def counts(profile):
+        # Residue counts of each column, the extra last column counting gaps is dropped
+        columns = profile.shape[1]
+        index = np.arange(columns) * (len(codes) + 1) + lookup[profile]
+        return np.bincount(index.ravel(), minlength=columns * (len(codes) + 1)).reshape(columns, len(codes) + 1)[:, :-1]
+
+    pairs = max(len(profile1) * len(profile2), 1)
+    return counts(profile1) @ substitution @ counts(profile2).T / pairs
+
+
+def _profile_gotoh(scores, gap_open, gap_extend):
+    '''
+    Global affine gap alignment of the rows and columns of a column pair score matrix, returns the alignment operations as a string and the score.
+    States and tie breaks follow alignment._gotoh: M aligns two columns, X a column of the first profile to a gap (D), Y a column of the second profile to a gap (I).
+    The dynamic programming runs over columns of the second profile, each one computed as vectors over the first profile.
+    Traceback stores the previous state of M, X and Y of each cell in 2 bits each of one byte.
+    '''
+    rows, columns = scores.shape
+    decay = np.arange(rows, dtype=np.float64) * gap_extend
+    opening = gap_open - decay
+    trace = np.zeros((columns + 1, rows + 1), dtype=np.uint8)
+
+    # Scores of the M, X and Y states in the previous and current column, column 0 has the first profile aligned to a gap
+    previous = np.full((3, rows + 1), -np.inf)
+    previous[0, 0] = 0
+    previous[1, 1:] = gap_open + decay
+    current = np.full((3, rows + 1), -np.inf)
+    trace[0, 2:] = 1 << 2
+    candidates = np.empty((3, rows + 1))
+    vertical = np.empty((3, rows))
+
+    for j in range(1, columns + 1):
+        # Match, from the best state of the cell up and to the left
+        best, state = _best_state(previous)
+        current[:2, 0] = -np.inf
+        np.add(best[:-1], scores[:, j - 1], out=current[0, 1:])
+
+        # Second profile column aligned to a gap, from the cell to the left
+        np.add(previous[:2], gap_open, out=candidates[:2])
+        np.add(previous[2], gap_extend, out=candidates[2])
+        state[1:] = state[:-1]
+        current[2], across = _best_state(candidates)
+        state |= across << 4
+
+        # First profile column aligned to a gap, from the cells above, as a running maximum of opened gaps
+        if rows:
+            np.maximum(current[0, :-1], current[2, :-1], out=vertical[0])
+            vertical[0] += opening
+            np.maximum.accumulate(vertical[0], out=vertical[0])
+            np.add(vertical[0], decay, out=current[1, 1:])
+            np.add(current[:, :-1], gap_open, out=vertical)
+            vertical[1] += gap_extend - gap_open
+            state[1:] |= _best_state(vertical)[1] << 2
+        trace[j] = state
+        previous, current = current, previous
+
+    match, down, across = previous
+    final = np.array((match[rows], down[rows], across[rows]))
+    state = int(final.argmax())
+    score = float(final[state])
+
+    ops = []
+    i, j = rows, columns
+    while i > 0 or j > 0:
+        cell = int(trace[j, i])
+        if state == 0:
+            ops.append('M')
+            state = cell & 3
+            i -= 1
+            j -= 1
+        elif state == 1:
+            ops.append('D')
+            state = (cell >> 2) & 3
+            i -= 1
+        else:
+            ops.append('I')
+            state = (cell >> 4) & 3
+            j -= 1
+    ops.reverse()
+
+    return ''.join(ops), score
+
+
+def _best_state(values):
+    '''
+    Returns the maximum of the three rows of values and the number of the first row reaching it, like max and argmax along axis 0
+    but with whole row operations, which are faster for three rows.
+    '''
+    best = np.maximum(values[0], values[1])
+    state = np.where(values[2] > best, 2, values[1] > values[0])
+    np.maximum(best, values[2], out=best)
+    return best, state
+
+
+def _init_worker(scoring, gap_open, gap_extend):
+    '''
+    Stores the Scoring object and gap penalties in a worker process.
+    '''
+    _worker['scoring'] = scoring
+    _worker['gap_open'] = gap_open
+    _worker['gap_extend'] = gap_extend
+
+
+def _merge_task(profile1, profile2):
+    '''
+    Aligns two profiles in a worker process and returns the merged profile.
+    '''
+    return align_profiles(profile1, profile2, _worker['scoring'], _worker['gap_open'], _worker['gap_extend'])[0]
+
+
+@instrument('msa.progressive_align', lambda args, kwargs, result: (0, len(result)))
+def progressive_align(records, scoring, gap_open=-11, gap_extend=-1, tree='upgma', distances=None, k=2, alphabet=AMINO_ACIDS, processes=1):
+    '''
+    Aligns a family of sequences progressively and returns a list of (name, aligned sequence) tuples in input order.
+    records is the filename of a fasta file (named by the first word of each header) or an iterable of (name, sequence) tuples.
+    Sequences are converted to uppercase. The gap penalties work as in global_align, a gap of length k scoring gap_open + (k - 1) * gap_extend.
+
+    tree is 'upgma' or 'nj' (see guide_tree), or a list of merges in the format returned by guide_tree.
+    distances is a square matrix of pairwise distances in input order. When it is None, distances between k-mer composition profiles
+    of the sequences are used (k and alphabet as in compositionProfile, use alphabet='ACGT' for DNA), computed as float32.
+    processes is the number of worker processes aligning independent subtrees at the same time (None for one per CPU), the default aligns in this process.
+    Each sequence is held once as a row of a uint8 profile, so memory is about the number of sequences times the alignment length,
+    plus the distance matrix and one byte per pair of columns of the two profiles being merged in each process.
+    '''
+    if isinstance(records, str):
+        records = ((recordName(header), seq) for header, seq in readFASTA(records))
+    records = [(name, str(seq).upper()) for name, seq in records]
+    if not records:
+        return []
+
+    if isinstance(tree, str):
+        if distances is None:
+            profiles = compositionProfile([seq for _, seq in records], k, alphabet)
+            distances = distanceArray(profiles, 'l2', dtype=np.float32)
+        tree = guide_tree(distances, tree)
+    n = len(records)
+    if len(tree) != n - 1:
+        raise ValueError('The guide tree must have one merge less than the number of sequences')
+
+    # Profiles of the nodes not merged yet, with the input numbers of their sequences
+    profiles = {number: np.frombuffer(seq.encode('latin-1', 'replace'), dtype=np.uint8).reshape(1, -1)
+                for number, (_, seq) in enumerate(records)}
+    members = {number: [number] for number in range(n)}
+
+    def finish(step, merged):
+        # Replacing the profiles of the children of a merge by its own
+        left, right = tree[step]
+        profiles[n + step] = merged
+        members[n + step] = members.pop(left) + members.pop(right)
+        del profiles[left], profiles[right]
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    if processes <= 1 or n < 3:
+        for step, (left, right) in enumerate(tree):
+            finish(step, align_profiles(profiles[left], profiles[right], scoring, gap_open, gap_extend)[0])
+    else:
+        # Submitting every merge as soon as both of its children are aligned
+        parents = {}
+        for step, (left, right) in enumerate(tree):
+            parents[left] = step
+            parents[right] = step
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(scoring, gap_open, gap_extend)) as executor:
+            pending = {}
+
+            def submit(step):
+                left, right = tree[step]
+                pending[executor.submit(_merge_task, profiles[left], profiles[right])] = step
+
+            for step, (left, right) in enumerate(tree):
+                if left < n and right < n:
+                    submit(step)
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = pending.pop(future)
+                    finish(step, future.result())
+                    parent = parents.get(n + step)
+                    if parent is not None and all(child in profiles for child in tree[parent]):
+                        submit(parent)
+
+    root = profiles.popitem()[1]
+    order = np.argsort(members.popitem()[1])
+    return [(records[number][0], root[row].tobytes().decode('latin-1')) for number, row in enumerate(order.tolist())]
@@ -0,0 +1,409 @@
+import numpy as np
+
+from bioseq.distance import readTable, _block_distance, _table_profiles
+from bioseq.profiling import instrument
+
+# Above this many features 'auto' uses a random projection forest, KD-tree pruning stops paying off in high dimensions
+KDTREE_MAX_DIMENSIONS = 16
+
+# Queries searched together, sharing one traversal of the tree
+_GROUP = 256
+
+# Number of neighbours kept per profile in the neighbour graph used by 'rpforest' refinement
+GRAPH_NEIGHBOURS = 16
+
+
+class NeighbourIndex:
+    '''
+    Class finds the nearest neighbours of composition profiles (rows of compositionProfile, AAtypeProfile or an AAtypetable csv)
+    without computing the full distance matrix.
+    Metrics are the ones of bioseq.distance, 'l1'=Euclidean distance and 'l2'=Manhattan distance.
+
+    Two methods are available:
+    'kdtree' is exact. Profiles are split on one feature at a time into a tree of boxes, and boxes further away than the current k-th neighbour are skipped.
+    It suits low-dimensional profiles such as the 3 amino acid class proportions.
+    'rpforest' is approximate. Each of trees trees splits the profiles on random directions, and the candidates of a query are the profiles
+    sharing a leaf with it in any tree. The candidates are then refined refine times through a graph linking every profile to its GRAPH_NEIGHBOURS
+    nearest profiles: the neighbours of the current neighbours of a query become candidates too.
+    The graph is built with the forest on the first query and saved with the index.
+    More trees, a larger leaf_size or more refine rounds find more of the true neighbours at a higher cost.
+    It suits high-dimensional profiles such as k-mer frequencies.
+    'auto' (default) picks 'kdtree' for at most KDTREE_MAX_DIMENSIONS features and 'rpforest' otherwise.
+
+    Queries are answered in batches, queries falling in the same leaf are searched together with NumPy operations.
+
+    Methods:
+    'query(points, k)' returns the distances and row numbers of the k nearest profiles of every point, nearest first.
+    'neighbours(k)' yields (name, [(name, distance), ...]) for every profile of the index, excluding the profile itself.
+    'save(filename)' writes the index to a .npz file, read back with NeighbourIndex.load(filename).
+    'NeighbourIndex.from_table(csvfile)' builds an index from an AAtypetable csv.
+    '''
+
+    def __init__(self, profiles, metric='l1', names=None, method='auto', leaf_size=64, trees=8, refine=1, seed=0):
+        if metric not in ['l1', 'l2']:
+            raise ValueError
+        if method not in ['auto', 'kdtree', 'rpforest']:
+            raise ValueError
+        if leaf_size < 1:
+            raise ValueError('leaf_size must be at least 1')
+
+        self.profiles = np.ascontiguousarray(profiles, dtype=np.float64)
+        if self.profiles.ndim != 2:
+            raise ValueError('profiles must be a 2D matrix with a row per profile')
+        self.metric = metric
+        self.names = list(names) if names is not None else [str(number) for number in range(len(self.profiles))]
+        if len(self.names) != len(self.profiles):
+            raise ValueError('names must have one name per profile')
+
+        if method == 'auto':
+            method = 'kdtree' if self.profiles.shape[1] <= KDTREE_MAX_DIMENSIONS else 'rpforest'
+        self.method = method
+
+        if method == 'kdtree':
+            self._tree = _build_kdtree(self.profiles, leaf_size)
+        else:
+            self._tree = _build_rpforest(self.profiles, leaf_size, trees, np.random.default_rng(seed))
+            self._tree['refine'] = np.array(refine)
+
+    def __len__(self):
+        return len(self.profiles)
+
+    @classmethod
+    def from_table(cls, csvfile, metric='l1', **options):
+        '''
+        Builds an index from a csv table read with readTable, such as the output of AAtypetable. Rows are named by the first column.
+        '''
+        data = readTable(csvfile)
+        keys = list(data)
+        return cls(_table_profiles(data, keys), metric, keys, **options)
+
+    @instrument('neighbours.NeighbourIndex.query', lambda args, kwargs, result: (0, len(result[0])))
+    def query(self, points=None, k=10):
+        '''
+        Finds the k nearest profiles of every row of points, a matrix with the same number of features as the index.
+        Returns two (len(points), k) arrays, the distances and the row numbers of the neighbours, nearest first.
+        If there are fewer than k profiles the missing neighbours have distance inf and row number -1.
+
+        Without points the profiles of the index itself are queried and each profile is left out of its own neighbours.
+        '''
+        if k < 1:
+            raise ValueError('k must be at least 1')
+
+        if points is None:
+            distances, indices = self._search(self.profiles, k + 1)
+            # Removing each profile from its own neighbours by moving it last, if a tie did not already push it out
+            own = indices == np.arange(len(self))[:, None]
+            distances[own] = np.inf
+            order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+            return np.take_along_axis(distances, order, 1), np.take_along_axis(np.where(own, -1, indices), order, 1)
+
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim == 1:
+            points = points[None, :]
+        if points.shape[1] != self.profiles.shape[1]:
+            raise ValueError(f'points have {points.shape[1]} features, the index has {self.profiles.shape[1]}')
+        return self._search(points, k)
+
+    def neighbours(self, k=10):
+        '''
+        Yields (name, [(neighbour name, distance), ...]) for every profile of the index, with its k nearest other profiles, nearest first.
+        '''
+        distances, indices = self.query(None, k)
+        for name, row_distances, row_indices in zip(self.names, distances.tolist(), indices.tolist()):
+            yield name, [(self.names[index], distance) for distance, index in zip(row_distances, row_indices) if index >= 0]
+
+    def save(self, filename):
+        '''
+        Writes the profiles, names, settings and trees of the index to a NumPy .npz file.
+        '''
+        np.savez(filename, profiles=self.profiles, names=np.array(self.names, dtype=str),
+                 metric=np.array(self.metric), method=np.array(self.method), **self._tree)
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Reads an index written by save, without rebuilding the trees.
+        '''
+        with np.load(filename, allow_pickle=False) as data:
+            index = cls.__new__(cls)
+            index.profiles = data['profiles']
+            index.names = data['names'].tolist()
+            index.metric = str(data['metric'])
+            index.method = str(data['method'])
+            index._tree = {name: data[name] for name in data.files if name not in ('profiles', 'names', 'metric', 'method')}
+        return index
+
+    def _search(self, points, k):
+        '''
+        Returns the distances and row numbers of the k nearest profiles of every point.
+        Points are grouped by the leaf they fall in, each group is searched together.
+        '''
+        best_distances = np.full((len(points), k), np.inf)
+        best_indices = np.full((len(points), k), -1, dtype=np.int64)
+        if len(self) == 0 or len(points) == 0:
+            return best_distances, best_indices
+
+        tree = self._tree
+        roots = tree['roots'].tolist()
+        if self.method == 'kdtree':
+            # Grouping points by the smallest node holding at most _GROUP profiles, nearby points share most of their traversal
+            for group in _groups(_descend(tree, points, roots[0], _GROUP)):
+                best_distances[group], best_indices[group] = self._kdtree_group(points[group], k)
+        elif points is self.profiles and k <= min(GRAPH_NEIGHBOURS, len(self)):
+            # The neighbours of the profiles of the index are the rows of its refined graph
+            self._graph()
+            return tree['graph_distances'][:, :k].copy(), tree['graph'][:, :k].copy()
+        else:
+            best_distances, best_indices = self._forest_search(points, k)
+            if int(tree['refine']):
+                graph = self._graph()
+                for _ in range(int(tree['refine'])):
+                    best_distances, best_indices = self._expand(points, best_distances, best_indices, graph)
+        return best_distances, best_indices
+
+    def _forest_search(self, points, k):
+        '''
+        Returns the k nearest profiles of every point among the profiles sharing a leaf with it in any tree of the forest.
+        '''
+        tree = self._tree
+        best_distances = np.full((len(points), k), np.inf)
+        best_indices = np.full((len(points), k), -1, dtype=np.int64)
+        for root in tree['roots'].tolist():
+            leaves = _descend(tree, points, root)
+            for group in _groups(leaves):
+                leaf = leaves[group[0]]
+                candidates = tree['order'][tree['start'][leaf]:tree['end'][leaf]]
+                best_distances[group], best_indices[group] = _merge(best_distances[group], best_indices[group],
+                                                                    _block_distance(points[group], self.profiles[candidates], self.metric),
+                                                                    candidates, k, unique=True)
+        return best_distances, best_indices
+
+    def _graph(self):
+        '''
+        Returns the neighbour graph of the index, a matrix with the GRAPH_NEIGHBOURS nearest profiles of every profile (itself included),
+        found with the forest and refined through itself refine times. The graph is built once and kept in the tree.
+        '''
+        if 'graph' not in self._tree:
+            width = min(GRAPH_NEIGHBOURS, len(self))
+            distances, graph = self._forest_search(self.profiles, width)
+            for _ in range(int(self._tree['refine'])):
+                distances, graph = self._expand(self.profiles, distances, graph, graph)
+            self._tree['graph'] = graph
+            self._tree['graph_distances'] = distances
+        return self._tree['graph']
+
+    def _expand(self, points, best_distances, best_indices, graph):
+        '''
+        One round of refinement, the graph neighbours of the current neighbours of every point are added as candidates.
+        Points are processed in groups sharing their nearest neighbour, so the candidates of a group overlap
+        and their distances are computed once, as one block against the distinct candidates of the group.
+        '''
+        k = best_indices.shape[1]
+        best_distances = best_distances.copy()
+        best_indices = best_indices.copy()
+        order = np.argsort(best_indices[:, 0], kind='stable')
+        for start in range(0, len(points), _GROUP // 4):
+            rows = order[start:start + _GROUP // 4]
+            current = best_indices[rows]
+            candidates = np.where(current[:, :, None] >= 0, graph[current], -1).reshape(len(rows), -1)
+
+            # Removing repeated candidates of a point, they would fill its neighbours with copies
+            candidates = np.sort(candidates, axis=1)
+            repeated = np.zeros(candidates.shape, dtype=bool)
+            repeated[:, 1:] = candidates[:, 1:] == candidates[:, :-1]
+
+            distinct, position = np.unique(candidates, return_inverse=True)
+            block = _block_distance(points[rows], self.profiles[np.maximum(distinct, 0)], self.metric)
+            distances = np.take_along_axis(block, position.reshape(candidates.shape), 1)
+            distances[repeated | (candidates < 0)] = np.inf
+
+            best_distances[rows], best_indices[rows] = _merge(best_distances[rows], best_indices[rows], distances, candidates, k, unique=True)
+        return best_distances, best_indices
+
+    def _kdtree_group(self, points, k):
+        '''
+        Searches the KD-tree for a group of points, visiting the nearer child of each node first
+        and skipping nodes whose box is further from every point than its current k-th neighbour.
+        '''
+        tree = self._tree
+        left, right, dim, value = tree['left'], tree['right'], tree['dim'], tree['value']
+        best_distances = np.full((len(points), k), np.inf)
+        best_indices = np.full((len(points), k), -1, dtype=np.int64)
+        centre = points.mean(axis=0)
+
+        stack = [int(tree['roots'][0])]
+        while stack:
+            node = stack.pop()
+            active = _box_distance(points, tree['lo'][node], tree['hi'][node], self.metric) < best_distances[:, -1]
+            if not active.any():
+                continue
+            if left[node] < 0:
+                # Only the points which can still gain a neighbour from this leaf are updated
+                active = np.flatnonzero(active)
+                candidates = tree['order'][tree['start'][node]:tree['end'][node]]
+                best_distances[active], best_indices[active] = _merge(best_distances[active], best_indices[active],
+                                                                      _block_distance(points[active], self.profiles[candidates], self.metric), candidates, k)
+            elif centre[dim[node]] <= value[node]:
+                stack.extend((int(right[node]), int(left[node])))
+            else:
+                stack.extend((int(left[node]), int(right[node])))
+
+        return best_distances, best_indices
+
+
+def _merge(best_distances, best_indices, distances, candidates, k, unique=False):
+    '''
+    Merges a block of candidate distances into the current k nearest neighbours of each point, nearest first.
+    With unique=True candidates already among the neighbours of a point are ignored, used when candidates come from several trees.
+    '''
+    candidates = np.broadcast_to(candidates, distances.shape)
+    if unique:
+        seen = (candidates[:, :, None] == best_indices[:, None, :]).any(axis=2)
+        distances = np.where(seen, np.inf, distances)
+    all_distances = np.concatenate([best_distances, distances], axis=1)
+    all_indices = np.concatenate([best_indices, candidates], axis=1)
+    order = np.argsort(all_distances, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(all_distances, order, 1), np.take_along_axis(all_indices, order, 1)
+
+
+def _box_distance(points, lo, hi, metric):
+    '''
+    Returns the distance from every point to the nearest point of a box.
+    '''
+    gap = np.maximum(0, np.maximum(lo - points, points - hi))
+    if metric == 'l1':
+        return np.sqrt((gap * gap).sum(axis=1))
+    return gap.sum(axis=1)
+
+
+def _descend(tree, points, root, stop=0):
+    '''
+    Returns the leaf reached by every point from a root, all points stepping down one level at a time.
+    With stop, points stop at the first node holding at most stop profiles instead.
+    KD-tree nodes split on a feature dim, random projection nodes on a direction normal.
+    '''
+    left, right, value = tree['left'], tree['right'], tree['value']
+    size = tree['end'] - tree['start']
+    node = np.full(len(points), root, dtype=np.int64)
+    inner = np.flatnonzero((left[node] >= 0) & (size[node] > stop))
+    while len(inner):
+        current = node[inner]
+        if 'normal' in tree:
+            projection = np.einsum('ij,ij->i', points[inner], tree['normal'][current])
+        else:
+            projection = points[inner, tree['dim'][current]]
+        node[inner] = np.where(projection <= value[current], left[current], right[current])
+        inner = inner[(left[node[inner]] >= 0) & (size[node[inner]] > stop)]
+    return node
+
+
+def _groups(leaves):
+    '''
+    Yields the point numbers falling in each leaf, split into groups of at most _GROUP points.
+    '''
+    order = np.argsort(leaves, kind='stable')
+    boundaries = np.flatnonzero(np.diff(leaves[order])) + 1
+    for group in np.split(order, boundaries):
+        for start in range(0, len(group), _GROUP):
+            yield group[start:start + _GROUP]
+
+
+def _build_kdtree(profiles, leaf_size):
+    '''
+    Builds a KD-tree, splitting each node at the median of its widest feature. Returns the tree as a dictionary of arrays:
+    left and right children (-1 for leaves), the split feature dim and value, the points of node i as order[start[i]:end[i]]
+    and the bounding box of its points lo[i], hi[i].
+    '''
+    n, d = profiles.shape
+    order = np.arange(n)
+    left, right, dims, values, starts, ends, los, his = [], [], [], [], [], [], [], []
+
+    def add(start, end):
+        points = profiles[order[start:end]]
+        los.append(points.min(axis=0) if end > start else np.zeros(d))
+        his.append(points.max(axis=0) if end > start else np.zeros(d))
+        for values_list, value in ((left, -1), (right, -1), (dims, 0), (values, 0.0), (starts, start), (ends, end)):
+            values_list.append(value)
+        return len(left) - 1
+
+    stack = [add(0, n)]
+    while stack:
+        node = stack.pop()
+        start, end = starts[node], ends[node]
+        if end - start <= leaf_size:
+            continue
+        widths = his[node] - los[node]
+        dim = int(np.argmax(widths))
+        if widths[dim] == 0:
+            continue  # identical points cannot be split
+
+        # Splitting at the median so the tree stays balanced
+        middle = (end - start) // 2
+        part = np.argpartition(profiles[order[start:end], dim], middle - 1)
+        order[start:end] = order[start:end][part]
+        dims[node] = dim
+        values[node] = float(profiles[order[start:start + middle], dim].max())
+        left[node] = add(start, start + middle)
+        right[node] = add(start + middle, end)
+        stack.extend((left[node], right[node]))
+
+    return {'roots': np.zeros(1, dtype=np.int64), 'left': np.array(left, dtype=np.int64), 'right': np.array(right, dtype=np.int64),
+            'dim': np.array(dims, dtype=np.int64), 'value': np.array(values), 'start': np.array(starts, dtype=np.int64),
+            'end': np.array(ends, dtype=np.int64), 'order': order, 'lo': np.array(los).reshape(-1, d), 'hi': np.array(his).reshape(-1, d)}
+
+
+def _build_rpforest(profiles, leaf_size, trees, rng):
+    '''
+    Builds a forest of random projection trees. Each node splits its points at the median of their projection on the direction between
+    two of its points chosen at random. Returns the forest as a dictionary of arrays in the layout of _build_kdtree,
+    with the split direction of node i in normal[i] instead of a feature, and the root of each tree in roots.
+    The points of each tree are stored one after the other in order.
+    '''
+    n, d = profiles.shape
+    left, right, values, starts, ends, normals = [], [], [], [], [], []
+    orders = []
+    roots = []
+
+    def add(start, end):
+        for values_list, value in ((left, -1), (right, -1), (values, 0.0), (starts, start), (ends, end)):
+            values_list.append(value)
+        normals.append(np.zeros(d, dtype=np.float32))
+        return len(left) - 1
+
+    for tree in range(trees):
+        offset = tree * n
+        order = np.arange(n)
+        roots.append(add(offset, offset + n))
+        stack = [roots[-1]]
+        while stack:
+            node = stack.pop()
+            start, end = starts[node] - offset, ends[node] - offset
+            if end - start <= leaf_size:
+                continue
+            points = profiles[order[start:end]]
+            middle = (end - start) // 2
+            first, second = rng.choice(end - start, 2, replace=False)
+
+            # Trying the direction between two points, then a random direction if too many points project to the same value
+            for normal in (points[first] - points[second], rng.standard_normal(d)):
+                # Directions are stored as float32 to keep the forest compact, so the split is computed with the stored direction
+                normal = normal.astype(np.float32)
+                projection = points @ normal.astype(np.float64)
+                part = np.argpartition(projection, middle - 1)
+                if projection[part[:middle]].max() < projection[part[middle:]].min():
+                    break
+            else:
+                continue
+
+            order[start:end] = order[start:end][part]
+            normals[node] = normal
+            values[node] = float(projection[part[:middle]].max())
+            left[node] = add(offset + start, offset + start + middle)
+            right[node] = add(offset + start + middle, offset + end)
+            stack.extend((left[node], right[node]))
+        orders.append(order)
+
+    return {'roots': np.array(roots, dtype=np.int64), 'left': np.array(left, dtype=np.int64), 'right': np.array(right, dtype=np.int64),
+            'value': np.array(values), 'start': np.array(starts, dtype=np.int64), 'end': np.array(ends, dtype=np.int64),
+            'order': np.concatenate(orders) if orders else np.zeros(0, dtype=np.int64),
+            'normal': np.array(normals, dtype=np.float32).reshape(-1, d)}
@@ -1,6 +1,23 @@
+import os
 import re
-from bioseq.translation import translate
-from bioseq.fasta import readFASTAseq, writeFASTA
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bioseq.packed import PackedDNA
+from bioseq.translation import encode, reverse_complement, codon_indices, codon_index, amino_acids, STOP_CODONS, frame_list_names
+from bioseq.fasta import readFASTAseq, writeFASTA, readFASTAchunks, readFASTAindex, recordName
+from bioseq.profiling import instrument, sequence_argument, generator_sequence_argument
+
+# Open reading frame found by findORFs.
+# frame is the reading frame name used by translate ('f1'-'f3', 'r1'-'r3').
+# start and end are 0-based coordinates on the forward strand, end is exclusive and includes the stop codon.
+# length is the number of amino acids in the protein, which excludes the stop codon.
+ORF = namedtuple('ORF', ['frame', 'start', 'end', 'length', 'protein'])
+
+# Default number of bases scanned at a time by findORFsChunked and scanORFs, a multiple of 3
+CHUNK_SIZE = 3 << 20
 
 def openReadingFrame(aaseq, n=0):
     '''
@@ -27,45 +44,398 @@ def openReadingFrame(aaseq, n=0):
         return ('')  # returns empty string if no match is found.
 
 
-def candidateProtein(dnaseq):
+@instrument('orf.findORFs', generator_sequence_argument)
+def findORFs(dnaseq, minlength=0, starts=('ATG',)):
     '''
-    Returns the longest Open reading frame in a DNA sequence.
-    The sequence is converted into its Amino acid sequence and the longest string between a Methionine and a stop codon is returned.
-    '''
-    # translating DNA to Amino acid sequence
-    t1 = translate(dnaseq)
-    aaseq = t1['f1']  # taking the first forward reading frame
-
-    # creating loop to return all possible orfs
-    i = 0  # Creating index to cycle through
-    all_orf = []
-    while True:  # loop through all possible indexes of orfs
-        try:
-            orf = openReadingFrame(aaseq, i)
-            if not orf:
-                break
-            all_orf.append(orf)
-            i += 1  # increment index by one
-        except IndexError:
-            break
-
-    # Loop through all orf sequences and keep the longest
-    longest = all_orf[0]
-    for seq in all_orf:
-        if len(seq) > len(longest):
-            longest = seq
-
-    if longest:
-        return longest
+    Finds open reading frames in all six reading frames of a DNA sequence and yields them as ORF tuples of (frame, start, end, length, protein).
+    An open reading frame runs from a start codon up to the next stop codon in the same frame. As in openReadingFrame, starts found inside an open reading frame do not begin a new one.
+    Reverse frames are read on the reverse complement, their coordinates are reported on the forward strand.
+    ORFs are yielded frame by frame in the order f1, f2, f3, r1, r2, r3, and in reading order within a frame.
+
+    minlength is the minimum protein length in amino acids, shorter ORFs are skipped.
+    starts is a tuple of start codons. Alternative start codons such as 'GTG' and 'TTG' can be added, the protein of an ORF always begins with 'M'.
+    The sequence is scanned once per strand, so run time is linear in the sequence length.
+    '''
+    start_codons = np.array([codon_index(codon) for codon in starts])
+
+    codes = encode(dnaseq)
+    length = len(codes)
+
+    for strand_name, strand in (('f', codes), ('r', reverse_complement(codes))):
+        # Codon index at every position of the strand and where stops and starts are found
+        indices = codon_indices(strand)
+        is_stop = np.isin(indices, STOP_CODONS)
+        is_start = np.isin(indices, start_codons)
+
+        for k in range(3):
+            frame_indices = indices[k::3]
+            stop_pos = np.flatnonzero(is_stop[k::3])
+            start_pos = np.flatnonzero(is_start[k::3])
+
+            # Each start is paired with the next stop in the frame, only the first start before every stop begins an ORF
+            next_stop = np.searchsorted(stop_pos, start_pos, side='right')
+            closed = next_stop < len(stop_pos)
+            stop_groups, first = np.unique(next_stop[closed], return_index=True)
+            orf_starts = start_pos[closed][first]
+            orf_stops = stop_pos[stop_groups]
+
+            frame = strand_name + str(k + 1)
+            for s, e in zip(orf_starts.tolist(), orf_stops.tolist()):
+                if e - s < minlength:
+                    continue
+
+                # Converting codon positions into nucleotide coordinates on the forward strand
+                nt_start = k + 3 * s
+                nt_end = k + 3 * (e + 1)
+                if strand_name == 'r':
+                    nt_start, nt_end = length - nt_end, length - nt_start
+
+                protein = 'M' + amino_acids(frame_indices[s + 1:e]).upper()
+                yield ORF(frame, nt_start, nt_end, e - s, protein)
+
+
+@instrument('orf.findORFsChunked')
+def findORFsChunked(dnaseq, minlength=0, starts=('ATG',), chunksize=CHUNK_SIZE, processes=1, length=None):
+    '''
+    Finds the same open reading frames as findORFs, scanning the sequence in windows of chunksize bases so that memory is proportional to chunksize
+    (plus the protein of the longest ORF) instead of the sequence length. dnaseq is a DNA string, a PackedDNA sequence, or an iterable of strings
+    which are consecutive pieces of one sequence (for example its fasta lines), which is read lazily.
+
+    chunksize must be a multiple of 3, so every window begins in reading frame f1, and each window overlaps the next one by 2 bases so that
+    every codon lies whole in the window it starts in. ORFs crossing window ends are joined across windows, each one is found exactly once whatever its length.
+    Windows are scanned in processes worker processes (None for one per CPU), the default scans them in this process. They are joined in this process.
+
+    ORFs are yielded as soon as they are complete, window by window, so they are not in the order of findORFs.
+    The names of reverse frames depend on the sequence length. It is known for strings and PackedDNA sequences, for pieces it is given as length.
+    If the length of pieces is not given, reverse ORFs are kept until the end of the sequence and then yielded, so their memory grows with the sequence.
+    A ValueError is raised at the end of the sequence if length does not match it.
+    '''
+    if isinstance(dnaseq, (str, PackedDNA)):
+        length = len(dnaseq)
+        windows = _sequence_windows(dnaseq, chunksize)
     else:
-        return ''
+        windows = _piece_windows(dnaseq, chunksize)
+    for _, orf in _chunked_orfs((('', start, window) for start, window in windows), minlength, starts, chunksize, processes, lambda header: length):
+        yield orf
 
 
-def maximalORF(inputfile, outputfile, proteinname):
+@instrument('orf.scanORFs')
+def scanORFs(fastafile, minlength=0, starts=('ATG',), chunksize=CHUNK_SIZE, processes=1, lengths=None, numbered=False):
     '''
-    Takes an input of a file containing a string of DNA and outputs a fasta file in of the longest Open reading frame in the sequence.
-    The function requires the use of other function found in this module: 'readFASTAseq', 'translate', 'candidateProtein', and 'writeFASTA'.
+    Finds the open reading frames of every record of a fasta file as findORFsChunked does, reading the file with readFASTAchunks
+    so that no record is ever held in memory as a whole. '-' reads from standard input and gzip input is accepted.
+    This is a generator yielding (header, ORF) tuples, record by record.
+
+    Reverse ORFs are yielded as soon as they are complete when the length of their record is known, otherwise at the end of the record (see findORFsChunked).
+    lengths is a dictionary of {record name: sequence length}, names being the first word of headers. By default the lengths are read from
+    the '.fai' index of the file (see buildFASTAindex and FASTAIndex) if it exists and is up to date, the index is not built.
+
+    With numbered=True (record number, header, ORF) tuples are yielded instead, records numbered from 0 in file order,
+    so the ORFs of consecutive records with the same header can be told apart.
+    '''
+    if lengths is None:
+        lengths = _index_lengths(fastafile)
+
+    def windows():
+        # Numbering records from the first window of each
+        number = -1
+        for header, start, chunk in readFASTAchunks(fastafile, chunksize, 2):
+            number += start == 0
+            yield (number, header), start, chunk
 
+    for (number, header), orf in _chunked_orfs(windows(), minlength, starts, chunksize, processes, lambda key: lengths.get(recordName(key[1]))):
+        yield (number, header, orf) if numbered else (header, orf)
+
+
+def _index_lengths(fastafile):
+    '''
+    Returns the {name: length} dictionary of the '.fai' index of a fasta file, or an empty dictionary if it has no up to date index.
+    '''
+    indexfile = fastafile + '.fai'
+    if fastafile == '-' or not os.path.exists(indexfile) or os.path.getmtime(indexfile) < os.path.getmtime(fastafile):
+        return {}
+    return {name: entry[0] for name, entry in readFASTAindex(indexfile).items()}
+
+
+def _sequence_windows(dnaseq, chunksize):
+    '''
+    Yields the (start, window) windows of a whole sequence, each window holding chunksize bases plus the first 2 bases of the next one.
+    '''
+    length = len(dnaseq)
+    start = 0
+    while start == 0 or start + 2 < length:
+        yield start, str(dnaseq[start:start + chunksize + 2])
+        start += chunksize
+
+
+def _piece_windows(pieces, chunksize):
+    '''
+    Yields the (start, window) windows of a sequence given as an iterable of consecutive pieces, as _sequence_windows does.
+    '''
+    start = 0
+    buffer = []  # pieces not yielded yet, joined once they hold a window
+    buffered = 0
+    for piece in pieces:
+        piece = str(piece)
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= chunksize + 2:
+            seq = ''.join(buffer)
+            offset = 0
+            while buffered - offset >= chunksize + 2:
+                yield start, seq[offset:offset + chunksize + 2]
+                offset += chunksize
+                start += chunksize
+            buffer = [seq[offset:]]
+            buffered -= offset
+    seq = ''.join(buffer)
+    if start == 0 or buffered > 2:
+        yield start, seq
+
+
+def _chunked_orfs(windows, minlength, starts, chunksize, processes, record_length):
+    '''
+    Scans (header, start, window) windows with _scan_window and joins ORFs across them, yielding (header, ORF) tuples.
+    A window starting at 0 begins a new record. Each record keeps, for every strand and phase, the ORF open at the end of the windows read so far.
+    record_length(header) returns the sequence length of a record, or None if it is not known. Reverse ORFs of records of known length
+    are yielded with the forward ORFs of each window, those of other records are kept in found and yielded by _finish_record.
+    '''
+    if chunksize < 3 or chunksize % 3:
+        raise ValueError('chunksize must be a positive multiple of 3')
+    start_codons = tuple(codon_index(codon) for codon in starts)
+
+    header = None
+    length = 0
+    for window_header, start, size, summary in _scan_windows(windows, start_codons, minlength, processes):
+        if start == 0:
+            if header is not None:
+                yield from _finish_record(header, length, expected, found, reverse, minlength)
+            header = window_header
+            forward = [None] * 3  # open forward ORF of each phase, as (start, amino acid pieces)
+            reverse = [None] * 3  # last reverse stop of each phase, as (stop, amino acid pieces, rightmost start)
+            found = []  # reverse ORFs waiting for the length of the record
+            expected = record_length(header)
+            frames = _reverse_frames(expected) if expected is not None else None
+        length = start + size
+
+        for phase, (first_stop, head, head_orf, complete, tail_start, tail) in enumerate(summary[0]):
+            frame = 'f' + str(phase + 1)
+            if first_stop is not None:
+                if forward[phase] is not None:
+                    # Closing the ORF opened in an earlier window
+                    orf_start, pieces = forward[phase]
+                    protein = ''.join(pieces) + head
+                    head_orf = (orf_start, first_stop + 3, (first_stop - orf_start) // 3, 'M' + protein[1:])
+                if head_orf is not None and head_orf[2] >= minlength:
+                    yield header, ORF(frame, *head_orf)
+                for orf in complete:
+                    yield header, ORF(frame, *orf)
+                forward[phase] = (tail_start, [tail]) if tail_start is not None else None
+            elif forward[phase] is not None:
+                forward[phase][1].append(head)
+            elif tail_start is not None:
+                forward[phase] = (tail_start, [tail])
+
+        for phase, (first_stop, head, head_start, complete, last_stop, tail, tail_start) in enumerate(summary[1]):
+            if reverse[phase] is not None:
+                stop, pieces, orf_start = reverse[phase]
+                pieces.append(head)
+                if head_start is not None:
+                    orf_start = head_start
+                reverse[phase] = (stop, pieces, orf_start)
+                if first_stop is not None:
+                    found.extend(_reverse_orf(phase, reverse[phase], minlength))
+            found.extend((phase, orf) for orf in complete)
+            if first_stop is not None:
+                reverse[phase] = (last_stop, [tail], tail_start)
+
+        if frames is not None:
+            for phase, fields in found:
+                yield header, ORF(frames[phase], *fields)
+            found = []
+
+    if header is not None:
+        yield from _finish_record(header, length, expected, found, reverse, minlength)
+
+
+def _reverse_orf(phase, state, minlength):
+    '''
+    Returns the reverse ORF ending at a reverse stop codon (the left end of the ORF on the forward strand) as a list of at most one (phase, ORF fields) tuple.
+    state is (stop, amino acid pieces following the stop on the forward strand, start of the ORF or None).
+    '''
+    stop, pieces, orf_start = state
+    if orf_start is None or (orf_start - stop) // 3 < minlength:
+        return []
+    codons = (orf_start - stop) // 3
+    protein = 'M' + ''.join(pieces)[:codons - 1][::-1]
+    return [(phase, (stop, orf_start + 3, codons, protein))]
+
+
+def _finish_record(header, length, expected, found, reverse, minlength):
+    '''
+    Yields the reverse ORFs of a record left at its end: the ORF ending at the last reverse stop of each phase,
+    and the reverse ORFs kept in found when the length of the record was not known, which are yielded in the order of findORFs.
+    found holds (phase, ORF fields) tuples. A ValueError is raised if the record length given beforehand, expected, is not its length.
+    '''
+    if expected is not None and expected != length:
+        raise ValueError(f'Sequence {header!r} has {length} bases, {expected} were expected')
+    for phase, state in enumerate(reverse):
+        if state is not None:
+            found.extend(_reverse_orf(phase, state, minlength))
+    frames = _reverse_frames(length)
+    found.sort(key=lambda item: (frames[item[0]], -item[1][0]))
+    for phase, fields in found:
+        yield header, ORF(frames[phase], *fields)
+
+
+def _reverse_frames(length):
+    '''
+    Returns the reverse frame names of the three phases of a sequence of the given length.
+    A reverse codon starting at position x is in reading frame r1, r2 or r3 for (length - x) % 3 = 0, 1 or 2.
+    '''
+    return ['r' + str((length - phase) % 3 + 1) for phase in range(3)]
+
+
+def _scan_windows(windows, start_codons, minlength, processes):
+    '''
+    Scans (header, start, window) windows with _scan_window and yields (header, start, window length, summary) in window order.
+    With more than one process at most a few windows per worker are in flight, so windows are read lazily and memory stays proportional to the window size.
+    '''
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1:
+        for header, start, window in windows:
+            yield header, start, len(window), _scan_window((window, start, start_codons, minlength))
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for header, start, window in windows:
+            pending.append((header, start, len(window), executor.submit(_scan_window, (window, start, start_codons, minlength))))
+            if len(pending) >= processes * 2:
+                header, start, size, future = pending.popleft()
+                yield header, start, size, future.result()
+        while pending:
+            header, start, size, future = pending.popleft()
+            yield header, start, size, future.result()
+
+
+def _scan_window(task):
+    '''
+    Scans one window of a sequence for findORFsChunked. task is (window, start, start codon indices, minlength), where start is a multiple of 3.
+    Codons starting in the window (all but its last 2 bases, which begin the next window) are read in the three phases of the forward strand and,
+    as reverse complement codons at the same positions, of the reverse strand. Positions are nucleotide coordinates on the forward strand.
+
+    Returns (forward, reverse), one summary per phase. ORFs lying within the window are complete, the ends of the window are left to be joined with the neighbouring windows:
+    forward  (first stop, amino acids before it, ORF ending at it if no ORF is open before the window, complete ORFs,
+              first start after the last stop, amino acids from that start). Without stops, the amino acids before the first stop are those of the whole window.
+    reverse  (first stop, amino acids before it, rightmost start before it, complete ORFs,
+              last stop, amino acids after it, rightmost start after it). A reverse ORF ends at the stop on its left and starts at the rightmost start before the next stop.
+    '''
+    window, start, start_codons, minlength = task
+    codes = encode(window)
+    strands = (codon_indices(codes), codon_indices(reverse_complement(codes))[::-1])
+
+    summary = ([], [])
+    for strand, (indices, found) in enumerate(zip(strands, summary)):
+        for phase in range(3):
+            frame_indices = indices[phase::3]
+            aa = amino_acids(frame_indices).upper()
+            stop_pos = np.flatnonzero(np.isin(frame_indices, STOP_CODONS))
+            start_pos = np.flatnonzero(np.isin(frame_indices, start_codons))
+            first = start + phase
+
+            # Number of stops before each start, starts in group 0 are before the first stop and those in group len(stop_pos) after the last
+            group = np.searchsorted(stop_pos, start_pos)
+            inside = (group > 0) & (group < len(stop_pos))
+            head = aa[:stop_pos[0]] if len(stop_pos) else aa
+            complete = []
+
+            if strand == 0:
+                # Forward ORFs begin at the first start after a stop and end at the next stop
+                groups, index = np.unique(group[inside], return_index=True)
+                for s, e in zip(start_pos[inside][index].tolist(), stop_pos[groups].tolist()):
+                    if e - s >= minlength:
+                        complete.append((first + 3 * s, first + 3 * (e + 1), e - s, 'M' + aa[s + 1:e]))
+                head_orf = None
+                if len(stop_pos) and len(start_pos) and group[0] == 0:
+                    s, e = int(start_pos[0]), int(stop_pos[0])
+                    head_orf = (first + 3 * s, first + 3 * (e + 1), e - s, 'M' + aa[s + 1:e])
+                tail = start_pos[group == len(stop_pos)]
+                tail_start = int(tail[0]) if len(tail) else None
+                found.append((first + 3 * int(stop_pos[0]) if len(stop_pos) else None, head, head_orf, complete,
+                              first + 3 * tail_start if tail_start is not None else None, aa[tail_start:] if tail_start is not None else ''))
+            else:
+                # Reverse ORFs end at a stop and begin at the rightmost start before the next stop on its right
+                groups, index = np.unique(group[inside][::-1], return_index=True)
+                for e, s in zip(stop_pos[groups - 1].tolist(), start_pos[inside][::-1][index].tolist()):
+                    if s - e >= minlength:
+                        complete.append((first + 3 * e, first + 3 * (s + 1), s - e, 'M' + aa[e + 1:s][::-1]))
+                head_starts = start_pos[group == 0]
+                tail_starts = start_pos[group == len(stop_pos)] if len(stop_pos) else start_pos[:0]
+                last_stop = int(stop_pos[-1]) if len(stop_pos) else None
+                found.append((first + 3 * int(stop_pos[0]) if len(stop_pos) else None, head,
+                              first + 3 * int(head_starts[-1]) if len(head_starts) else None, complete,
+                              first + 3 * last_stop if last_stop is not None else None, aa[last_stop + 1:] if last_stop is not None else '',
+                              first + 3 * int(tail_starts[-1]) if len(tail_starts) else None))
+
+    return summary
+
+
+def _found_order(orf):
+    '''
+    Returns the position of an ORF in the order of findORFs, frame by frame then in reading order.
+    '''
+    return frame_list_names.index(orf.frame), orf.start if orf.frame[0] == 'f' else -orf.start
+
+
+@instrument('orf.longestORF', lambda args, kwargs, result: sequence_argument(args, kwargs, result) if args and hasattr(args[0], '__len__') else (0, 1))
+def longestORF(dnaseq, minlength=0, starts=('ATG',), chunksize=None, processes=1):
+    '''
+    Returns the longest open reading frame found by findORFs in any of the six reading frames as an ORF tuple.
+    Ties are won by the ORF found first by findORFs. None is returned if there are no open reading frames.
+    With chunksize set, the sequence is scanned with findORFsChunked in windows of chunksize bases across processes worker processes,
+    and dnaseq may also be an iterable of consecutive pieces of the sequence.
+    '''
+    if chunksize is None:
+        orfs = findORFs(dnaseq, minlength, starts)
+    else:
+        orfs = findORFsChunked(dnaseq, minlength, starts, chunksize, processes)
+    return selectLongestORF(orfs)
+
+
+def selectLongestORF(orfs):
+    '''
+    Returns the longest of an iterable of ORF tuples, such as the ORFs of one record yielded by scanORFs, or None if there are none.
+    Ties are won by the ORF found first by findORFs, whatever the order of the iterable, so the result is the same as longestORF.
+    '''
+    longest = None
+    for orf in orfs:
+        if longest is None or orf.length > longest.length or (orf.length == longest.length and _found_order(orf) < _found_order(longest)):
+            longest = orf
+    return longest
+
+
+@instrument('orf.candidateProtein', lambda args, kwargs, result: sequence_argument(args, kwargs, result) if args and hasattr(args[0], '__len__') else (0, 1))
+def candidateProtein(dnaseq, starts=('ATG',), chunksize=None, processes=1):
+    '''
+    Returns the longest Open reading frame in a DNA sequence.
+    All six reading frames are searched and the longest amino acid sequence between a start codon and a stop codon is returned.
+    An IndexError is raised if the sequence contains no open reading frame.
+    chunksize and processes scan long sequences in windows as in longestORF.
+    '''
+    longest = longestORF(dnaseq, starts=starts, chunksize=chunksize, processes=processes)
+    if longest is None:
+        raise IndexError('No open reading frames found')
+    return longest.protein
+
+
+@instrument('orf.maximalORF')
+def maximalORF(inputfile, outputfile, proteinname, minlength=0, starts=('ATG',)):
+    '''
+    Takes an input of a file containing a string of DNA and outputs a fasta file in of the longest Open reading frame in the sequence.
+    All six reading frames are searched using findORFs. minlength and starts are passed on to findORFs.
+    If no open reading frame is found an error is printed and a fasta file with an empty sequence is written.
     '''
 
     # Reading input file
@@ -73,13 +443,11 @@ def maximalORF(inputfile, outputfile, proteinname):
 
     # Getting the longest amino acid sequence from dna sequence extracted from file
     candidate = ''
-    try:
-        candidate = candidateProtein(dnaseq)
-    except IndexError:
-        print("Error: No ORFs found (IndexError).")
-
-    # This is the string to write to output file
+    longest = longestORF(dnaseq, minlength, starts)
+    if longest is None:
+        print("Error: No ORFs found.")
+    else:
+        candidate = longest.protein
 
     # Writing to outputfile
     writeFASTA(candidate, proteinname, outputfile)
-
@@ -0,0 +1,187 @@
+import numpy as np
+
+# Nucleotides are stored as A=0, C=1, G=2, T=3, the same codes used by bioseq.translation.encode
+NUCLEOTIDES = 'ACGT'
+UNKNOWN = 4
+
+# Lookup table from ASCII code to nucleotide code, every other character is unknown
+_CODES = np.full(256, UNKNOWN, dtype=np.uint8)
+for _code, _base in enumerate(NUCLEOTIDES):
+    _CODES[ord(_base)] = _code
+    _CODES[ord(_base.lower())] = _code
+
+# Complements of IUPAC ambiguity codes, other characters are their own complement
+_AMBIGUITY_COMPLEMENT = {'R': 'Y', 'Y': 'R', 'K': 'M', 'M': 'K', 'B': 'V', 'V': 'B', 'D': 'H', 'H': 'D'}
+
+# Number of characters packed at a time by from_chunks, a multiple of 8 so packed bases and mask bits stay byte aligned
+_PACK_BLOCK = 1 << 20
+
+
+class PackedDNA:
+    '''
+    Class stores a DNA sequence at 2 bits per base, 4 bases per byte in a NumPy buffer.
+    Bases other than A, C, G and T are flagged in a side mask of 1 bit per base. They are read back as 'N', except other characters
+    (such as IUPAC ambiguity codes) which are kept in a small dictionary of {position: character}. Sequences are stored in upper case.
+
+    Slicing with step 1 and reverse_complement() return views which share the buffers of the original sequence, so they do not copy any data.
+    str() decodes a sequence or view to a string and codes() returns it as an array of nucleotide codes (A=0, C=1, G=2, T=3, 4 for anything else).
+    translate(), findORFs() and candidateProtein() accept PackedDNA sequences directly.
+    '''
+
+    def __init__(self, sequence=''):
+        packed = PackedDNA.from_chunks([sequence])
+        self._data = packed._data
+        self._mask = packed._mask
+        self._other = packed._other
+        self._start = 0
+        self._stop = packed._stop
+        self._reverse = False
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        '''
+        Builds a PackedDNA sequence from an iterable of strings which are concatenated, for example the sequence lines of a fasta file.
+        Chunks are packed as they arrive, so the full sequence is never held as a string.
+        '''
+        data = []
+        mask = []
+        other = {}
+        buffer = []
+        buffered = 0
+        length = 0
+
+        def pack(text):
+            # Packing a piece of sequence whose length is a multiple of 8 (except the last one)
+            raw = np.frombuffer(text.encode('ascii', 'replace'), dtype=np.uint8)
+            codes = _CODES[raw]
+            unknown = codes == UNKNOWN
+
+            # Recording ambiguity characters other than N
+            for position in np.flatnonzero(unknown).tolist():
+                character = text[position].upper()
+                if character != 'N':
+                    other[length + position] = character
+
+            padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+            padded[:len(codes)] = np.where(unknown, 0, codes)
+            quads = padded.reshape(-1, 4)
+            data.append((quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3])
+            mask.append(np.packbits(unknown))
+
+        for chunk in chunks:
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= _PACK_BLOCK:
+                text = ''.join(buffer)
+                cut = len(text) - len(text) % 8
+                pack(text[:cut])
+                length += cut
+                buffer = [text[cut:]]
+                buffered = len(buffer[0])
+
+        text = ''.join(buffer)
+        pack(text)
+        length += len(text)
+
+        sequence = cls.__new__(cls)
+        sequence._data = np.concatenate(data) if data else np.zeros(0, dtype=np.uint8)
+        sequence._mask = np.concatenate(mask) if mask else np.zeros(0, dtype=np.uint8)
+        sequence._other = other
+        sequence._start = 0
+        sequence._stop = length
+        sequence._reverse = False
+        return sequence
+
+    def _view(self, start, stop, reverse):
+        '''
+        Returns a view of positions start to stop of the underlying buffers, reverse complemented if reverse is True.
+        '''
+        view = PackedDNA.__new__(PackedDNA)
+        view._data = self._data
+        view._mask = self._mask
+        view._other = self._other
+        view._start = start
+        view._stop = stop
+        view._reverse = reverse
+        return view
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('PackedDNA only supports slices with a step of 1')
+            stop = max(start, stop)
+            if self._reverse:
+                return self._view(self._stop - stop, self._stop - start, True)
+            return self._view(self._start + start, self._start + stop, False)
+
+        # Single base
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('PackedDNA index out of range')
+        return str(self[key:key + 1])
+
+    def __str__(self):
+        letters = np.frombuffer(b'ACGTN', dtype=np.uint8)[self.codes()]
+        sequence = letters.tobytes().decode('ascii')
+        if not self._other:
+            return sequence
+
+        # Restoring ambiguity characters other than N
+        characters = list(sequence)
+        for position, character in self._other.items():
+            if self._start <= position < self._stop:
+                if self._reverse:
+                    characters[self._stop - 1 - position] = _AMBIGUITY_COMPLEMENT.get(character, character)
+                else:
+                    characters[position - self._start] = character
+        return ''.join(characters)
+
+    def __repr__(self):
+        preview = str(self[:20]) + ('...' if len(self) > 20 else '')
+        return f"PackedDNA('{preview}', length={len(self)})"
+
+    @property
+    def nbytes(self):
+        '''
+        Number of bytes used by the buffers shared by this sequence and its views.
+        '''
+        return self._data.nbytes + self._mask.nbytes
+
+    def codes(self):
+        '''
+        Returns the sequence as a NumPy array of nucleotide codes, A=0, C=1, G=2, T=3 and 4 for anything else.
+        '''
+        start, stop = self._start, self._stop
+        if start >= stop:
+            return np.zeros(0, dtype=np.uint8)
+
+        # Unpacking the bytes covering the view
+        first = start // 4
+        packed = self._data[first:-(-stop // 4)]
+        codes = np.empty((len(packed), 4), dtype=np.uint8)
+        codes[:, 0] = packed >> 6
+        codes[:, 1] = (packed >> 4) & 3
+        codes[:, 2] = (packed >> 2) & 3
+        codes[:, 3] = packed & 3
+        codes = codes.ravel()[start - first * 4:stop - first * 4]
+
+        # Flagging unknown bases from the mask
+        first = start // 8
+        unknown = np.unpackbits(self._mask[first:-(-stop // 8)])[start - first * 8:stop - first * 8]
+        codes[unknown.astype(bool)] = UNKNOWN
+
+        if self._reverse:
+            codes = np.where(codes == UNKNOWN, UNKNOWN, 3 - codes)[::-1].astype(np.uint8)
+        return codes
+
+    def reverse_complement(self):
+        '''
+        Returns the reverse complement of the sequence as a view, without copying.
+        '''
+        return self._view(self._start, self._stop, not self._reverse)
+
@@ -0,0 +1,210 @@
+'''
+Runtime instrumentation of the bioseq stages.
+
+Public functions of fasta, translation, orf, alignment, composition and distance are decorated with instrument().
+While profiling is disabled (the default) a decorated function only checks one flag before calling the original function.
+Once enabled, every call records its wall time and the bytes and sequences it processed under the name of its stage, for example 'translation.translate'.
+Times are inclusive, a stage that calls another stage also counts the time spent in it. Statistics are kept per process.
+
+    from bioseq import profiling
+
+    with profiling.enabled():
+        maximalORF('genome.fasta', 'protein.fasta', 'protein')
+    print(profiling.summary())
+    profiling.to_json('profile.json')
+'''
+import functools
+import inspect
+import json
+import time
+from contextlib import contextmanager
+
+_enabled = False
+
+# Statistics of each stage, [calls, seconds, bytes, sequences]
+_stats = {}
+
+
+def enable():
+    '''
+    Starts recording statistics.
+    '''
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    '''
+    Stops recording statistics, statistics recorded so far are kept.
+    '''
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    '''
+    Removes all recorded statistics.
+    '''
+    _stats.clear()
+
+
+@contextmanager
+def enabled():
+    '''
+    Context manager recording statistics for the code inside the with block.
+    '''
+    previous = _enabled
+    enable()
+    try:
+        yield
+    finally:
+        if not previous:
+            disable()
+
+
+def record(stage, seconds, nbytes=0, sequences=0, calls=1):
+    '''
+    Adds a measurement to the statistics of a stage. Used by instrument(), and available to instrument other code.
+    '''
+    entry = _stats.get(stage)
+    if entry is None:
+        entry = _stats[stage] = [0, 0.0, 0, 0]
+    entry[0] += calls
+    entry[1] += seconds
+    entry[2] += nbytes
+    entry[3] += sequences
+
+
+def instrument(stage, measure=None):
+    '''
+    Decorator recording the calls of a function under the name stage while profiling is enabled.
+    measure is an optional function of (args, kwargs, result) returning the (bytes, sequences) processed by a call.
+    For generator functions the time spent producing each item is recorded, measure is called once for every item yielded (as result)
+    and once with result None when the generator is created.
+    '''
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not _enabled:
+                    return function(*args, **kwargs)
+                return _instrumented_generator(stage, measure, function, args, kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not _enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                result = function(*args, **kwargs)
+                seconds = time.perf_counter() - start
+                nbytes, sequences = measure(args, kwargs, result) if measure else (0, 0)
+                record(stage, seconds, nbytes, sequences)
+                return result
+        return wrapper
+    return decorator
+
+
+def _instrumented_generator(stage, measure, function, args, kwargs):
+    '''
+    Runs a generator function, recording the time spent inside it and what it yields.
+    '''
+    start = time.perf_counter()
+    nbytes, sequences = measure(args, kwargs, None) if measure else (0, 0)
+    generator = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                seconds += time.perf_counter() - start
+                break
+            seconds += time.perf_counter() - start
+            if measure:
+                item_bytes, item_sequences = measure(args, kwargs, item)
+                nbytes += item_bytes
+                sequences += item_sequences
+            yield item
+    finally:
+        generator.close()
+        record(stage, seconds, nbytes, sequences)
+
+
+def stats():
+    '''
+    Returns the recorded statistics as a dictionary of {stage: {'calls', 'seconds', 'bytes', 'sequences'}}.
+    '''
+    return {stage: {'calls': calls, 'seconds': seconds, 'bytes': nbytes, 'sequences': sequences}
+            for stage, (calls, seconds, nbytes, sequences) in _stats.items()}
+
+
+def summary():
+    '''
+    Returns the recorded statistics as a text table, slowest stage first.
+    '''
+    lines = [f"{'stage':<32}{'calls':>10}{'seconds':>12}{'bytes':>16}{'sequences':>12}"]
+    for stage, entry in sorted(stats().items(), key=lambda item: -item[1]['seconds']):
+        lines.append(f"{stage:<32}{entry['calls']:>10}{entry['seconds']:>12.4f}{entry['bytes']:>16}{entry['sequences']:>12}")
+    return '\n'.join(lines)
+
+
+def to_json(filename=None):
+    '''
+    Returns the recorded statistics as a JSON string, and writes it to filename if given.
+    '''
+    text = json.dumps(stats(), indent=2)
+    if filename is not None:
+        with open(filename, 'wt') as OUTF:
+            OUTF.write(text)
+    return text
+
+
+# Measure functions shared by the instrumented modules
+
+def sequence_argument(args, kwargs, result):
+    '''
+    Measure for functions whose first argument is one sequence.
+    '''
+    return (len(args[0]), 1) if args else (0, 1)
+
+
+def sequence_pair_argument(args, kwargs, result):
+    '''
+    Measure for aligners whose first argument is a tuple of two sequences.
+    '''
+    if not args:
+        return (0, 2)
+    return (len(args[0][0]) + len(args[0][1]), 2)
+
+
+def generator_sequence_argument(args, kwargs, result):
+    '''
+    Measure for generators whose first argument is one sequence, counted once when the generator is created.
+    '''
+    return sequence_argument(args, kwargs, result) if result is None else (0, 0)
+
+
+def sequence_result(args, kwargs, result):
+    '''
+    Measure for readers returning one sequence.
+    '''
+    return (len(result), 1) if result is not None else (0, 0)
+
+
+def rows_result(args, kwargs, result):
+    '''
+    Measure for functions returning a matrix or table with a row per sequence.
+    '''
+    return (getattr(result, 'nbytes', 0), len(result))
+
+
+def record_result(args, kwargs, result):
+    '''
+    Measure for generators yielding (header, sequence) records.
+    '''
+    return (len(result[1]), 1) if result is not None else (0, 0)
@@ -1,18 +1,40 @@
-from Bio.Align import substitution_matrices
+import numpy as np
+
+from bioseq._matrices import MATRICES
 
 class Scoring:
     '''
     Class loads a scoring matrix from the Biopython subsitituiton_matrices, name must be provided in the argument as a string.
+    The common BLOSUM and PAM matrices (see bioseq._matrices) are bundled and loaded without importing Biopython, as a dictionary in the custom matrix format.
+    Biopython is only imported for other names.
     It also accepts a custom substition matrix in type dictionary.
     Custom matrices must be in the format of {('res_1', 'res_2'): <score>, ('res_3', 'res_4'): <score>}. Where res_n stands for a 1-letter aminoacid code.
     Empty items in dictionary will default to a identity matrix. match=1, mismatch=0
-    One attribute is matrix described above.
-    One method, 'match('res1', 'res2')'. This returns the match score of the two residues using the given matrix
+    Attribute matrix is the matrix described above.
+
+    The matrix is compiled once into a dense 256 x 256 array indexed by the ASCII codes of two residues, applying the same mirror and identity rules as match().
+    Attribute array is the compiled NumPy array, integer if every score is a whole number and float otherwise.
+    Attribute table holds the same scores as nested python lists, table[ord(res1)][ord(res2)], which is the fastest lookup inside python loops.
+
+    Methods:
+    'match('res1', 'res2')' returns the match score of the two residues using the given matrix.
+    'encode(seq)' returns a sequence as an array of residue codes used to index array.
+    'score_pairs(seq1, seq2)' returns the scores of every aligned residue pair of two equal length sequences.
+    'profile(query)' returns the query profile, the score of each query residue against every residue code.
     '''
 
     def __init__(self, matrix):
-        if isinstance(matrix, str):
-            # Getting names of avalible matrices
+        if isinstance(matrix, str) and matrix in MATRICES:
+            self.matrix = _bundled_matrix(matrix)
+
+        elif isinstance(matrix, str):
+            # Importing Biopython only when a matrix that is not bundled is requested
+            try:
+                from Bio.Align import substitution_matrices
+            except ImportError:
+                raise ValueError(f"Matrix '{matrix}' is not bundled and Biopython is not installed. Bundled matrices are {list(MATRICES)}")
+
+            # Getting names of avaliable matrices
             avaliable = substitution_matrices.load()
 
             #
@@ -24,8 +46,39 @@ class Scoring:
         elif isinstance(matrix, dict):
             self.matrix = matrix
 
+        self.array = self._compile()
+        self.table = self.array.tolist()
+
+    def _compile(self):
+        '''
+        Builds the dense score array from the matrix.
+        Scores start as an identity matrix, then mirror pairs are filled in and finally the pairs found in the matrix, so that a pair
+        in the matrix wins over its mirror, which wins over the identity score, as in match().
+        Pairs that are not single ASCII characters cannot be looked up by code and are left to match().
+        '''
+        entries = []
+        for (res1, res2), value in self.matrix.items():
+            if len(res1) == 1 and len(res2) == 1 and ord(res1) < 256 and ord(res2) < 256:
+                entries.append((ord(res1), ord(res2), value))
+
+        integer = all(float(value).is_integer() for _, _, value in entries)
+        array = np.identity(256, dtype=np.int64 if integer else np.float64)
+
+        for code1, code2, value in entries:
+            array[code2, code1] = value
+        for code1, code2, value in entries:
+            array[code1, code2] = value
+
+        return array
+
     def match(self, res1, res2):
 
+        # Looking residues up in compiled table
+        try:
+            return self.table[ord(res1)][ord(res2)]
+        except (TypeError, IndexError):
+            pass
+
         query = (res1, res2)
         mirror = (res2, res1)
 
@@ -41,4 +94,40 @@ class Scoring:
         if query not in self.matrix:
             if res1 == res2:  # Residue pair is the same
                 return 1
-            return 0
\ No newline at end of file
+            return 0
+
+    def encode(self, seq):
+        '''
+        Returns a sequence as a NumPy array of residue codes (ASCII codes) used to index the compiled array.
+        Arrays are returned unchanged. Characters outside the first 256 code points are encoded as '?'.
+        '''
+        if isinstance(seq, np.ndarray):
+            return seq
+        return np.frombuffer(seq.encode('latin-1', 'replace'), dtype=np.uint8)
+
+    def score_pairs(self, seq1, seq2):
+        '''
+        Scores every aligned residue pair of two equal length sequences (strings or encoded arrays) in one operation.
+        Returns an array with the score of seq1[i] against seq2[i] at position i, sum it for the ungapped alignment score.
+        '''
+        codes1 = self.encode(seq1)
+        codes2 = self.encode(seq2)
+        if len(codes1) != len(codes2):
+            raise ValueError('Sequences must have the same length')
+        return self.array[codes1, codes2]
+
+    def profile(self, query):
+        '''
+        Returns the query profile of a sequence (string or encoded array), an array of shape (len(query), 256) where
+        profile[i, code] is the score of query[i] against the residue with that code.
+        Scoring a database sequence against the query is then profile[:, encode(target)].
+        '''
+        return self.array[self.encode(query)]
+
+
+def _bundled_matrix(name):
+    '''
+    Returns a bundled matrix as a dictionary of {('res_1', 'res_2'): score} covering every pair of its alphabet.
+    '''
+    alphabet, rows = MATRICES[name]
+    return {(res1, res2): score for res1, row in zip(alphabet, rows) for res2, score in zip(alphabet, row)}
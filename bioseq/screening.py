@@ -0,0 +1,155 @@
+'''
+Score-only alignment of one query against many sequences, for screening large sets of pairs before full alignment.
+
+alignment_scores computes the optimal local or global alignment score of the query against a whole batch of targets at once, without traceback.
+Targets are sorted by length, padded to a common length and stacked, and the Gotoh recurrences are evaluated one target column at a time
+as NumPy operations over every query position of every target in the batch:
+    M (match) and E (target residue aligned to a gap) only need the previous column, so they are computed for the whole column at once.
+    F (query residue aligned to a gap) depends on the cells above in the same column, F[i] = max over k < i of
+    (max(M[k], E[k]) - k * gap_extend) + gap_open + (i - 1) * gap_extend, which is a running maximum along the column (np.maximum.accumulate).
+    This replaces the lazy-F loop of striped SIMD aligners.
+Scores are computed from the query profile of the Scoring object, so each column is one fancy index into the profile.
+
+screen aligns with full traceback only the targets whose score reaches a threshold.
+'''
+import itertools
+
+import numpy as np
+
+from bioseq.batch import _run
+from bioseq.fasta import readFASTA, recordName
+from bioseq.profiling import instrument
+
+
+@instrument('screening.alignment_scores', lambda args, kwargs, result: (0, len(result)))
+def alignment_scores(query, targets, scoring, gap_open=-1, gap_extend=-1, mode='local', batch=1024):
+    '''
+    Returns the optimal alignment score of query against every sequence of targets as a NumPy array, in target order.
+    Scores are the same as the third element returned by local_align (mode='local', the default) or global_align (mode='global')
+    with the same Scoring object and gap penalties, a gap of length k scoring gap_open + (k - 1) * gap_extend.
+    Only scores are computed, no alignment is built, so memory is proportional to len(query) * batch.
+
+    Targets are processed in batches of batch sequences of similar length. The array is integer if every score of the Scoring matrix and
+    both gap penalties are whole numbers, float otherwise.
+    '''
+    if mode not in ['local', 'global']:
+        raise ValueError
+    if batch < 1:
+        raise ValueError('batch must be at least 1')
+
+    targets = list(targets)
+    # Query profile transposed, row c holds the score of every query position against residue code c
+    profile = scoring.profile(query.upper()).T.astype(np.float64)
+    scores = np.zeros(len(targets), dtype=np.float64)
+
+    # Batching targets of similar length together keeps padding small
+    lengths = np.array([len(target) for target in targets], dtype=np.int64)
+    order = np.argsort(lengths, kind='stable')
+    for start in range(0, len(targets), batch):
+        chunk = order[start:start + batch]
+        scores[chunk] = _batch_scores(profile, [targets[number] for number in chunk.tolist()], scoring,
+                                      float(gap_open), float(gap_extend), mode == 'local')
+
+    integer = np.issubdtype(scoring.array.dtype, np.integer) and float(gap_open).is_integer() and float(gap_extend).is_integer()
+    return scores.astype(np.int64) if integer else scores
+
+
+def _batch_scores(profile, targets, scoring, gap_open, gap_extend, local):
+    '''
+    Scores a query profile against a batch of targets, column by column over the padded targets.
+    Arrays have a row per target and a column per query position. As in alignment._gotoh, match is the best score of alignments ending with
+    a match, down ending with a query residue aligned to a gap and across ending with a target residue aligned to a gap.
+    Row 0 of the dynamic programming matrices (before the first query residue) is not stored, its value in each column is computed as top.
+    '''
+    m = profile.shape[1]
+    count = len(targets)
+    lengths = np.array([len(target) for target in targets], dtype=np.int64)
+    n = int(lengths.max()) if count else 0
+
+    # Alignments with an empty sequence, a single gap in global mode
+    if local:
+        best = np.zeros(count)
+    else:
+        other = np.where(lengths > 0, lengths, m)
+        best = np.where(other > 0, gap_open + (other - 1) * gap_extend, 0.0)
+    if m == 0 or n == 0:
+        return best
+
+    # Encoded targets, padded past their end with code 0 whose scores are never read
+    codes = np.zeros((count, n), dtype=np.intp)
+    for row, target in enumerate(targets):
+        codes[row, :len(target)] = scoring.encode(target.upper())
+
+    # Column 0, global alignments may begin with a gap of the first i query residues
+    decay = np.arange(m, dtype=np.float64) * gap_extend
+    match = np.full((count, m), -np.inf)
+    across = np.full((count, m), -np.inf)
+    if local:
+        down = np.full((count, m), -np.inf)
+    else:
+        down = np.broadcast_to(gap_open + decay, (count, m)).copy()
+
+    for j in range(n):
+        # Row 0 of columns j and j + 1 of the matrices, a gap of the first j target residues in global mode
+        if local:
+            top_previous, top = 0.0, -np.inf
+        else:
+            top_previous = 0.0 if j == 0 else gap_open + (j - 1) * gap_extend
+            top = gap_open + j * gap_extend
+
+        # Match or mismatch, from the best state of the cell up and to the left
+        diagonal = np.empty((count, m))
+        diagonal[:, 0] = top_previous
+        np.maximum(np.maximum(match[:, :-1], across[:, :-1]), down[:, :-1], out=diagonal[:, 1:])
+        if local:
+            np.maximum(diagonal, 0, out=diagonal)
+        diagonal += profile[codes[:, j]]
+
+        # Target residue aligned to a gap, from the cell to the left
+        np.maximum(np.maximum(match, down) + gap_open, across + gap_extend, out=across)
+        match = diagonal
+
+        # Query residue aligned to a gap, from the cells above in the same column. A vertical gap opened below row k scores
+        # open[k] + gap_open + (i - 1 - k) * gap_extend at row i, so down is a running maximum of open[k] - k * gap_extend along the column
+        down = np.empty((count, m))
+        down[:, 0] = top
+        np.maximum(match[:, :-1], across[:, :-1], out=down[:, 1:])
+        down[:, 1:] -= decay[1:]
+        np.maximum.accumulate(down, axis=1, out=down)
+        down += gap_open + decay
+
+        # Recording scores of targets ending in this column, local alignments end with a match
+        if local:
+            np.maximum(best, np.where(j < lengths, match.max(axis=1), 0), out=best)
+        else:
+            ending = np.flatnonzero(lengths == j + 1)
+            best[ending] = np.maximum(np.maximum(match[ending, -1], across[ending, -1]), down[ending, -1])
+
+    return best
+
+
+def screen(query, database, scoring, threshold, gap_open=-1, gap_extend=-1, mode='local', batch=1024, processes=1, **options):
+    '''
+    Screens a database for sequences aligning to query with a score of at least threshold, and aligns only those with full traceback.
+    database is the filename of a fasta file, read batch records at a time, or an iterable of (name, sequence) tuples.
+    Scores are computed with alignment_scores, passing pairs are aligned with local_align (mode='local') or global_align (mode='global').
+    This is a generator yielding (name, (aln1, aln2, score)) tuples in database order.
+    processes spreads the alignments of passing pairs over worker processes as in batch_align, other keyword arguments go to the aligner.
+    '''
+    if isinstance(database, str):
+        database = ((recordName(header), seq) for header, seq in readFASTA(database))
+    database = iter(database)
+
+    def passing():
+        # Scoring the database one batch at a time, yielding the alignment tasks of pairs above the threshold
+        while True:
+            records = list(itertools.islice(database, batch))
+            if not records:
+                return
+            scores = alignment_scores(query, [seq for _, seq in records], scoring, gap_open, gap_extend, mode, batch)
+            for (name, seq), score in zip(records, scores.tolist()):
+                if score >= threshold:
+                    yield name, (query, seq)
+
+    options = dict(options, gap_open=gap_open, gap_extend=gap_extend)
+    yield from _run(passing(), scoring, mode, processes, 16, True, options)
@@ -1,62 +1,183 @@
-def translate(dnaseq):
+import numpy as np
+
+from bioseq.packed import PackedDNA
+from bioseq.profiling import instrument, sequence_argument
+
+# Standard genetic code
+codon_dict = {
+    'TTT': 'F', 'TTC': 'F', 'TTA': 'L', 'TTG': 'L', 'TCT': 'S', 'TCC': 'S', 'TCA': 'S', 'TCG': 'S', 'TAT': 'Y',
+    'TAC': 'Y', 'TAA': '*', 'TAG': '*',
+    'TGT': 'C', 'TGC': 'C', 'TGA': '*', 'TGG': 'W', 'CTT': 'L', 'CTC': 'L', 'CTA': 'L', 'CTG': 'L', 'CCT': 'P',
+    'CCC': 'P', 'CCA': 'P', 'CCG': 'P',
+    'CAT': 'H', 'CAC': 'H', 'CAA': 'Q', 'CAG': 'Q', 'CGT': 'R', 'CGC': 'R', 'CGA': 'R', 'CGG': 'R', 'ATT': 'I',
+    'ATC': 'I', 'ATA': 'I', 'ATG': 'M',
+    'ACT': 'T', 'ACC': 'T', 'ACA': 'T', 'ACG': 'T', 'AAT': 'N', 'AAC': 'N', 'AAA': 'K', 'AAG': 'K', 'AGT': 'S',
+    'AGC': 'S', 'AGA': 'R', 'AGG': 'R',
+    'GTT': 'V', 'GTC': 'V', 'GTA': 'V', 'GTG': 'V', 'GCT': 'A', 'GCC': 'A', 'GCA': 'A', 'GCG': 'A', 'GAT': 'D',
+    'GAC': 'D', 'GAA': 'E', 'GAG': 'E',
+    'GGT': 'G', 'GGC': 'G', 'GGA': 'G', 'GGG': 'G'}
+
+frame_list_names = ['f1', 'f2', 'f3', 'r1', 'r2', 'r3']
+
+# Nucleotides are encoded as A=0, C=1, G=2, T=3. Every other character is encoded as 4 (unknown).
+NUCLEOTIDES = 'ACGT'
+UNKNOWN = 4
+
+# Lookup table from ASCII code to nucleotide code
+_NUCLEOTIDE_CODES = np.full(256, UNKNOWN, dtype=np.uint8)
+for _code, _base in enumerate(NUCLEOTIDES):
+    _NUCLEOTIDE_CODES[ord(_base)] = _code
+
+# Lookup table from nucleotide code to the code of its complement, unknown bases stay unknown
+_COMPLEMENT_CODES = np.array([3, 2, 1, 0, UNKNOWN], dtype=np.uint8)
+
+# Translation table used to complement DNA strings
+_COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+# Lookup table from codon index (first * 25 + second * 5 + third) to the ASCII code of its amino acid.
+# 125 entries cover the 64 codons plus every codon containing an unknown base, which translates to 'x'.
+_CODON_LOOKUP = np.full(125, ord('x'), dtype=np.uint8)
+for _codon, _aa in codon_dict.items():
+    _c1, _c2, _c3 = (NUCLEOTIDES.index(base) for base in _codon)
+    _CODON_LOOKUP[_c1 * 25 + _c2 * 5 + _c3] = ord(_aa)
+
+
+def amino_acids(indices):
+    '''
+    Translates an array of codon indices into a string of amino acids.
+    '''
+    return _CODON_LOOKUP[indices].tobytes().decode('ascii')
+
+
+def encode(dnaseq):
+    '''
+    Encodes a DNA string as a NumPy array of small integers, A=0, C=1, G=2, T=3 and 4 for anything else.
+    Input is converted to uppercase before encoding. PackedDNA sequences are unpacked directly.
+    '''
+    if isinstance(dnaseq, PackedDNA):
+        return dnaseq.codes()
+    raw = np.frombuffer(dnaseq.upper().encode('ascii', 'replace'), dtype=np.uint8)
+    return _NUCLEOTIDE_CODES[raw]
+
+
+def reverse_complement(codes):
+    '''
+    Returns the reverse complement of an encoded DNA sequence.
+    '''
+    return _COMPLEMENT_CODES[codes[::-1]]
+
+
+def codon_indices(codes):
+    '''
+    Returns the codon index (0-124) starting at every position of an encoded DNA sequence.
+    Codon n of reading frame k is found at position k + 3n, so all three frames of a strand are computed in one batch.
+    '''
+    codes = codes.astype(np.intp)
+    return codes[:-2] * 25 + codes[1:-1] * 5 + codes[2:]
+
+
+def codon_index(codon):
+    '''
+    Returns the codon index (0-124) of a three letter codon such as 'ATG'.
+    A ValueError is raised if the codon is not three of the letters A, C, G and T.
+    '''
+    codon = codon.upper()
+    if len(codon) != 3 or any(base not in NUCLEOTIDES for base in codon):
+        raise ValueError(f"'{codon}' is not a codon of A, C, G and T")
+    return NUCLEOTIDES.index(codon[0]) * 25 + NUCLEOTIDES.index(codon[1]) * 5 + NUCLEOTIDES.index(codon[2])
+
+
+# Codon indices of the stop codons
+STOP_CODONS = np.array([codon_index(codon) for codon, aa in codon_dict.items() if aa == '*'])
+
+
+@instrument('translation.translate', sequence_argument)
+def translate(dnaseq, engine='numpy'):
     '''
     Translates DNA into its corresponding amino acids in all possible reading frames.
-    One argument which must be a string of DNA.
-    '*' stand for stop codons. 'X' represent unknown amino acids.
+    One argument which must be a string of DNA or a PackedDNA sequence.
+    Frames 'f1', 'f2' and 'f3' read the sequence from its first, second and third base. Frames 'r1', 'r2' and 'r3' read the reverse complement in the same way.
+    '*' stand for stop codons. 'x' represent unknown amino acids.
+
+    Second argument chooses the translation engine, both return identical results.
+    There are two options: 'numpy' (default) which translates every frame through a lookup array in one batch, and 'python' which translates codon by codon.
     '''
 
     # ValueError raised if input is not a DNA string
-    if not isinstance(dnaseq, str):
+    if not isinstance(dnaseq, (str, PackedDNA)):
         raise ValueError('Argument must be a DNA sequence of type string')
 
-    # Making sure everything is upper case
-    dnaseq = dnaseq.upper()
+    if engine == 'numpy':
+        return _translate_numpy(dnaseq)
+    elif engine == 'python':
+        return _translate_python(dnaseq)
+    else:
+        raise ValueError(f"Unknown engine '{engine}'. Please select 'numpy' or 'python'")
+
+
+def _translate_numpy(dnaseq):
+    '''
+    NumPy translation engine used by translate().
+    The sequence is encoded once, the codon index at every position of each strand is computed in one batch,
+    and each frame is a strided view of those indices mapped through the codon lookup array.
+    '''
+    codes = encode(dnaseq)
+
+    # Creating reverse complement strand
+    strands = [codes, reverse_complement(codes)]
+
+    translated_list = []
+    for strand in strands:
+        indices = codon_indices(strand)
+        aa = _CODON_LOOKUP[indices]
+        for k in range(3):
+            frame = aa[k::3].tobytes().decode('ascii')
+
+            # A trailing incomplete codon translates to 'x', as in the python engine
+            if max(len(strand) - k, 0) % 3:
+                frame += 'x'
+            translated_list.append(frame)
+
+    # zip together list of frame list names and the translated sequence
+    possible_translations = dict(zip(frame_list_names, translated_list))
+
+    return (possible_translations)
+
+
+def _translate_python(dnaseq):
+    '''
+    Pure python translation engine used by translate().
+    '''
 
-    # Converting input string into a list
-    dnaseq = list(dnaseq)
+    # Making sure everything is an upper case string
+    dnaseq = str(dnaseq).upper()
 
     # Creating all possible forward reading frames
-    f1 = ''.join(dnaseq[0:])
-    f2 = ''.join(dnaseq[1:])
-    f3 = ''.join(dnaseq[2:])
+    f1 = dnaseq[0:]
+    f2 = dnaseq[1:]
+    f3 = dnaseq[2:]
 
-    # Creating copy of sequence and reversing it
-    rv_dnaseq = dnaseq.copy()
-    rv_dnaseq.reverse()
+    # Creating reverse complement of the sequence
+    rv_dnaseq = dnaseq[::-1].translate(_COMPLEMENT)
 
     # Creating all possible reverse reading frames
-    r1 = ''.join(rv_dnaseq[0:])
-    r2 = ''.join(rv_dnaseq[1:])
-    r3 = ''.join(rv_dnaseq[2:])
-
-    # Initialize codon dictionary
-    codon_dict = {
-        'TTT': 'F', 'TTC': 'F', 'TTA': 'L', 'TTG': 'L', 'TCT': 'S', 'TCC': 'S', 'TCA': 'S', 'TCG': 'S', 'TAT': 'Y',
-        'TAC': 'Y', 'TAA': '*', 'TAG': '*',
-        'TGT': 'C', 'TGC': 'C', 'TGA': '*', 'TGG': 'W', 'CTT': 'L', 'CTC': 'L', 'CTA': 'L', 'CTG': 'L', 'CCT': 'P',
-        'CCC': 'P', 'CCA': 'P', 'CCG': 'P',
-        'CAT': 'H', 'CAC': 'H', 'CAA': 'Q', 'CAG': 'Q', 'CGT': 'R', 'CGC': 'R', 'CGA': 'R', 'CGG': 'R', 'ATT': 'I',
-        'ATC': 'I', 'ATA': 'I', 'ATG': 'M',
-        'ACT': 'T', 'ACC': 'T', 'ACA': 'T', 'ACG': 'T', 'AAT': 'N', 'AAC': 'N', 'AAA': 'K', 'AAG': 'K', 'AGT': 'S',
-        'AGC': 'S', 'AGA': 'R', 'AGG': 'R',
-        'GTT': 'V', 'GTC': 'V', 'GTA': 'V', 'GTG': 'V', 'GCT': 'A', 'GCC': 'A', 'GCA': 'A', 'GCG': 'A', 'GAT': 'D',
-        'GAC': 'D', 'GAA': 'E', 'GAG': 'E',
-        'GGT': 'G', 'GGC': 'G', 'GGA': 'G', 'GGG': 'G'}
+    r1 = rv_dnaseq[0:]
+    r2 = rv_dnaseq[1:]
+    r3 = rv_dnaseq[2:]
 
     # Create list of frames
     frame_list = [f1, f2, f3, r1, r2, r3]
-    frame_list_names = ['f1', 'f2', 'f3', 'r1', 'r2', 'r3']
 
     # Translating dna sequence to amino acid sequences
     translated_list = []  # Creating list for translated sequences
     for seq in frame_list:  # looping through all DNA sequences
-        aaseq = ''  # Creating string for amino acid sequences
+        aaseq = []  # Creating list for amino acids, joined once the frame is complete
         for n in range(0, len(seq), 3):  # Moves through sequence 3 at a time
             rf = seq[n:n + 3]  # takes one codon at a time
-            aaseq += codon_dict.get(rf, 'x')  # Getting the amino acid based on codon
-        translated_list.append(aaseq)  # adding amino acid to list
+            aaseq.append(codon_dict.get(rf, 'x'))  # Getting the amino acid based on codon
+        translated_list.append(''.join(aaseq))  # adding amino acid sequence to list
 
     # zip together list of frame list names and the translated sequence
     possible_translations = dict(zip(frame_list_names, translated_list))
 
-    return (possible_translations)
\ No newline at end of file
+    return (possible_translations)
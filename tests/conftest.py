@@ -0,0 +1,17 @@
+import os
+import random
+import sys
+
+import pytest
+
+# Tests run against the source tree, the package is not installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def rng():
+    return random.Random(0)
+
+
+def random_sequence(rng, length, alphabet='ACGT'):
+    return ''.join(rng.choice(alphabet) for _ in range(length))
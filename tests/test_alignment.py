@@ -0,0 +1,44 @@
+import pytest
+
+from bioseq.alignment import global_align, local_align
+from bioseq.scoring import Scoring
+from conftest import random_sequence
+
+GAPS = [(-1, -1), (-11, -1), (-5, -2), (-2, -4)]
+
+
+def alignment_score(aln1, aln2, scoring, gap_open, gap_extend):
+    # Rescoring an alignment from its strings, a gap of length k scores gap_open + (k - 1) * gap_extend
+    score = 0
+    previous = None
+    for a, b in zip(aln1, aln2):
+        if a == '-' or b == '-':
+            state = 'up' if b == '-' else 'left'
+            score += gap_extend if state == previous else gap_open
+            previous = state
+        else:
+            score += scoring.match(a, b)
+            previous = None
+    return score
+
+
+@pytest.mark.parametrize('gap_open, gap_extend', GAPS)
+@pytest.mark.parametrize('align', [global_align, local_align])
+def test_linear_memory_matches_full_matrix(rng, align, gap_open, gap_extend):
+    scoring = Scoring('BLOSUM62')
+    for _ in range(20):
+        seq1 = random_sequence(rng, rng.randint(0, 40), 'ACDEFGHIKLMNPQRSTVWY')
+        seq2 = random_sequence(rng, rng.randint(0, 40), 'ACDEFGHIKLMNPQRSTVWY')
+        full = align([seq1, seq2], scoring, gap_open, gap_extend)
+        linear = align([seq1, seq2], scoring, gap_open, gap_extend, linear=True)
+        assert linear[2] == full[2]
+        assert alignment_score(linear[0], linear[1], scoring, gap_open, gap_extend) == full[2]
+
+
+def test_global_alignment_keeps_sequences(rng):
+    scoring = Scoring('BLOSUM62')
+    seq1 = random_sequence(rng, 60, 'ACDEFGHIKLMNPQRSTVWY')
+    seq2 = seq1[:20] + seq1[30:]
+    aln1, aln2, _ = global_align([seq1, seq2], scoring, -11, -1, linear=True)
+    assert aln1.replace('-', '') == seq1
+    assert aln2.replace('-', '') == seq2
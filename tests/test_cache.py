@@ -0,0 +1,52 @@
+import hashlib
+
+import pytest
+
+import bioseq.cache
+from bioseq.cache import ResultCache, sequence_digest
+from bioseq.orf import candidateProtein
+from bioseq.packed import PackedDNA
+from bioseq.translation import translate
+from conftest import random_sequence
+
+
+def test_digest_of_packed_sequences_and_views(rng, monkeypatch):
+    monkeypatch.setattr(bioseq.cache, 'DIGEST_CHUNK', 7)
+    for length in [0, 1, 7, 8, 100]:
+        seq = random_sequence(rng, length, 'ACGTNacgtR')
+        expected = hashlib.blake2b(seq.upper().encode('ascii'), digest_size=16).hexdigest()
+        assert sequence_digest(seq) == expected
+        assert sequence_digest(PackedDNA(seq)) == expected
+
+        view = PackedDNA(seq).reverse_complement()[1:]
+        assert sequence_digest(view) == sequence_digest(str(view))
+
+
+def test_cached_results(rng, tmp_path):
+    seq = random_sequence(rng, 300)
+    cache = ResultCache(maxsize=2, path=str(tmp_path))
+    for _ in range(3):
+        assert cache.translate(seq) == translate(seq)
+        assert cache.translate(seq.lower()) == translate(seq)
+    assert cache.stats()['misses'] == 1
+
+    # Results are shared through the disk store
+    other = ResultCache(path=str(tmp_path))
+    assert other.translate(PackedDNA(seq)) == translate(seq)
+    assert other.stats()['disk_hits'] == 1 and other.stats()['misses'] == 0
+
+
+def test_cached_frames_cannot_be_modified(rng):
+    seq = random_sequence(rng, 90)
+    cache = ResultCache()
+    cache.translate(seq)['f1'] = ''
+    cache.translate(seq).clear()
+    assert cache.translate(seq) == translate(seq)
+
+
+def test_candidate_protein_without_orfs():
+    cache = ResultCache()
+    assert cache.candidateProtein('CCATGAAATAGCC') == candidateProtein('CCATGAAATAGCC')
+    for _ in range(2):
+        with pytest.raises(IndexError):
+            cache.candidateProtein('CCCCCC')
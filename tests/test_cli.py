@@ -0,0 +1,28 @@
+import pytest
+
+from bioseq.cli import main
+
+
+def test_matrix_files_need_an_output_name(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    with open('profiles.csv', 'wt') as OUTF:
+        OUTF.write('#Filename,Polar,Small,Hydrophobic\na,0.1,0.2,0.3\nb,0.3,0.2,0.1\n')
+    for output_format in ['npy', 'condensed']:
+        with pytest.raises(SystemExit) as error:
+            main(['distance', 'profiles.csv', '-o', '-', '--format', output_format])
+        assert error.value.code == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['profiles.csv']
+
+    main(['distance', 'profiles.csv', '-o', '-'])
+    assert capsys.readouterr().out.startswith('# filename\ta\tb\n')
+
+
+@pytest.mark.parametrize('chunk_size', [None, '6'])
+def test_longest_orf_of_records_sharing_a_header(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.chdir(tmp_path)
+    with open('dna.fasta', 'wt') as OUTF:
+        OUTF.write('>a\nATGAAATAGATGAAAAAATAG\n>a\nATGCCCCCCCCCTAG\n>b\nCCC\n')
+    options = ['--chunk-size', chunk_size] if chunk_size else []
+    main(['orfs', 'dna.fasta', '--longest', '-o', 'proteins.fasta'] + options)
+    with open('proteins.fasta') as INFILE:
+        assert INFILE.read() == '>a_f1_9_21 length=3\nMKK\n>a_f1_0_15 length=4\nMPPP\n'
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from bioseq.composition import compositionProfile, profileColumns
+from conftest import random_sequence
+
+
+def brute_force_profile(sequences, k, alphabet):
+    columns = {kmer: number for number, kmer in enumerate(profileColumns(k, alphabet))}
+    profile = np.zeros((len(sequences), len(columns)))
+    for row, seq in enumerate(sequences):
+        seq = seq.upper()
+        for i in range(len(seq) - k + 1):
+            if seq[i:i + k] in columns:
+                profile[row, columns[seq[i:i + k]]] += 1
+    return profile
+
+
+@pytest.mark.parametrize('k', [1, 2, 3])
+def test_profile_matches_brute_force(rng, k):
+    sequences = [random_sequence(rng, rng.randint(0, 40), 'ACDEFGHIKLMNPQRSTVWYXacd') for _ in range(30)]
+    expected = brute_force_profile(sequences, k, 'ACDEFGHIKLMNPQRSTVWY')
+    assert np.array_equal(compositionProfile(sequences, k, normalise=False), expected)
+
+    # Chunking by residues or by counts does not change the result
+    assert np.array_equal(compositionProfile(sequences, k, normalise=False, chunk_residues=50), expected)
+    assert np.array_equal(compositionProfile(sequences, k, normalise=False, chunk_cells=1), expected)
+
+    frequencies = compositionProfile(sequences, k)
+    totals = expected.sum(axis=1, keepdims=True)
+    assert np.allclose(frequencies, np.divide(expected, totals, out=np.zeros_like(expected), where=totals > 0))
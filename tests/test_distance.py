@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from bioseq.distance import distanceMatrix, updateDistanceMatrix, readTable, writeTable, writeDistances, distanceArray
+
+
+def random_table(rng, names, columns=3):
+    return {name: tuple(round(rng.random(), 3) for _ in range(columns)) for name in names}
+
+
+def matrix_by_name(outputfile):
+    # Matrix entries keyed by pairs of names, so matrices in different row orders can be compared
+    keys = list(readTable(outputfile + '.keys.csv'))
+    matrix = np.load(outputfile + '.npy')
+    assert matrix.shape == (len(keys), len(keys))
+    return {(a, b): matrix[i, j] for i, a in enumerate(keys) for j, b in enumerate(keys)}
+
+
+def assert_same_as_fresh(tmp_path, metric):
+    fresh = str(tmp_path / 'fresh')
+    distanceMatrix(str(tmp_path / 'table.csv'), fresh, metric, output='npy')
+    updated = matrix_by_name(str(tmp_path / 'matrix'))
+    expected = matrix_by_name(fresh)
+    assert set(updated) == set(expected)
+    for pair, value in expected.items():
+        assert updated[pair] == pytest.approx(value, abs=1e-12)
+    assert readTable(str(tmp_path / 'matrix.keys.csv')) == readTable(fresh + '.keys.csv')
+
+
+@pytest.mark.parametrize('metric', ['l1', 'l2', 'cosine'])
+def test_update_matches_fresh_matrix(tmp_path, rng, metric):
+    tablefile = str(tmp_path / 'table.csv')
+    outputfile = str(tmp_path / 'matrix')
+    names = [f'p{number}' for number in range(40)]
+    table = random_table(rng, names)
+
+    # First update computes the matrix in full
+    writeTable(table, tablefile)
+    result = updateDistanceMatrix(tablefile, outputfile, metric, block=7)
+    assert result == {'added': names, 'changed': [], 'removed': []}
+    assert_same_as_fresh(tmp_path, metric)
+
+    # Appending entries
+    table.update(random_table(rng, [f'q{number}' for number in range(13)]))
+    writeTable(table, tablefile)
+    result = updateDistanceMatrix(tablefile, outputfile, metric, block=7)
+    assert len(result['added']) == 13 and not result['changed'] and not result['removed']
+    assert_same_as_fresh(tmp_path, metric)
+
+    # Changing, removing and adding entries at once
+    for name in ['p3', 'q5', 'p20']:
+        table[name] = tuple(round(rng.random(), 3) for _ in range(3))
+    for name in ['p0', 'p7', 'q12']:
+        del table[name]
+    table.update(random_table(rng, ['r0', 'r1']))
+    writeTable(table, tablefile)
+    result = updateDistanceMatrix(tablefile, outputfile, metric, block=7)
+    assert sorted(result['changed']) == ['p20', 'p3', 'q5']
+    assert sorted(result['removed']) == ['p0', 'p7', 'q12']
+    assert result['added'] == ['r0', 'r1']
+    assert_same_as_fresh(tmp_path, metric)
+
+    # Nothing to do
+    result = updateDistanceMatrix(tablefile, outputfile, metric, block=7)
+    assert result == {'added': [], 'changed': [], 'removed': []}
+    assert_same_as_fresh(tmp_path, metric)
+
+
+def test_update_keeps_table_header(tmp_path, rng):
+    tablefile = str(tmp_path / 'table.csv')
+    outputfile = str(tmp_path / 'matrix')
+    table = random_table(rng, ['a', 'b', 'c'], columns=4)
+    writeTable(table, tablefile, ['AA', 'AC', 'AD', 'AE'])
+    distanceMatrix(tablefile, outputfile, 'l1', output='npy')
+
+    table['d'] = (0.1, 0.2, 0.3, 0.4)
+    writeTable(table, tablefile, ['AA', 'AC', 'AD', 'AE'])
+    updateDistanceMatrix(tablefile, outputfile, 'l1')
+    with open(outputfile + '.keys.csv') as INFILE:
+        assert INFILE.readline() == '#Filename,AA,AC,AD,AE\n'
+
+
+@pytest.mark.parametrize('metric', ['l1', 'l2', 'cosine'])
+def test_dmf_rows_match_distance_array(tmp_path, metric):
+    profiles = np.random.default_rng(3).random((45, 4))
+    keys = [f'k{number}' for number in range(45)]
+    writeDistances(keys, profiles, str(tmp_path / 'matrix'), metric, block=4)
+    with open(str(tmp_path / 'matrix.dmf')) as INFILE:
+        assert INFILE.readline() == '# filename\t' + '\t'.join(keys) + '\n'
+        rows = [line.split() for line in INFILE]
+    assert [row[0] for row in rows] == keys
+    expected = distanceArray(profiles, metric)
+    assert np.abs(np.array([[float(value) for value in row[1:]] for row in rows]) - expected).max() <= 0.0005 + 1e-12
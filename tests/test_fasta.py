@@ -0,0 +1,97 @@
+import pytest
+
+from bioseq.fasta import FASTAIndex, buildFASTAindex, readFASTA, readFASTAchunks
+
+
+def random_records(rng, count=8):
+    # Mixed case records of various lengths, including empty ones and lengths that are multiples of the line width
+    records = []
+    for number in range(count):
+        linewidth = rng.randint(1, 12)
+        length = rng.choice([0, linewidth, 3 * linewidth, rng.randint(1, 80)])
+        records.append((f'seq{number} description {number}', ''.join(rng.choice('ACGTacgtN') for _ in range(length)), linewidth))
+    return records
+
+
+def write_fasta(path, records, newline, final_newline=True):
+    # Every record is wrapped at its own line width
+    lines = []
+    for header, seq, linewidth in records:
+        lines.append('>' + header)
+        lines.extend(seq[i:i + linewidth] for i in range(0, len(seq), linewidth))
+    text = newline.join(lines) + (newline if final_newline else '')
+    path.write_bytes(text.encode('ascii'))
+    return str(path)
+
+
+@pytest.fixture(params=[('\n', True), ('\r\n', True), ('\n', False), ('\r\n', False)], ids=['lf', 'crlf', 'lf-unterminated', 'crlf-unterminated'])
+def fasta(request, tmp_path, rng):
+    newline, final_newline = request.param
+    records = random_records(rng)
+    return write_fasta(tmp_path / 'test.fasta', records, newline, final_newline), records
+
+
+def test_readFASTA(fasta):
+    fastafile, records = fasta
+    assert list(readFASTA(fastafile, case='ORIGINAL')) == [(header, seq) for header, seq, _ in records]
+
+
+def test_fetch_matches_slices(rng, fasta):
+    fastafile, records = fasta
+    sequences = {header.split()[0]: seq for header, seq in readFASTA(fastafile, case='ORIGINAL')}
+    with FASTAIndex(fastafile) as index:
+        assert list(index) == list(sequences)
+        for name, seq in sequences.items():
+            assert index.length(name) == len(seq)
+            assert index.fetch(name, case='ORIGINAL') == seq
+            # Every slice of short records, random ones spanning any number of lines of the others
+            if len(seq) <= 20:
+                coordinates = [(start, end) for start in range(len(seq) + 1) for end in range(start, len(seq) + 2)]
+            else:
+                coordinates = [sorted([rng.randint(0, len(seq)), rng.randint(0, len(seq))]) for _ in range(200)]
+            for start, end in coordinates:
+                assert index.fetch(name, start, end, case='ORIGINAL') == seq[start:end]
+                assert index.fetch(name, start, end) == seq[start:end].upper()
+            assert index.fetch(name, len(seq) + 5, len(seq) + 10) == ''
+        with pytest.raises(KeyError):
+            index.fetch('missing')
+
+
+def test_reopened_index(fasta):
+    fastafile, records = fasta
+    built = buildFASTAindex(fastafile)
+    index = FASTAIndex(fastafile)
+    assert index.index == built
+    for header, seq, _ in records:
+        assert index.fetch(header.split()[0], 1, len(seq) - 1, case='ORIGINAL') == seq[1:len(seq) - 1]
+
+
+def test_uneven_lines_are_rejected(tmp_path):
+    fastafile = tmp_path / 'uneven.fasta'
+    fastafile.write_bytes(b'>a\nACGT\nAC\nACGT\n')
+    with pytest.raises(ValueError):
+        buildFASTAindex(str(fastafile))
+    fastafile.write_bytes(b'>a\nACGT\nACGTA\n')
+    with pytest.raises(ValueError):
+        buildFASTAindex(str(fastafile))
+
+
+@pytest.mark.parametrize('size, overlap', [(1, 0), (3, 2), (5, 0), (7, 3), (16, 16), (200, 5)])
+def test_chunks_match_slices(fasta, size, overlap):
+    fastafile, _ = fasta
+    expected = []
+    for header, seq in readFASTA(fastafile, case='ORIGINAL'):
+        # Windows start every size bases, the last one holds what remains and empty records yield one empty window
+        starts = range(0, max(len(seq) - overlap, 1), size)
+        expected.extend((header, start, seq[start:start + size + overlap]) for start in starts)
+    assert list(readFASTAchunks(fastafile, size, overlap, case='ORIGINAL')) == expected
+
+
+def test_chunks_of_long_lines(tmp_path, rng):
+    # Lines longer than the read limit of readFASTAchunks, split across reads
+    seq = ''.join(rng.choice('ACGT') for _ in range(200000))
+    fastafile = write_fasta(tmp_path / 'long.fasta', [('long', seq, len(seq)), ('short', 'ACGT', 4)], '\r\n')
+    chunks = list(readFASTAchunks(fastafile, 30000, 2))
+    assert [(header, start) for header, start, _ in chunks] == [('long', start) for start in range(0, len(seq) - 2, 30000)] + [('short', 0)]
+    assert ''.join(chunk[:30000] for header, _, chunk in chunks if header == 'long') == seq
+    assert all(chunk == seq[start:start + 30002] for header, start, chunk in chunks if header == 'long')
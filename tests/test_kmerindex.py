@@ -0,0 +1,66 @@
+import pytest
+
+from bioseq.kmerindex import KmerIndex
+from conftest import random_sequence
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def kmers(seq, k):
+    return {seq[i:i + k] for i in range(len(seq) - k + 1) if all(c in AMINO_ACIDS for c in seq[i:i + k])}
+
+
+def brute_force_search(records, query, k, top, min_shared):
+    # Counting shared distinct k-mers with sets, most shared first and ties in database order
+    query_kmers = kmers(query.upper(), k)
+    shared = [(name, len(query_kmers & kmers(seq.upper(), k))) for name, seq in records]
+    hits = [(number, name, count) for number, (name, count) in enumerate(shared) if count >= max(min_shared, 1)]
+    hits.sort(key=lambda hit: (-hit[2], hit[0]))
+    return [(name, count) for _, name, count in hits[:top]]
+
+
+@pytest.fixture
+def database(rng):
+    # Small alphabets give many shared k-mers and many ties
+    return [(f'seq{number}', random_sequence(rng, rng.randint(0, 80), AMINO_ACIDS[:rng.randint(3, 20)] + 'Xx'))
+            for number in range(150)]
+
+
+@pytest.mark.parametrize('k', [1, 2, 3])
+def test_search_matches_brute_force(tmp_path, rng, database, k):
+    index = KmerIndex.build(database, str(tmp_path / 'index'), k=k, batch=37)
+    for _ in range(20):
+        query = random_sequence(rng, rng.randint(0, 60), AMINO_ACIDS[:rng.randint(3, 20)])
+        for top, min_shared in [(10, 1), (None, 1), (5, 3)]:
+            assert index.search(query, top, min_shared) == brute_force_search(database, query, k, top, min_shared)
+
+
+def test_reopened_index(tmp_path, database):
+    KmerIndex.build(database, str(tmp_path / 'index'), k=2)
+    for mmap in [True, False]:
+        index = KmerIndex(str(tmp_path / 'index'), mmap=mmap)
+        assert len(index) == len(database)
+        for name, seq in database:
+            assert name in index
+            assert index.sequence(name) == seq.upper()
+        assert index.search(database[3][1], top=None) == brute_force_search(database, database[3][1], 2, None, 1)
+
+
+def test_duplicate_names(tmp_path):
+    with pytest.raises(ValueError):
+        KmerIndex.build([('a', 'ACD'), ('a', 'EFG')], str(tmp_path / 'index'))
+
+
+@pytest.mark.parametrize('k', [7, 14])
+def test_long_kmers(tmp_path, rng, database, k):
+    # 20 ** 14 k-mer codes, only those in the database are stored
+    index = KmerIndex.build(database, str(tmp_path / 'index'), k=k, batch=37)
+    assert len(index.offsets) == len(index.kmers) + 1 <= len(index.postings) + 1
+    for number in range(0, len(database), 10):
+        query = database[number][1]
+        assert index.search(query, top=None) == brute_force_search(database, query, k, None, 1)
+
+
+def test_k_too_large(tmp_path):
+    with pytest.raises(ValueError):
+        KmerIndex.build([('a', 'ACD')], str(tmp_path / 'index'), k=15)
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from bioseq.alignment import global_align
+from bioseq.msa import align_profiles, guide_tree, progressive_align
+from bioseq.scoring import Scoring
+from conftest import random_sequence
+from test_alignment import GAPS, alignment_score
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def random_distances(rng, n):
+    # Random symmetric distances, without ties
+    matrix = np.array([[rng.random() for _ in range(n)] for _ in range(n)])
+    matrix = (matrix + matrix.T) / 2
+    np.fill_diagonal(matrix, 0)
+    return matrix
+
+
+def clusters(merges, n):
+    # Leaves below each merge, in merge order
+    leaves = {number: frozenset([number]) for number in range(n)}
+    for step, (left, right) in enumerate(merges):
+        leaves[n + step] = leaves[left] | leaves[right]
+    return [leaves[n + step] for step in range(len(merges))]
+
+
+def naive_upgma(distances):
+    # Average linkage from the leaf distances of every pair of clusters
+    n = len(distances)
+    active = {number: [number] for number in range(n)}
+    merges = []
+    for step in range(n - 1):
+        pairs = [(np.mean([distances[a, b] for a in active[i] for b in active[j]]), i, j) for i in active for j in active if i < j]
+        _, i, j = min(pairs)
+        merges.append((i, j))
+        active[n + step] = active.pop(i) + active.pop(j)
+    return merges
+
+
+def naive_neighbour_joining(distances):
+    # Textbook neighbour joining, recomputing the row sums and the criterion of every pair at each join
+    n = len(distances)
+    d = {(i, j): distances[i, j] for i in range(n) for j in range(n)}
+    active = list(range(n))
+    merges = []
+    for step in range(n - 1):
+        r = len(active)
+        totals = {i: sum(d[i, j] for j in active) for i in active}
+        _, i, j = min(((r - 2) * d[i, j] - totals[i] - totals[j], i, j) for i in active for j in active if i < j)
+        merges.append((i, j))
+        node = n + step
+        active = [other for other in active if other not in (i, j)]
+        for other in active:
+            d[node, other] = d[other, node] = (d[i, other] + d[j, other] - d[i, j]) / 2
+        d[node, node] = 0
+        active.append(node)
+    return merges
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 8, 25])
+def test_upgma_matches_naive(rng, n):
+    distances = random_distances(rng, n)
+    assert clusters(guide_tree(distances, 'upgma'), n) == clusters(naive_upgma(distances), n)
+
+
+@pytest.mark.parametrize('n', [4, 5, 8, 25])
+def test_neighbour_joining_matches_naive(rng, n):
+    distances = random_distances(rng, n)
+    found = clusters(guide_tree(distances, 'nj'), n)
+    expected = clusters(naive_neighbour_joining(distances), n)
+    # With 4 clusters left the criterion ties for the two complementary pairs, which split the tree the same way,
+    # and with 3 left every pair ties, so only the joins before those are compared cluster by cluster
+    assert found[:n - 4] == expected[:n - 4]
+    everything = frozenset(range(n))
+    assert {found[n - 4], everything - found[n - 4]} == {expected[n - 4], everything - expected[n - 4]}
+
+
+def test_guide_tree_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        guide_tree(np.zeros((3, 3)), 'single')
+
+
+@pytest.mark.parametrize('tree', ['upgma', 'nj'])
+@pytest.mark.parametrize('processes', [1, 2])
+def test_rows_keep_their_sequences(rng, tree, processes):
+    scoring = Scoring('BLOSUM62')
+    base = random_sequence(rng, 60, AMINO_ACIDS)
+    records = []
+    for number in range(12):
+        # Related sequences with point mutations, insertions and deletions, and a lower case one
+        seq = list(base)
+        for _ in range(rng.randint(0, 10)):
+            position = rng.randrange(len(seq))
+            action = rng.choice(['mutate', 'insert', 'delete'])
+            if action == 'mutate':
+                seq[position] = rng.choice(AMINO_ACIDS)
+            elif action == 'insert':
+                seq.insert(position, random_sequence(rng, rng.randint(1, 5), AMINO_ACIDS))
+            else:
+                del seq[position]
+        records.append((f'seq{number}', ''.join(seq).lower() if number == 3 else ''.join(seq)))
+    records.append(('empty', ''))
+
+    aligned = progressive_align(records, scoring, tree=tree, processes=processes)
+    assert [name for name, _ in aligned] == [name for name, _ in records]
+    assert len({len(row) for _, row in aligned}) == 1
+    for (_, seq), (_, row) in zip(records, aligned):
+        assert row.replace('-', '') == seq.upper()
+    # No column is made of gaps only
+    assert all(any(row[column] != '-' for _, row in aligned) for column in range(len(aligned[0][1])))
+
+
+@pytest.mark.parametrize('gap_open, gap_extend', GAPS)
+def test_two_sequences_match_global_align(rng, gap_open, gap_extend):
+    scoring = Scoring('BLOSUM62')
+    for _ in range(20):
+        seq1 = random_sequence(rng, rng.randint(0, 40), AMINO_ACIDS)
+        seq2 = random_sequence(rng, rng.randint(0, 40), AMINO_ACIDS)
+        expected = global_align([seq1, seq2], scoring, gap_open, gap_extend)[2]
+
+        (_, aln1), (_, aln2) = progressive_align([('a', seq1), ('b', seq2)], scoring, gap_open, gap_extend)
+        assert alignment_score(aln1, aln2, scoring, gap_open, gap_extend) == expected
+        profiles = [np.frombuffer(seq.encode('ascii'), dtype=np.uint8).reshape(1, -1) for seq in (seq1, seq2)]
+        assert align_profiles(profiles[0], profiles[1], scoring, gap_open, gap_extend)[1] == pytest.approx(expected)
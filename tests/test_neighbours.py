@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from bioseq.neighbours import NeighbourIndex
+
+
+def brute_force(profiles, points, metric, k):
+    # 'l1' is the Euclidean distance and 'l2' the Manhattan distance, as in bioseq.distance
+    difference = points[:, None, :] - profiles[None, :, :]
+    if metric == 'l1':
+        distances = np.sqrt((difference ** 2).sum(axis=2))
+    else:
+        distances = np.abs(difference).sum(axis=2)
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(distances, order, 1), order
+
+
+@pytest.mark.parametrize('metric', ['l1', 'l2'])
+@pytest.mark.parametrize('features', [1, 3, 8])
+def test_kdtree_matches_brute_force(metric, features):
+    generator = np.random.default_rng(features)
+    profiles = generator.random((500, features))
+    points = generator.random((60, features))
+    index = NeighbourIndex(profiles, metric, method='kdtree', leaf_size=8)
+    for k in [1, 5, 20]:
+        distances, indices = index.query(points, k)
+        expected_distances, expected_indices = brute_force(profiles, points, metric, k)
+        assert np.allclose(distances, expected_distances)
+        assert np.array_equal(indices, expected_indices)
+
+
+@pytest.mark.parametrize('metric', ['l1', 'l2'])
+def test_kdtree_self_query_leaves_profiles_out(metric):
+    profiles = np.random.default_rng(0).random((200, 3))
+    distances, indices = NeighbourIndex(profiles, metric, method='kdtree', leaf_size=4).query(None, 6)
+    expected_distances, expected_indices = brute_force(profiles, profiles, metric, 7)
+    assert np.allclose(distances, expected_distances[:, 1:])
+    assert np.array_equal(indices, expected_indices[:, 1:])
+
+
+def test_fewer_profiles_than_k():
+    profiles = np.random.default_rng(1).random((3, 2))
+    distances, indices = NeighbourIndex(profiles, method='kdtree').query(profiles[:1], 5)
+    assert np.array_equal(indices[0, 3:], [-1, -1])
+    assert np.isinf(distances[0, 3:]).all()
+
+
+def test_rpforest_distances_are_exact(tmp_path):
+    # The approximate method may miss neighbours, but the distances it reports are exact and sorted
+    generator = np.random.default_rng(2)
+    profiles = generator.random((400, 40))
+    points = generator.random((30, 40))
+    index = NeighbourIndex(profiles, 'l1', method='rpforest')
+    distances, indices = index.query(points, 10)
+    assert np.allclose(distances, np.sqrt(((points[:, None, :] - profiles[indices]) ** 2).sum(axis=2)))
+    assert (np.diff(distances, axis=1) >= 0).all()
+
+    filename = str(tmp_path / 'index.npz')
+    index.save(filename)
+    _, loaded_indices = NeighbourIndex.load(filename).query(points, 10)
+    assert np.array_equal(loaded_indices, indices)
@@ -0,0 +1,98 @@
+import itertools
+
+import pytest
+
+from bioseq.fasta import readFASTA, buildFASTAindex
+from bioseq.orf import findORFs, findORFsChunked, scanORFs, longestORF, selectLongestORF
+from bioseq.packed import PackedDNA
+from conftest import random_sequence
+
+
+def orf_sequence(rng, length):
+    # Random DNA with frequent start and stop codons, so many ORFs cross window ends
+    pieces = []
+    while sum(map(len, pieces)) < length:
+        pieces.append(rng.choice(['ATG', 'TAA', 'TAG', 'TGA', 'GTG', random_sequence(rng, rng.randint(1, 12), 'ACGTN')]))
+    return ''.join(pieces)[:length]
+
+
+@pytest.mark.parametrize('chunksize', [3, 6, 9, 30, 300])
+def test_chunked_matches_findORFs(rng, chunksize):
+    for _ in range(30):
+        seq = orf_sequence(rng, rng.randint(0, min(40 * chunksize, 400)))
+        for starts, minlength in [(('ATG',), 0), (('ATG', 'GTG'), 3)]:
+            expected = list(findORFs(seq, minlength, starts))
+            assert sorted(findORFsChunked(seq, minlength, starts, chunksize)) == sorted(expected)
+            assert sorted(findORFsChunked(PackedDNA(seq), minlength, starts, chunksize)) == sorted(expected)
+
+            # Pieces of any length, such as fasta lines
+            pieces = [seq[start:start + 7] for start in range(0, len(seq), 7)]
+            assert sorted(findORFsChunked(iter(pieces), minlength, starts, chunksize)) == sorted(expected)
+
+
+def test_pieces_of_unknown_length(rng):
+    # Reverse ORFs wait for the end of the sequence and are then yielded in the order of findORFs
+    seq = orf_sequence(rng, 2000)
+    pieces = [seq[start:start + 50] for start in range(0, len(seq), 50)]
+    expected = [orf for orf in findORFs(seq) if orf.frame.startswith('r')]
+    assert [orf for orf in findORFsChunked(iter(pieces), chunksize=12) if orf.frame.startswith('r')] == expected
+
+    # With the length given they are yielded as they are found
+    assert sorted(findORFsChunked(iter(pieces), chunksize=12, length=len(seq))) == sorted(findORFs(seq))
+    with pytest.raises(ValueError):
+        list(findORFsChunked(iter(pieces), chunksize=12, length=len(seq) + 1))
+
+
+def test_reverse_orfs_are_not_held_until_the_end(rng):
+    seq = orf_sequence(rng, 3000)
+    orfs = findORFsChunked(seq, chunksize=300)
+    reverse = [orf for orf in itertools.islice(orfs, 60) if orf.frame.startswith('r')]
+    assert reverse and max(orf.start for orf in reverse) < 1500
+
+
+def test_chunksize_must_be_a_multiple_of_3():
+    with pytest.raises(ValueError):
+        list(findORFsChunked('ATGAAATAG', chunksize=10))
+
+
+def test_longest_orf(rng):
+    for _ in range(30):
+        seq = orf_sequence(rng, rng.randint(0, 300))
+        longest = longestORF(seq)
+        assert longestORF(seq, chunksize=9) == longest
+        assert selectLongestORF(reversed(list(findORFs(seq)))) == longest
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_scanORFs_matches_findORFs_per_record(tmp_path, rng, processes):
+    fastafile = str(tmp_path / 'genome.fasta')
+    with open(fastafile, 'wt') as OUTF:
+        for number in range(12):
+            seq = orf_sequence(rng, rng.randint(0, 500))
+            width = rng.choice([10, 60, 61])
+            OUTF.write(f'>chr{number} description\n')
+            OUTF.write(''.join(seq[start:start + width] + '\n' for start in range(0, len(seq), width)))
+
+    expected = [(header, orf) for header, seq in readFASTA(fastafile) for orf in findORFs(seq)]
+    lengths = {header.split()[0]: len(seq) for header, seq in readFASTA(fastafile)}
+    for options in [{}, {'lengths': lengths}]:
+        found = list(scanORFs(fastafile, chunksize=30, processes=processes, **options))
+        assert sorted(found) == sorted(expected)
+
+        # ORFs of a record are consecutive
+        headers = [header for header, _ in found]
+        assert headers == sorted(headers, key=lambda header: int(header.split()[0][3:]))
+
+
+def test_scanORFs_reads_lengths_from_index(tmp_path, rng):
+    fastafile = str(tmp_path / 'genome.fasta')
+    with open(fastafile, 'wt') as OUTF:
+        for number in range(3):
+            seq = orf_sequence(rng, 400 + number)
+            OUTF.write(f'>chr{number}\n' + ''.join(seq[start:start + 60] + '\n' for start in range(0, len(seq), 60)))
+    buildFASTAindex(fastafile)
+
+    expected = [(header, orf) for header, seq in readFASTA(fastafile) for orf in findORFs(seq)]
+    assert sorted(scanORFs(fastafile, chunksize=30)) == sorted(expected)
+    with pytest.raises(ValueError):
+        list(scanORFs(fastafile, chunksize=30, lengths={'chr0': 1, 'chr1': 401, 'chr2': 402}))
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from bioseq.packed import PackedDNA
+from conftest import random_sequence
+
+COMPLEMENT = str.maketrans('ACGTNRY', 'TGCANYR')
+
+
+def reverse_complement(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+@pytest.mark.parametrize('length', [0, 1, 3, 4, 7, 8, 9, 100, 1001])
+def test_round_trip(rng, length):
+    seq = random_sequence(rng, length, 'ACGTN')
+    packed = PackedDNA(seq)
+    assert len(packed) == length
+    assert str(packed) == seq
+
+
+def test_lower_case_and_ambiguity_codes_round_trip():
+    packed = PackedDNA('acgtRYKMnNacgtBDHVSW')
+    assert str(packed) == 'ACGTRYKMNNACGTBDHVSW'
+
+
+def test_from_chunks_matches_whole_sequence(rng):
+    seq = random_sequence(rng, 5000, 'ACGTNR')
+    chunks = [seq[start:start + 61] for start in range(0, len(seq), 61)]
+    assert str(PackedDNA.from_chunks(chunks)) == seq
+
+
+def test_slicing_matches_string(rng):
+    seq = random_sequence(rng, 203, 'ACGTNY')
+    packed = PackedDNA(seq)
+    for _ in range(200):
+        start = rng.randint(-250, 250)
+        stop = rng.randint(-250, 250)
+        assert str(packed[start:stop]) == seq[start:stop]
+    for position in [0, 1, 100, 202, -1, -203]:
+        assert packed[position] == seq[position]
+    with pytest.raises(IndexError):
+        packed[203]
+    with pytest.raises(ValueError):
+        packed[::2]
+
+
+def test_views_of_views(rng):
+    seq = random_sequence(rng, 300, 'ACGTNRY')
+    packed = PackedDNA(seq)
+    view = packed[17:250]
+    assert str(view[5:100]) == seq[17:250][5:100]
+    assert view._data is packed._data
+
+    reverse = packed.reverse_complement()
+    assert str(reverse) == reverse_complement(seq)
+    assert str(reverse[10:90]) == reverse_complement(seq)[10:90]
+    assert str(reverse[10:90].reverse_complement()) == seq[210:290]
+
+
+def test_codes(rng):
+    seq = random_sequence(rng, 123, 'ACGTN')
+    codes = PackedDNA(seq)[3:120].codes()
+    expected = np.array(['ACGTN'.index(base) for base in seq[3:120]], dtype=np.uint8)
+    assert np.array_equal(codes, expected)
+
+
+def test_memory_is_two_bits_per_base():
+    assert PackedDNA('ACGT' * 1000).nbytes == 1000 + 500
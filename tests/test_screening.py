@@ -0,0 +1,43 @@
+import pytest
+
+from bioseq.alignment import global_align, local_align
+from bioseq.scoring import Scoring
+from bioseq.screening import alignment_scores, screen
+from conftest import random_sequence
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+GAPS = [(-1, -1), (-11, -1), (-5, -2), (-2, -4), (-7.5, -0.5)]
+
+
+@pytest.fixture
+def targets(rng):
+    return [random_sequence(rng, rng.randint(0, 50), AMINO_ACIDS[:rng.randint(4, 20)]) for _ in range(60)]
+
+
+@pytest.mark.parametrize('gap_open, gap_extend', GAPS)
+@pytest.mark.parametrize('mode, align', [('local', local_align), ('global', global_align)])
+def test_scores_match_aligners(rng, targets, mode, align, gap_open, gap_extend):
+    scoring = Scoring('BLOSUM62')
+    for query in ['', 'W', random_sequence(rng, 30, AMINO_ACIDS), random_sequence(rng, 45, AMINO_ACIDS[:6])]:
+        scores = alignment_scores(query, targets, scoring, gap_open, gap_extend, mode, batch=16)
+        expected = [align([query, target], scoring, gap_open, gap_extend)[2] for target in targets]
+        assert scores.tolist() == pytest.approx(expected)
+
+
+def test_integer_scores():
+    scoring = Scoring('BLOSUM62')
+    assert alignment_scores('ACDE', ['ACD', 'WW'], scoring, -11, -1).dtype.kind == 'i'
+    assert alignment_scores('ACDE', ['ACD', 'WW'], scoring, -11.5, -1).dtype.kind == 'f'
+
+
+def test_screen_aligns_passing_targets(rng, targets):
+    scoring = Scoring('BLOSUM62')
+    query = targets[5]
+    database = [(f'seq{number}', target) for number, target in enumerate(targets)]
+    scores = alignment_scores(query, targets, scoring, -11, -1)
+    threshold = sorted(scores.tolist())[-10]
+
+    found = list(screen(query, database, scoring, threshold, -11, -1))
+    assert [name for name, _ in found] == [name for (name, _), score in zip(database, scores.tolist()) if score >= threshold]
+    for name, (_, _, score) in found:
+        assert score == local_align([query, dict(database)[name]], scoring, -11, -1)[2]
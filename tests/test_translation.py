@@ -0,0 +1,29 @@
+import pytest
+
+from bioseq.packed import PackedDNA
+from bioseq.translation import translate, frame_list_names
+from conftest import random_sequence
+
+
+@pytest.mark.parametrize('length', [0, 1, 2, 3, 4, 5, 10, 99, 100, 1001])
+def test_numpy_engine_matches_python_engine(rng, length):
+    for alphabet in ['ACGT', 'ACGTN', 'acgtRYN']:
+        seq = random_sequence(rng, length, alphabet)
+        assert translate(seq, 'numpy') == translate(seq, 'python')
+
+
+def test_frames():
+    frames = translate('ATGAAATAG')
+    assert list(frames) == frame_list_names
+    assert frames['f1'] == 'MK*'
+    assert frames['r1'] == translate('CTATTTCAT')['f1']
+
+
+def test_packed_input_matches_string(rng):
+    seq = random_sequence(rng, 500, 'ACGTN')
+    assert translate(PackedDNA(seq)) == translate(seq)
+
+
+def test_invalid_engine():
+    with pytest.raises(ValueError):
+        translate('ATG', 'fortran')